@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+"""
+Per-request cost of the pyrestful param conversion.
+
+Compares types.convert, which walks the issubclass chain for every
+value, with the converters compiled by config() for each operation.
+
+    $ python benchmarks/bench_convert.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pyrestful import types
+
+NUMBER = 200000
+
+# Params of /id/{key}{value} as they come from the url
+VALUES = [b'gQk3rAhHDDaZ', b'333']
+TYPES = [bytes, int]
+CONVERTERS = tuple(types.converter(t) for t in TYPES)
+
+
+def convert_before():
+    return [types.convert(v, TYPES[i]) for i, v in enumerate(VALUES)]
+
+
+def convert_after():
+    return [CONVERTERS[i](v) for i, v in enumerate(VALUES)]
+
+
+def main():
+    assert convert_before() == convert_after()
+    for name, func in (("types.convert", convert_before), ("compiled converters", convert_after)):
+        best = min(timeit.repeat(func, number=NUMBER, repeat=5))
+        print("%-20s %8.3f us/request" % (name, best / NUMBER * 1e6))
+
+if __name__ == '__main__':
+    main()
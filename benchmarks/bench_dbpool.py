@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+"""
+Database connection per request versus pooled connections, under a
+number of threads, with the pool statistics: connections opened, peak of
+connections in use and waits of a saturated pool.
+
+Against a stand-in server by default, whose connections cost a TCP
+handshake and AUTH_DELAY of authentication, and a round trip by query
+and by ping. Against MySQL when BENCH_MYSQL_HOST is set, with
+BENCH_MYSQL_USER, BENCH_MYSQL_PASSWORD and BENCH_MYSQL_DB.
+
+    $ python benchmarks/bench_dbpool.py
+"""
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from components.dbpool import DatabasePool
+
+THREADS = (1, 4, 16)
+REQUESTS = 400
+QUERIES = 3
+POOL_SIZE = 8
+# Seconds, the handshake of MySQL over TLS is a few ms
+AUTH_DELAY = 0.005
+
+
+class StandinServer:
+    """
+    Answers each line with a line, after AUTH_DELAY for the first one
+    """
+
+    def __init__(self):
+        self.sock = socket.socket()
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(128)
+        self.port = self.sock.getsockname()[1]
+        self.handlers = []
+        thread = threading.Thread(target=self.serve)
+        thread.daemon = True
+        thread.start()
+
+    def serve(self):
+        while True:
+            conn, _ = self.sock.accept()
+            thread = threading.Thread(target=self.handle, args=(conn,))
+            thread.daemon = True
+            thread.start()
+            self.handlers.append(thread)
+
+    def join(self):
+        """
+        Wait for the connections closed by the clients to end
+        """
+        for thread in self.handlers:
+            thread.join(1)
+
+    def handle(self, conn):
+        reader = conn.makefile('rb')
+        first = True
+        for line in reader:
+            if first:
+                time.sleep(AUTH_DELAY)
+                first = False
+            conn.sendall(b"ok\n")
+        conn.close()
+
+
+class StandinConnection:
+
+    def __init__(self, port):
+        self.sock = socket.create_connection(('127.0.0.1', port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile('rb')
+        self.query("auth")
+
+    def query(self, line):
+        self.sock.sendall(line.encode('ascii') + b"\n")
+        return self.reader.readline()
+
+    def ping(self):
+        self.query("ping")
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+
+def standin():
+    server = StandinServer()
+    return (lambda: StandinConnection(server.port),
+            lambda conn: conn.query("select 1"),
+            server.join)
+
+
+def mysql():
+    import MySQLdb
+
+    def connect():
+        return MySQLdb.connect(host=os.environ['BENCH_MYSQL_HOST'], user=os.environ.get('BENCH_MYSQL_USER', 'root'),
+                               passwd=os.environ.get('BENCH_MYSQL_PASSWORD', ''),
+                               db=os.environ.get('BENCH_MYSQL_DB', 'mysql'))
+
+    def query(conn):
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1")
+        cursor.fetchall()
+        cursor.close()
+    return connect, query, lambda: None
+
+
+def run(threads, request):
+    """
+    :return: requests by second of REQUESTS requests on threads threads
+    """
+    left = [REQUESTS]
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                if not left[0]:
+                    return
+                left[0] -= 1
+            request()
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    started = time.time()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return REQUESTS / (time.time() - started)
+
+
+def main():
+    connect, query, done = mysql() if os.environ.get('BENCH_MYSQL_HOST') else standin()
+
+    def per_request():
+        conn = connect()
+        for _ in range(QUERIES):
+            query(conn)
+        conn.close()
+
+    print("%d requests of %d queries, pool of %d" % (REQUESTS, QUERIES, POOL_SIZE))
+    for threads in THREADS:
+        pool = DatabasePool(connect, max_size=POOL_SIZE, ping=lambda conn: conn.ping(),
+                            reset=lambda conn: conn.rollback())
+
+        def pooled():
+            with pool.connection() as conn:
+                for _ in range(QUERIES):
+                    query(conn)
+
+        direct = run(threads, per_request)
+        shared = run(threads, pooled)
+        stats = pool.stats()
+        print("%2d threads  connect per request %7.0f req/s  pooled %7.0f req/s  "
+              "opened %d  peak in use %d  waits %d  max wait %.1f ms" %
+              (threads, direct, shared, stats["created"], stats["peak_in_use"], stats["waits"],
+               stats["max_wait"] * 1e3))
+        pool.close()
+    done()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""
+Api key validation latency against the local ndb testbed: ancestor
+query, as the keys were read before, versus key get and get_multi.
+
+Needs the App Engine SDK, for example
+
+    $ APPENGINE_SDK=~/google-cloud-sdk/platform/google_appengine python benchmarks/bench_keystore.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.expanduser(os.environ.get('APPENGINE_SDK', '')))
+
+import dev_appserver
+dev_appserver.fix_sys_path()
+
+from google.appengine.ext import ndb as db
+from google.appengine.ext import testbed
+
+KEYS = 1000
+LOOKUPS = 200
+IP = "127.0.0.1"
+
+
+def main():
+    bed = testbed.Testbed()
+    bed.activate()
+    bed.init_datastore_v3_stub()
+    bed.init_memcache_stub()
+    # Measure the datastore, not the ndb caches
+    db.get_context().set_cache_policy(False)
+    db.get_context().set_memcache_policy(False)
+
+    from components.helpers import Keystore, generate_hash_key, get_ancestor
+
+    keys = [generate_hash_key() for _ in range(KEYS)]
+    legacy = []
+    for k in keys:
+        # Same entry stored both ways: under the mkey ancestor and with the key as id
+        legacy.append(Keystore(parent=get_ancestor("mkey", k), ukey=k, ip=IP, valid=True,
+                               user="bench", password="bench"))
+        legacy.append(Keystore(id=k, ukey=k, ip=IP, valid=True, user="bench", password="bench"))
+    db.put_multi(legacy)
+    sample = keys[:LOOKUPS]
+
+    def by_query():
+        for k in sample:
+            Keystore.query_keys(get_ancestor("mkey", k)).fetch(1)
+
+    def by_get():
+        for k in sample:
+            Keystore.get_key(k)
+
+    def by_get_multi():
+        Keystore.get_keys(sample)
+
+    for name, func in (("ancestor query", by_query), ("key get", by_get), ("get_multi", by_get_multi)):
+        best = min(timeit.repeat(func, number=1, repeat=5))
+        print("%-16s %8.1f us/key" % (name, best / LOOKUPS * 1e6))
+
+    bed.deactivate()
+
+if __name__ == '__main__':
+    main()
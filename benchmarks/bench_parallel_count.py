@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""
+Word counting of large texts in process versus chunked on process pools
+of growing sizes, to find the size above which the pool pays for itself
+(PARALLEL_THRESHOLD) and how the counting scales with the cores.
+
+    $ python benchmarks/bench_parallel_count.py
+"""
+import multiprocessing
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from concurrent.futures import ProcessPoolExecutor
+
+from components.tokenizer import get_stopwords, count_tokens, count_tokens_parallel
+
+VOCABULARY = [u"word%d" % i for i in range(20000)] + u"the a of and to in is it".split()
+SIZES = (128 * 1024, 512 * 1024, 2 * 1024 * 1024, 8 * 1024 * 1024)
+NODE_WORDS = 50
+
+
+def texts(size, seed=0):
+    rnd = random.Random(seed)
+    nodes = []
+    length = 0
+    while length < size:
+        node = u" ".join(rnd.choice(VOCABULARY) for _ in range(NODE_WORDS))
+        nodes.append(node)
+        length += len(node)
+    return nodes
+
+
+def main():
+    stopwords = get_stopwords()
+    cpus = multiprocessing.cpu_count()
+    workers = sorted(set([1, 2, 4, cpus]))
+    pools = dict((n, ProcessPoolExecutor(max_workers=n)) for n in workers)
+    # Start the processes before measuring
+    for pool in pools.values():
+        count_tokens_parallel([u"warm up"], stopwords, pool)
+
+    print("%d cpus" % cpus)
+    for size in SIZES:
+        nodes = texts(size)
+        expected = count_tokens(nodes, stopwords)
+        best = min(timeit.repeat(lambda: count_tokens(nodes, stopwords), number=1, repeat=3))
+        print("%6d KB in process   %8.1f ms" % (size // 1024, best * 1e3))
+        for n in workers:
+            if count_tokens_parallel(nodes, stopwords, pools[n]) != expected:
+                print("%6d KB %d workers: the counts differ" % (size // 1024, n))
+                continue
+            best = min(timeit.repeat(lambda: count_tokens_parallel(nodes, stopwords, pools[n]),
+                                     number=1, repeat=3))
+            print("%6d KB %2d workers    %8.1f ms" % (size // 1024, n, best * 1e3))
+
+    for pool in pools.values():
+        pool.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+"""
+Latency of the lookups of a word in wordlist and of a site in websites
+on ROWS rows, on the tables without keys of the first schema, then once
+the migrations added the unique keys on wordlist.sword and
+websites.url_hash.
+
+Against MySQL when BENCH_MYSQL_HOST is set, with BENCH_MYSQL_USER,
+BENCH_MYSQL_PASSWORD and BENCH_MYSQL_DB, a scratch database whose tables
+are dropped. Otherwise against an in memory SQLite database, with the
+same keys made by CREATE INDEX.
+
+    $ python benchmarks/bench_schema.py
+"""
+import hashlib
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from components import schema
+
+ROWS = int(os.environ.get('BENCH_ROWS', 1000000))
+LOOKUPS = 50
+# Rows by insert, under the 999 parameters of the older SQLite
+CHUNK = 300
+TABLES = ('pages', 'topwords', 'site_words', 'schema_version', 'wordlist', 'websites')
+
+
+def sha1(url):
+    return hashlib.sha1(url.encode('ascii')).hexdigest()
+
+
+def mysql():
+    import MySQLdb
+    conn = MySQLdb.connect(host=os.environ['BENCH_MYSQL_HOST'], user=os.environ.get('BENCH_MYSQL_USER', 'root'),
+                           passwd=os.environ.get('BENCH_MYSQL_PASSWORD', ''), db=os.environ['BENCH_MYSQL_DB'])
+    cursor = conn.cursor()
+    for table in TABLES:
+        cursor.execute("DROP TABLE IF EXISTS %s" % table)
+    schema.create_tables(cursor)
+    # The hashes are filled with the rows, the migration adds the key
+    cursor.execute("ALTER TABLE websites MODIFY url varchar(2048), ADD COLUMN url_hash char(40)")
+
+    def add_keys():
+        schema.migrate(conn)
+    return conn, "%s", add_keys
+
+
+def sqlite():
+    import sqlite3
+    conn = sqlite3.connect(":memory:")
+    cursor = conn.cursor()
+    cursor.execute("CREATE TABLE wordlist (sword varchar(80), eword varchar(2048), frequency int)")
+    cursor.execute("CREATE TABLE websites (url varchar(2048), url_hash char(40))")
+
+    def add_keys():
+        cursor.execute("CREATE UNIQUE INDEX sword ON wordlist (sword)")
+        cursor.execute("CREATE UNIQUE INDEX url_hash ON websites (url_hash)")
+    return conn, "?", add_keys
+
+
+def fill(conn, mark):
+    cursor = conn.cursor()
+    for start in range(0, ROWS, CHUNK):
+        count = min(CHUNK, ROWS - start)
+        words = ", ".join(["(%s, %s, %s)" % (mark, mark, mark)] * count)
+        cursor.execute("INSERT INTO wordlist (sword, eword, frequency) VALUES " + words,
+                       [value for i in range(start, start + count) for value in ("word%d" % i, "x" * 64, i % 97)])
+        urls = [("http://site%d.example.com/%s/page%d" % (i % 1000, "path/" * 40, i)) for i in range(start, start + count)]
+        sites = ", ".join(["(%s, %s)" % (mark, mark)] * count)
+        cursor.execute("INSERT INTO websites (url, url_hash) VALUES " + sites,
+                       [value for url in urls for value in (url, sha1(url))])
+    conn.commit()
+
+
+def lookups(conn, mark, rnd):
+    cursor = conn.cursor()
+    timings = {"word": [], "url": []}
+    for _ in range(LOOKUPS):
+        i = rnd.randrange(ROWS)
+        started = time.time()
+        cursor.execute("SELECT COUNT(*) FROM wordlist WHERE sword = %s" % mark, ("word%d" % i,))
+        assert cursor.fetchone()[0] == 1
+        timings["word"].append(time.time() - started)
+
+        url = "http://site%d.example.com/%s/page%d" % (i % 1000, "path/" * 40, i)
+        started = time.time()
+        cursor.execute("SELECT COUNT(*) FROM websites WHERE url_hash = %s" % mark, (sha1(url),))
+        assert cursor.fetchone()[0] == 1
+        timings["url"].append(time.time() - started)
+    return timings
+
+
+def report(label, timings):
+    for name in ("word", "url"):
+        values = sorted(timings[name])
+        print("%-10s %-5s median %9.3f ms  p95 %9.3f ms" %
+              (label, name, values[len(values) // 2] * 1e3, values[int(len(values) * 0.95)] * 1e3))
+
+
+def main():
+    conn, mark, add_keys = mysql() if os.environ.get('BENCH_MYSQL_HOST') else sqlite()
+    started = time.time()
+    fill(conn, mark)
+    print("%d rows by table, filled in %.1f s" % (ROWS, time.time() - started))
+    report("no keys", lookups(conn, mark, random.Random(0)))
+    started = time.time()
+    add_keys()
+    print("keys added in %.1f s" % (time.time() - started))
+    report("keys", lookups(conn, mark, random.Random(0)))
+    conn.close()
+
+if __name__ == '__main__':
+    main()
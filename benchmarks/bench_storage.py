@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+"""
+Storage backends of the word wall: latency of the word lookups and of
+the upserts of the word lists of pages, on SQLite and, when
+BENCH_MYSQL_HOST is set, on MySQL (BENCH_MYSQL_USER,
+BENCH_MYSQL_PASSWORD, BENCH_MYSQL_DB, a scratch database whose tables
+are dropped). Then the whole pipeline offline on SQLite: pages of the
+stand-in server fetched, counted and stored.
+
+The statements are the ones of insert_wordlist, and a lookup of a word
+by its key.
+
+    $ python benchmarks/bench_storage.py
+"""
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from components import schema
+from components import sqlitedb
+from components.fetcher import PageFetcher
+from components.textextract import iter_visible_text
+from components.tokenizer import count_tokens, get_stopwords
+from standin_http import StandinServer
+
+WORDS = 20000
+PAGE_WORDS = 100
+PAGES = 200
+LOOKUPS = 2000
+INSERT = "INSERT INTO wordlist (`sword`, `eword`, `frequency`) VALUES "
+UPSERTS = {
+    'mysql': "ON DUPLICATE KEY UPDATE `frequency` = `frequency` + VALUES(`frequency`)",
+    'sqlite': "ON CONFLICT (`sword`) DO UPDATE SET `frequency` = `frequency` + excluded.`frequency`",
+}
+
+
+def sqlite(directory):
+    conn = sqlitedb.connect(os.path.join(directory, "bench.db"))
+    schema.migrate_sqlite(conn)
+    return conn
+
+
+def mysql():
+    import MySQLdb
+    conn = MySQLdb.connect(host=os.environ['BENCH_MYSQL_HOST'], user=os.environ.get('BENCH_MYSQL_USER', 'root'),
+                           passwd=os.environ.get('BENCH_MYSQL_PASSWORD', ''), db=os.environ['BENCH_MYSQL_DB'])
+    cursor = conn.cursor()
+    for table in ('pages', 'topwords', 'site_words', 'schema_version', 'wordlist', 'websites'):
+        cursor.execute("DROP TABLE IF EXISTS %s" % table)
+    schema.migrate(conn)
+    return conn
+
+
+def store(conn, backend, counts):
+    """
+    Word list of a page, one statement and one commit
+    """
+    rows = [(word.encode('utf-8'), b"x" * 64, frequency) for word, frequency in counts]
+    cursor = conn.cursor()
+    cursor.execute(INSERT + ", ".join(["(%s, %s, %s)"] * len(rows)) + " " + UPSERTS[backend],
+                   [value for row in rows for value in row])
+    conn.commit()
+    cursor.close()
+
+
+def percentiles(timings):
+    timings = sorted(timings)
+    return timings[len(timings) // 2] * 1e3, timings[int(len(timings) * 0.99)] * 1e3
+
+
+def measure(conn, backend):
+    rnd = random.Random(0)
+    timings = []
+    for _ in range(PAGES):
+        counts = [(u"word%d" % rnd.randrange(WORDS), rnd.randrange(1, 10)) for _ in range(PAGE_WORDS)]
+        counts = list(dict(counts).items())
+        started = time.time()
+        store(conn, backend, counts)
+        timings.append(time.time() - started)
+    print("%-6s upsert of %d words   median %7.3f ms  p99 %7.3f ms" % ((backend, PAGE_WORDS) + percentiles(timings)))
+
+    cursor = conn.cursor()
+    timings = []
+    for _ in range(LOOKUPS):
+        started = time.time()
+        cursor.execute("SELECT COUNT(*) from wordlist WHERE sword=%s", (b"word%d" % rnd.randrange(WORDS),))
+        cursor.fetchone()
+        timings.append(time.time() - started)
+    cursor.close()
+    print("%-6s word lookup            median %7.3f ms  p99 %7.3f ms" % ((backend,) + percentiles(timings)))
+
+
+def pipeline(conn, server):
+    fetcher = PageFetcher()
+    stopwords = get_stopwords()
+    fetching = storing = 0.0
+    for i in range(PAGES):
+        started = time.time()
+        chunks = fetcher.stream(server.url + "/page/%d" % (20000 + i)).chunks
+        counts = count_tokens(iter_visible_text(chunks, 'utf-8'), stopwords)
+        counted = time.time()
+        store(conn, 'sqlite', counts.most_common(PAGE_WORDS))
+        fetching += counted - started
+        storing += time.time() - counted
+    fetcher.pool.clear()
+    print("pipeline %d pages: fetch and count %.2f ms/page, store %.2f ms/page"
+          % (PAGES, fetching / PAGES * 1e3, storing / PAGES * 1e3))
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        conn = sqlite(directory)
+        measure(conn, 'sqlite')
+        if os.environ.get('BENCH_MYSQL_HOST'):
+            measure(mysql(), 'mysql')
+        with StandinServer() as server:
+            pipeline(conn, server)
+        conn.close()
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""
+Visible text extraction of large pages: the BeautifulSoup tree with
+tag_visible, as text_from_html did before, versus the streaming
+extractor fed with the page in network sized chunks.
+
+    $ python benchmarks/bench_textextract.py
+"""
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bs4 import BeautifulSoup
+from bs4.element import Comment
+
+from components.fetcher import READ_CHUNK_SIZE
+from components.textextract import iter_visible_text
+
+WORDS = u"the quick brown fox jumps over the lazy dog near the river bank caf\u00e9 &amp; &#233;".split()
+SIZES = (100 * 1024, 1024 * 1024, 5 * 1024 * 1024)
+
+
+def html_page(size, seed=0):
+    """
+    Page of about size bytes with nested blocks, scripts, styles and comments
+    """
+    rnd = random.Random(seed)
+    parts = [u"<!DOCTYPE html><html><head><title>bench</title><meta charset='utf-8'>"
+             u"<style>p { color: red }</style><script>var x = '<p>no</p>';</script></head><body>"]
+    length = 0
+    while length < size:
+        words = u" ".join(rnd.choice(WORDS) for _ in range(rnd.randint(5, 40)))
+        block = rnd.choice((u"<div class='c'><p>%s</p><br>%s</div>\n",
+                            u"<ul><li><a href='/x'>%s</a></li><li>%s</li></ul>\n",
+                            u"<!-- %s --><span>%s</span>\n",
+                            u"<script>// %s</script><p><b>%s</b></p>\n")) % (words, words)
+        parts.append(block)
+        length += len(block)
+    parts.append(u"</body></html>")
+    return u"".join(parts).encode('utf-8')
+
+
+def tag_visible(element):
+    if element.parent.name in ['style', 'script', 'head', 'title', 'meta', '[document]']:
+        return False
+    if isinstance(element, Comment):
+        return False
+    return True
+
+
+def by_soup(body):
+    soup = BeautifulSoup(body, 'html.parser')
+    return u" ".join(t.strip() for t in filter(tag_visible, soup.findAll(text=True)))
+
+
+def by_stream(body):
+    chunks = (body[i:i + READ_CHUNK_SIZE] for i in range(0, len(body), READ_CHUNK_SIZE))
+    return u" ".join(iter_visible_text(chunks, 'utf-8'))
+
+
+def peak_memory(func, body):
+    try:
+        import tracemalloc
+    except ImportError:
+        return None
+    tracemalloc.start()
+    func(body)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    for size in SIZES:
+        body = html_page(size)
+        if by_soup(body) != by_stream(body):
+            print("%d bytes: the outputs differ" % len(body))
+            continue
+        for name, func in (("BeautifulSoup", by_soup), ("stream", by_stream)):
+            best = min(timeit.repeat(lambda: func(body), number=1, repeat=3))
+            peak = peak_memory(func, body)
+            print("%8d KB %-14s %8.1f ms %s" % (len(body) // 1024, name, best * 1e3,
+                                                "" if peak is None else "peak %.1f MB" % (peak / 1048576.0)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Words per second of the word counting on multi megabyte texts: the
+whitespace split filtered with the stopwords list, as count_words did
+before, versus the regex tokenizer filtered with the StopwordSet.
+
+    $ python benchmarks/bench_tokenizer.py
+"""
+import os
+import random
+import sys
+import timeit
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from components.tokenizer import get_stopwords, count_tokens
+
+VOCABULARY = (u"the quick brown fox jumps over the lazy dog near the river bank with a "
+              u"Café résumé Straße don't (parenthesis) end. Comma, "
+              u"question? exclamation! 2018 “quoted”").split()
+SIZES = (1024 * 1024, 4 * 1024 * 1024)
+# Text nodes of about the size the extractor yields
+NODE_WORDS = 50
+
+
+def texts(size, seed=0):
+    rnd = random.Random(seed)
+    nodes = []
+    length = 0
+    while length < size:
+        node = u" ".join(rnd.choice(VOCABULARY) for _ in range(NODE_WORDS))
+        nodes.append(node)
+        length += len(node)
+    return nodes
+
+
+def by_split(nodes, wordnot):
+    counts = Counter()
+    for text in nodes:
+        counts.update(x for x in text.lower().split() if x not in wordnot)
+    return counts
+
+
+def main():
+    stopwords = get_stopwords()
+    wordnot = sorted(stopwords.words)
+    for size in SIZES:
+        nodes = texts(size)
+        words = sum(len(text.split()) for text in nodes)
+        for name, func in (("split + list", lambda: by_split(nodes, wordnot)),
+                           ("tokenizer + set", lambda: count_tokens(nodes, stopwords))):
+            best = min(timeit.repeat(func, number=1, repeat=3))
+            print("%5d KB %-16s %10.0f words/s" % (size // 1024, name, words / best))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+"""
+Local stand-in HTTP server for the scraper, and a check of the fetcher
+against it: connection reuse, gzip, redirects, timeouts, size caps,
+the page cache revalidation and a crawl.
+
+    $ python benchmarks/standin_http.py
+"""
+import gzip
+import io
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urllib import urlopen
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.request import urlopen
+
+from components.fetcher import PageFetcher, FetchError
+from components.pagecache import PageCache, CachingFetcher
+from components.crawler import Crawler
+from components.textextract import iter_visible_text
+from components.tokenizer import count_tokens
+from components.simhash import simhash
+
+WORDS = u"the quick brown fox jumps over the lazy dog near the river bank "
+
+
+def site_page(n):
+    """
+    Page n of a site shaped as a binary tree, linking to its children,
+    its parent and pages that are not to be crawled
+    """
+    links = "".join("<a href='/site/%d#top'>%d</a>" % (c, c) for c in (2 * n + 1, 2 * n + 2, n // 2))
+    return (u"<html><body><p>page%d common words</p>%s<a href='http://example.com/'>out</a>"
+            u"<a href='/logo.png'>logo</a><a href='mailto:x@example.com'>mail</a></body></html>"
+            % (n, links)).encode('utf-8')
+
+
+def html_page(size):
+    text = (WORDS * (size // len(WORDS) + 1))[:size]
+    return (u"<html><head><title>stand-in</title><style>p {}</style></head>"
+            u"<body><p>%s</p><script>var x = 1;</script></body></html>" % text).encode('utf-8')
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    """
+    /page/<size>      html page of about size bytes
+    /gzip/<size>      same page gzip encoded
+    /redirect/<n>     n redirects, then a page
+    /slow/<seconds>   page sent after seconds
+    /cached/<max_age> page with an ETag and that max-age, 304 when it matches
+    /site/<n>         page n of a site to crawl
+    """
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def do_GET(self):
+        parts = self.path.split('?')[0].strip('/').split('/')
+        kind, arg = parts[0], parts[1] if len(parts) > 1 else '0'
+        if kind == 'redirect' and int(arg) > 0:
+            self.send_response(302)
+            self.send_header('Location', '/redirect/%d' % (int(arg) - 1))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if kind == 'slow':
+            time.sleep(float(arg))
+        if kind == 'cached':
+            if self.headers.get('If-None-Match') == '"v1"':
+                self.send_response(304)
+                self.send_header('ETag', '"v1"')
+                self.send_header('Cache-Control', 'max-age=%s' % arg)
+                self.end_headers()
+                self.server.not_modified += 1
+                return
+        self.server.bodies += 1
+        if kind == 'site':
+            body = site_page(int(arg))
+        else:
+            body = html_page(int(arg) if kind in ('page', 'gzip') else 1000)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        if kind == 'gzip':
+            buf = io.BytesIO()
+            with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+                f.write(body)
+            body = buf.getvalue()
+            self.send_header('Content-Encoding', 'gzip')
+        if kind == 'cached':
+            self.send_header('ETag', '"v1"')
+            self.send_header('Cache-Control', 'max-age=%s' % arg)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StandinServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    connections = 0
+    bodies = 0
+    not_modified = 0
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StandinHandler)
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%d" % self.server_address[1]
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+    def handle_error(self, request, client_address):
+        # Clients dropping the connection on purpose, like on the size cap
+        pass
+
+
+def main():
+    with StandinServer() as server:
+        fetcher = PageFetcher(read_timeout=0.5, max_body_size=1024 * 1024)
+
+        r = fetcher.fetch(server.url + "/gzip/20000")
+        print("gzip: %d %s, %d bytes decoded" % (r.code, r.headers.get('content-encoding'), len(r.body)))
+        r = fetcher.fetch(server.url + "/redirect/3")
+        print("redirects: %d, ended on %s" % (r.code, r.url))
+        for path, error in (("/redirect/9", "redirects"), ("/page/2000000", "size cap"), ("/slow/2", "read timeout")):
+            try:
+                fetcher.fetch(server.url + path)
+                print("%s: not raised" % error)
+            except FetchError as e:
+                print("%s: %s" % (error, e))
+
+        for name, fetch in (("urlopen", lambda url: urlopen(url).read()),
+                            ("PageFetcher", lambda url: fetcher.fetch(url).body)):
+            server.connections = 0
+            started = time.time()
+            for _ in range(200):
+                fetch(server.url + "/page/20000")
+            print("%-12s 200 fetches in %.3fs over %d connections" % (name, time.time() - started, server.connections))
+
+        directory = tempfile.mkdtemp()
+        try:
+            cached = CachingFetcher(fetcher, PageCache(directory))
+            server.bodies = server.not_modified = 0
+            for _ in range(3):
+                cached.fetch(server.url + "/cached/1")
+            time.sleep(1.1)
+            cached.fetch(server.url + "/cached/1")
+            cached.fetch(server.url + "/cached/60")
+            # A new cache on the same directory starts from the disk tier
+            restarted = CachingFetcher(fetcher, PageCache(directory))
+            restarted.fetch(server.url + "/cached/60")
+            stats = cached.stats()
+            print("cache: %d hits, %d revalidations, %d misses, %d bytes saved; server sent %d bodies, %d 304"
+                  % (stats["hits"], stats["revalidations"], stats["misses"], stats["bytes_saved"],
+                     server.bodies, server.not_modified))
+            print("disk tier after restart: %d disk hits" % restarted.stats()["disk_hits"])
+        finally:
+            shutil.rmtree(directory)
+        def count(url, links):
+            counts = count_tokens(iter_visible_text(fetcher.stream(url).chunks, 'utf-8', links))
+            return counts, simhash(counts)
+
+        result = Crawler(count, max_depth=3, max_pages=10).crawl(server.url + "/site/0")
+        print("crawl: %d pages, %d errors, %d urls queued, 'common' counted %d times"
+              % (len(result.pages), len(result.errors), result.queued, result.counts['common']))
+        result = Crawler(count, max_depth=2, max_pages=100).crawl(server.url + "/site/0")
+        print("crawl to depth 2: %d pages %s" % (len(result.pages), sorted(int(u.rsplit('/', 1)[1]) for u in result.pages)))
+
+        # Let the handler threads of the kept alive connections end
+        fetcher.pool.clear()
+
+if __name__ == '__main__':
+    main()
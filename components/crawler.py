@@ -0,0 +1,215 @@
+"""
+Same site crawler of the word wall.
+
+Breadth first from a seed url, following the links to the same host up
+to a depth and a page budget. The urls already queued are remembered in
+a Bloom filter sized by the budget, and no more urls than the budget
+allows are ever queued, so the memory depends on the budget and not on
+the size of the site. Pages are fetched on a pool of threads, with at
+most per_host of them on the same host. A page whose simhash is near
+one of a page crawled before is not counted again.
+"""
+import hashlib
+import math
+import struct
+from collections import Counter
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import wait
+from components.simhash import SimHashIndex
+
+try:
+    from urlparse import urljoin, urlsplit, urlunsplit
+except ImportError:
+    from urllib.parse import urljoin, urlsplit, urlunsplit
+
+CRAWL_DEPTH = 2
+CRAWL_PAGES = 20
+CRAWL_CONCURRENCY = 8
+CRAWL_PER_HOST = 4
+# Urls queued at most, by page of the budget: enough to replace the failed ones
+QUEUED_PER_PAGE = 4
+BLOOM_ERROR_RATE = 0.01
+# Links to files that have no words
+SKIPPED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.svg', '.ico', '.webp', '.pdf', '.zip', '.gz',
+                      '.mp3', '.mp4', '.avi', '.mov', '.css', '.js', '.json', '.xml', '.woff', '.woff2')
+
+
+class BloomFilter:
+    """
+    Set of strings in a fixed number of bits, it can tell that a string
+    was added when it was not, at about error_rate, never the opposite
+    """
+
+    def __init__(self, capacity, error_rate=BLOOM_ERROR_RATE):
+        """
+        :param capacity: number of strings added, the error rate grows past it
+        """
+        self.size = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hashes = max(1, int(round(float(self.size) / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        # Double hashing, the k positions out of two 64 bits hashes
+        h1, h2 = struct.unpack('<QQ', hashlib.sha1(item.encode('utf-8')).digest()[:16])
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        """
+        :return: True if the item was not in the filter
+        """
+        added = False
+        for p in self._positions(item):
+            mask = 1 << (p & 7)
+            if not self.bits[p >> 3] & mask:
+                self.bits[p >> 3] |= mask
+                added = True
+        if added:
+            self.count += 1
+        return added
+
+    def __contains__(self, item):
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(item))
+
+    def __len__(self):
+        return self.count
+
+
+def normalize_url(base, href):
+    """
+    :param base: url of the page of the link
+    :param href: href of the link
+    :return: absolute http(s) url without fragment, None for the other schemes
+    """
+    try:
+        parts = urlsplit(urljoin(base, href.strip()))
+    except ValueError:
+        return None
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        return None
+    netloc = parts.hostname
+    if parts.port and parts.port != (443 if parts.scheme == 'https' else 80):
+        netloc += ':%d' % parts.port
+    return urlunsplit((parts.scheme, netloc, parts.path or '/', parts.query, ''))
+
+
+def site_of(url):
+    """
+    :return: host of url, without www.
+    """
+    host = urlsplit(url).hostname or ''
+    return host[4:] if host.startswith('www.') else host
+
+
+class CrawlResult:
+
+    def __init__(self):
+        # Counter of the words of all the pages, urls crawled, url -> error
+        self.counts = Counter()
+        self.pages = []
+        self.errors = {}
+        # url -> url of the page it is a near duplicate of, not counted
+        self.duplicates = {}
+        self.queued = 0
+
+
+class Crawler:
+    """
+    Crawl with a count function, count(url, links) returning the Counter
+    of the words of url and its simhash, None to not look for its near
+    duplicates, and adding the href of its links to links
+    """
+
+    def __init__(self, count, max_depth=CRAWL_DEPTH, max_pages=CRAWL_PAGES,
+                 concurrency=CRAWL_CONCURRENCY, per_host=CRAWL_PER_HOST):
+        """
+        :param max_depth: links followed from the seed, 0 for the seed only
+        :param max_pages: pages fetched at most, the failed ones included
+        :param concurrency: pages fetched at the same time
+        :param per_host: pages fetched at the same time from one host
+        """
+        self.count = count
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        self.concurrency = concurrency
+        self.per_host = per_host
+
+    def _fetch(self, url):
+        links = []
+        return self.count(url, links), links
+
+    def crawl(self, seed):
+        """
+        :return: CrawlResult
+        """
+        result = CrawlResult()
+        start = normalize_url(seed, '')
+        if start is None:
+            result.errors[seed] = "Not an http url"
+            return result
+        seed = start
+        site = site_of(seed)
+        max_queued = self.max_pages * QUEUED_PER_PAGE
+        seen = BloomFilter(max_queued)
+        seen.add(seed)
+        frontier = deque([(seed, 0)])
+        result.queued = 1
+        in_flight = {}
+        host_load = Counter()
+        counted = SimHashIndex()
+
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        try:
+            while frontier or in_flight:
+                # Start what the budget and the host limits allow, keeping the order
+                waiting = []
+                while (frontier and len(in_flight) < self.concurrency and
+                       len(result.pages) + len(result.errors) + len(in_flight) < self.max_pages):
+                    url, depth = frontier.popleft()
+                    host = urlsplit(url).hostname
+                    if host_load[host] >= self.per_host:
+                        waiting.append((url, depth))
+                        continue
+                    host_load[host] += 1
+                    in_flight[executor.submit(self._fetch, url)] = (url, depth, host)
+                frontier.extendleft(reversed(waiting))
+                if not in_flight:
+                    break
+
+                done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                for future in done:
+                    url, depth, host = in_flight.pop(future)
+                    host_load[host] -= 1
+                    try:
+                        (counts, fingerprint), links = future.result()
+                    except Exception as e:
+                        result.errors[url] = str(e)
+                        continue
+                    result.pages.append(url)
+                    near = counted.find(fingerprint) if fingerprint is not None else None
+                    if near is not None:
+                        result.duplicates[url] = near[0]
+                    else:
+                        if fingerprint is not None:
+                            counted.add(fingerprint, url)
+                        result.counts.update(counts)
+                    if depth < self.max_depth:
+                        self._queue_links(url, depth + 1, links, site, seen, frontier, result, max_queued)
+        finally:
+            executor.shutdown(wait=False)
+        return result
+
+    def _queue_links(self, url, depth, links, site, seen, frontier, result, max_queued):
+        for href in links:
+            if result.queued >= max_queued:
+                return
+            link = normalize_url(url, href)
+            if link is None or site_of(link) != site:
+                continue
+            if urlsplit(link).path.lower().endswith(SKIPPED_EXTENSIONS):
+                continue
+            if seen.add(link):
+                frontier.append((link, depth))
+                result.queued += 1
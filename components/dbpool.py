@@ -0,0 +1,244 @@
+"""
+Thread safe pool of database connections.
+
+Keeps from min_size to max_size connections made by a connect function.
+A connection is checked with ping before it is handed out, closed once
+older than max_age, and ended with reset when it comes back, so the next
+user never sees the transaction of the last one. When all the
+connections are in use, a checkout waits for one up to wait_timeout.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+MIN_SIZE = 1
+MAX_SIZE = 10
+# Seconds, Cloud SQL drops the connections idle for 8 hours
+MAX_AGE = 3600
+WAIT_TIMEOUT = 10
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class PooledConnection:
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created = time.time()
+
+
+class DatabasePool:
+
+    def __init__(self, connect, min_size=MIN_SIZE, max_size=MAX_SIZE, max_age=MAX_AGE,
+                 wait_timeout=WAIT_TIMEOUT, ping=None, reset=None):
+        """
+        :param connect: function making a new connection
+        :param max_age: seconds after which a connection is closed, None to keep it
+        :param wait_timeout: seconds a checkout waits for a connection when all are in use
+        :param ping: function raising on a dead connection, checked on checkout
+        :param reset: function ending the transaction of a connection given back
+        """
+        self.connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_age = max_age
+        self.wait_timeout = wait_timeout
+        self.ping = ping
+        self.reset = reset
+        self.idle = []
+        # Connections open or being opened, idle ones included
+        self.size = 0
+        self.in_use = 0
+        self.filled = False
+        self.cond = threading.Condition(threading.Lock())
+        # Statistics
+        self.checkouts = 0
+        self.created = 0
+        self.recycled = 0
+        self.dead = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.max_wait = 0.0
+        self.timeouts = 0
+        self.peak_in_use = 0
+
+    def acquire(self):
+        """
+        :return: PooledConnection, give it back with release
+        :raise PoolTimeout: when no connection was free within wait_timeout
+        """
+        if not self.filled:
+            self._fill()
+        started = None
+        with self.cond:
+            while True:
+                if self.idle:
+                    pooled = self.idle.pop()
+                    break
+                if self.size < self.max_size:
+                    # Open it outside of the lock, the slot is taken meanwhile
+                    self.size += 1
+                    pooled = None
+                    break
+                now = time.time()
+                if started is None:
+                    started = now
+                    self.waits += 1
+                left = self.wait_timeout - (now - started)
+                if left <= 0:
+                    self.timeouts += 1
+                    self._count_wait(now - started)
+                    raise PoolTimeout("No connection free within %s seconds" % self.wait_timeout)
+                self.cond.wait(left)
+            if started is not None:
+                self._count_wait(time.time() - started)
+            self.in_use += 1
+            self.checkouts += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+
+        try:
+            if pooled is not None:
+                pooled = self._check(pooled)
+            if pooled is None:
+                pooled = self._open()
+        except Exception:
+            with self.cond:
+                self.size -= 1
+                self.in_use -= 1
+                self.cond.notify()
+            raise
+        return pooled
+
+    def release(self, pooled, broken=False):
+        """
+        Give the connection back, closed if broken, too old or if reset fails
+        """
+        if not broken and self.reset is not None:
+            try:
+                self.reset(pooled.conn)
+            except Exception:
+                broken = True
+        expired = not broken and self._expired(pooled)
+        if broken or expired:
+            self._close(pooled)
+            broken = True
+        with self.cond:
+            if expired:
+                self.recycled += 1
+            self.in_use -= 1
+            if broken:
+                self.size -= 1
+            else:
+                self.idle.append(pooled)
+            self.cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """
+        with pool.connection() as conn: the connection is given back at the end
+        """
+        pooled = self.acquire()
+        try:
+            yield pooled.conn
+        except Exception:
+            self.release(pooled)
+            raise
+        self.release(pooled)
+
+    def _fill(self):
+        with self.cond:
+            if self.filled:
+                return
+            self.filled = True
+            missing = max(0, self.min_size - self.size)
+            self.size += missing
+        opened = []
+        try:
+            for _ in range(missing):
+                opened.append(self._open())
+        finally:
+            with self.cond:
+                self.size -= missing - len(opened)
+                self.idle.extend(opened)
+                self.cond.notify_all()
+
+    def _open(self):
+        pooled = PooledConnection(self.connect())
+        with self.cond:
+            self.created += 1
+        return pooled
+
+    def _check(self, pooled):
+        """
+        :return: pooled if it is alive and young enough, else None once closed
+        """
+        if self._expired(pooled):
+            with self.cond:
+                self.recycled += 1
+            self._close(pooled)
+            return None
+        if self.ping is not None:
+            try:
+                self.ping(pooled.conn)
+            except Exception:
+                with self.cond:
+                    self.dead += 1
+                self._close(pooled)
+                return None
+        return pooled
+
+    def _expired(self, pooled):
+        return self.max_age is not None and time.time() - pooled.created > self.max_age
+
+    def _close(self, pooled):
+        try:
+            pooled.conn.close()
+        except Exception:
+            pass
+
+    def _count_wait(self, seconds):
+        self.wait_seconds += seconds
+        self.max_wait = max(self.max_wait, seconds)
+
+    def close(self):
+        """
+        Close the idle connections, the ones in use are closed when given back
+        """
+        with self.cond:
+            idle, self.idle = self.idle, []
+            self.size -= len(idle)
+            self.filled = False
+        for pooled in idle:
+            self._close(pooled)
+
+    def stats(self):
+        with self.cond:
+            return {"size": self.size, "idle": len(self.idle), "in_use": self.in_use,
+                    "max_size": self.max_size, "peak_in_use": self.peak_in_use,
+                    "checkouts": self.checkouts, "created": self.created, "recycled": self.recycled,
+                    "dead": self.dead, "waits": self.waits, "wait_seconds": self.wait_seconds,
+                    "max_wait": self.max_wait, "timeouts": self.timeouts}
+
+    def collect(self):
+        """
+        Collector of a MetricsRegistry
+
+        :return: list of (name, type, help, value)
+        """
+        stats = self.stats()
+        return [
+            ("db_pool_connections", "gauge", "Connections open, idle ones included.", stats["size"]),
+            ("db_pool_in_use", "gauge", "Connections checked out.", stats["in_use"]),
+            ("db_pool_peak_in_use", "gauge", "Most connections checked out at once.", stats["peak_in_use"]),
+            ("db_pool_checkouts_total", "counter", "Connections checked out.", stats["checkouts"]),
+            ("db_pool_created_total", "counter", "Connections opened.", stats["created"]),
+            ("db_pool_closed_total", "counter", "Connections closed for their age or found dead.",
+             stats["recycled"] + stats["dead"]),
+            ("db_pool_waits_total", "counter", "Checkouts that waited for a connection, the pool being saturated.",
+             stats["waits"]),
+            ("db_pool_wait_seconds_total", "counter", "Time spent waiting for a connection.", stats["wait_seconds"]),
+            ("db_pool_max_wait_seconds", "gauge", "Longest wait for a connection.", stats["max_wait"]),
+            ("db_pool_timeouts_total", "counter", "Checkouts that gave up waiting.", stats["timeouts"]),
+        ]
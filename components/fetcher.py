@@ -0,0 +1,213 @@
+"""
+Page fetcher of the scraper.
+
+Keeps idle keep-alive connections per host, bounds connect and read
+times, stops at a max body size, decodes gzip and follows a bounded
+number of redirects. A fetcher is thread safe, the blocking fetches run
+on the executor of the operation so the IOLoop is never stalled.
+"""
+import socket
+import threading
+import time
+import zlib
+
+try:
+    import httplib
+    from urlparse import urlsplit, urljoin
+except ImportError:
+    import http.client as httplib
+    from urllib.parse import urlsplit, urljoin
+
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 15
+MAX_BODY_SIZE = 5 * 1024 * 1024
+MAX_REDIRECTS = 5
+# Idle connections kept per host, and for how many seconds
+MAX_IDLE_PER_HOST = 4
+IDLE_TIMEOUT = 30
+READ_CHUNK_SIZE = 64 * 1024
+USER_AGENT = "Mozilla/5.0 (compatible; alexchallenge-scraper)"
+
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+
+class FetchError(Exception):
+    pass
+
+
+class FetchResponse:
+    """
+    A fetched page, headers names are lower case
+    """
+
+    def __init__(self, url, code, headers, body=None, chunks=None):
+        """
+        :param url: url of the page, after the redirects
+        :param body: decoded body, None when streamed
+        :param chunks: iterator of the decoded body chunks, when streamed
+        """
+        self.url = url
+        self.code = code
+        self.headers = headers
+        self.body = body
+        self.chunks = chunks
+
+    @property
+    def charset(self):
+        """
+        :return: charset of the Content-Type header, None if not given
+        """
+        for param in self.headers.get('content-type', '').split(';')[1:]:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'charset':
+                return value.strip().strip('"\'') or None
+        return None
+
+
+class ConnectionPool:
+    """
+    Idle connections by (scheme, host, port)
+    """
+
+    def __init__(self, max_idle_per_host=MAX_IDLE_PER_HOST, idle_timeout=IDLE_TIMEOUT):
+        self.max_idle_per_host = max_idle_per_host
+        self.idle_timeout = idle_timeout
+        self.idle = {}
+        self.lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+
+    def get(self, scheme, host, port, timeout):
+        """
+        :return: (connection, True if it was already used)
+        """
+        with self.lock:
+            conns = self.idle.get((scheme, host, port))
+            while conns:
+                conn, released = conns.pop()
+                if time.time() - released < self.idle_timeout:
+                    self.reused += 1
+                    conn.sock.settimeout(timeout)
+                    return conn, True
+                conn.close()
+            self.created += 1
+
+        if scheme == 'https':
+            return httplib.HTTPSConnection(host, port, timeout=timeout), False
+        return httplib.HTTPConnection(host, port, timeout=timeout), False
+
+    def put(self, scheme, host, port, conn):
+        with self.lock:
+            conns = self.idle.setdefault((scheme, host, port), [])
+            if len(conns) < self.max_idle_per_host:
+                conns.append((conn, time.time()))
+                return
+        conn.close()
+
+    def clear(self):
+        with self.lock:
+            for conns in self.idle.values():
+                for conn, released in conns:
+                    conn.close()
+            self.idle.clear()
+
+
+class PageFetcher:
+
+    def __init__(self, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 max_body_size=MAX_BODY_SIZE, max_redirects=MAX_REDIRECTS, pool=None):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_body_size = max_body_size
+        self.max_redirects = max_redirects
+        self.pool = pool or ConnectionPool()
+
+    def fetch(self, url, headers=None):
+        """
+        :param url: http or https url
+        :param headers: extra request headers
+        :return: FetchResponse with the whole decoded body
+        :raise FetchError: on connection errors, timeouts, too many redirects or a too large body
+        """
+        response = self.stream(url, headers)
+        response.body = b"".join(response.chunks)
+        response.chunks = None
+        return response
+
+    def stream(self, url, headers=None):
+        """
+        Like fetch, but the body is read while it is consumed from the
+        chunks of the response, the connection is released at the end
+
+        :return: FetchResponse with the decoded body chunks iterator
+        """
+        for _ in range(self.max_redirects + 1):
+            conn, resp, target = self._request(url, headers)
+            location = resp.getheader('location')
+            if resp.status not in REDIRECT_CODES or not location:
+                response_headers = dict((k.lower(), v) for k, v in resp.getheaders())
+                return FetchResponse(url, resp.status, response_headers,
+                                     chunks=self._read_body(conn, resp, target, url))
+            for _ in self._read_body(conn, resp, target, url):
+                pass
+            url = urljoin(url, location)
+        raise FetchError("Too many redirects: %s" % url)
+
+    def _request(self, url, headers):
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise FetchError("Not an http url: %s" % url)
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        target = (parts.scheme, parts.hostname, port)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        request_headers = {'User-Agent': USER_AGENT, 'Accept-Encoding': 'gzip'}
+        if headers:
+            request_headers.update(headers)
+
+        while True:
+            conn, reused = self.pool.get(parts.scheme, parts.hostname, port, self.connect_timeout)
+            try:
+                conn.request('GET', path, headers=request_headers)
+                conn.sock.settimeout(self.read_timeout)
+                return conn, conn.getresponse(), target
+            except (socket.error, httplib.HTTPException) as e:
+                conn.close()
+                # The server may have closed an idle connection, retry on a new one
+                if not reused:
+                    raise FetchError("%s: %s" % (url, e))
+
+    def _read_body(self, conn, resp, target, url):
+        decoder = None
+        if resp.getheader('content-encoding', '').lower() == 'gzip':
+            decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        size = 0
+        done = False
+        try:
+            while True:
+                try:
+                    data = resp.read(READ_CHUNK_SIZE)
+                except (socket.error, httplib.HTTPException) as e:
+                    raise FetchError("%s: %s" % (url, e))
+                if not data:
+                    break
+                if decoder is not None:
+                    try:
+                        # Never inflate more than the size left
+                        data = decoder.decompress(data, self.max_body_size - size + 1)
+                    except zlib.error as e:
+                        raise FetchError("%s: %s" % (url, e))
+                size += len(data)
+                if size > self.max_body_size:
+                    raise FetchError("Body larger than %d bytes: %s" % (self.max_body_size, url))
+                if data:
+                    yield data
+            done = True
+        finally:
+            # A connection is reused only when its response was read to the end
+            if done and not resp.will_close:
+                self.pool.put(target[0], target[1], target[2], conn)
+            else:
+                conn.close()
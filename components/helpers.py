@@ -3,114 +3,422 @@ import base64
 import hashlib
 import random
 import datetime
+import threading
+import time
 from google.appengine.ext import ndb as db
-from bs4 import BeautifulSoup
+from google.appengine.api import datastore_errors
 from bs4.element import Comment
-import urllib
 from collections import Counter
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
 import MySQLdb
 import hashlib
 from Crypto.Hash import SHA256
+from Crypto.PublicKey import RSA
 from base64 import b64encode
 from base64 import b64decode
-
-wordnot = ["a", "is","if","to","we","it","end","not","aboard", "about", "above", "absent", "across", "after", "against", \
-           "along", "alongside", "amid", "amidst", "among", "amongst", "apud", "around", "round", \
-           "as", "astride", "at", "@", "on", "atop", "ontop", "bar", "before", "behind","below", \
-           "allow", "beneath", "beside", "besides", "between", "beyond", "but", "by", "circa", "come", \
-           "dehors", "despite", "spite" , "down", "during", "except", "for", "from", "in", "inside", \
-           "into", "less", "like", "minus", "near", "notwithstanding", "us", "your", "&", "on", "this", \
-           "of", "off", "on", "onto", "opposite", "out", "outside", "over", "pace", "past", "per", "post", \
-           "pre", "pro", "qua",  "re",  "sans", "short", "since", "than", "through", "thru", "throughout", \
-           "thruout", "to", "toward", "towards", "under", "underneath", "unlike", "until", "up", "upon", \
-           "upside", "versus", "via", "with", "within", "without", "worth", "with", "the", "and", "there"]
+from itsdangerous import URLSafeTimedSerializer
+from itsdangerous import BadSignature
+from components.fetcher import PageFetcher
+from components.fetcher import FetchError
+from components.pagecache import PageCache
+from components.pagecache import CachingFetcher
+from components.textextract import visible_text
+from components.textextract import iter_visible_text
+from components.tokenizer import get_stopwords
+from components.tokenizer import count_tokens
+from components.tokenizer import count_tokens_parallel
+from components.tokenizer import PARALLEL_THRESHOLD
+from components.crawler import Crawler
+from components.crawler import site_of
+from components.simhash import simhash
+from components.simhash import SimHashIndex
+from components.simhash import split_blocks
+from components.simhash import hamming
+from components.simhash import MAX_DISTANCE
+from components.dbpool import DatabasePool
+from components.dbpool import PoolTimeout
+from components import schema
+from components import sqlitedb
 
 
 # These environment variables are configured in app.yaml.
 CLOUDSQL_CONNECTION_NAME = os.environ.get('CLOUDSQL_CONNECTION_NAME')
 CLOUDSQL_USER = os.environ.get('CLOUDSQL_USER')
 CLOUDSQL_PASSWORD = os.environ.get('CLOUDSQL_PASSWORD')
+# Backend of get_database, 'mysql' or 'sqlite'. SQLite needs a writable
+# disk, it is for the single node deployments, not App Engine standard
+DATABASE_BACKEND = os.environ.get('DATABASE_BACKEND', 'mysql')
+# Directory of the SQLite databases, one <dbname>.db file each
+SQLITE_DIR = os.environ.get('SQLITE_DIR', '.')
+# Database of the word wall
+WORDWALL_DB = os.environ.get('WORDWALL_DB', 'wordwall')
+# PEM file of the RSA key encrypting the words stored, the pages scanned
+# are not stored in the word wall without it
+WORDWALL_KEY_FILE = os.environ.get('WORDWALL_KEY_FILE')
+# Connections kept by database, see components/dbpool.py
+DB_POOL_MIN = 1
+DB_POOL_MAX = 10
+DB_POOL_MAX_AGE = 3600
+DB_POOL_TIMEOUT = 10
 MAX_LIST_RECORD = 100
+# Rows by statement of the bulk inserts
+BULK_CHUNK_SIZE = int(os.environ.get('BULK_CHUNK_SIZE', '500'))
+# 'signed' issues api keys carrying their issue time and ip under an HMAC,
+# checked without storage, 'stored' the random keys kept in Keystore
+APPKEY_MODE = os.environ.get('APPKEY_MODE', 'stored')
+APPKEY_SECRET = os.environ.get('APPKEY_SECRET')
+# With signed keys, Keystore is only read as the list of revoked keys
+APPKEY_REVOCATION = os.environ.get('APPKEY_REVOCATION', 'no') == 'yes'
+# Validated api keys cached per instance, see lookup_key
+KEY_CACHE_SIZE = 1024
+KEY_CACHE_TTL = 60
+MAX_KEYS_PAGE = 100
+# Urls of one scan_urls call, and how many are fetched at the same time
+MAX_SCAN_URLS = 20
+SCAN_CONCURRENCY = 8
+# Disk tier of the page cache, memory only if not set: App Engine has no writable disk
+PAGE_CACHE_DIR = os.environ.get('PAGE_CACHE_DIR')
+# Words returned by default, the word wall renders no more
+TOP_WORDS = 100
+MAX_TOP_WORDS = 1000
+# Limits of the crawls of /crawl
+MAX_CRAWL_DEPTH = 3
+MAX_CRAWL_PAGES = 100
+# Word counts memoized by page content
+WORD_MEMO_SIZE = 256
+# Stopwords of components/stopwords, dropped from the counts
+STOPWORDS_LANGUAGE = 'en'
+
+
+class LRUCache:
+    """
+    Bounded, thread safe LRU cache whose entries can expire
+    """
+
+    def __init__(self, maxsize, ttl=None):
+        """
+        :param maxsize: max number of entries, the least recently used is dropped first
+        :param ttl: default time to live of the entries in seconds, None to keep them
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        :return: the value of key, None if missing or expired
+        """
+        with self.lock:
+            item = self.data.pop(key, None)
+            if item is None:
+                return None
+            if item[1] is not None and item[1] <= time.time():
+                return None
+            self.data[key] = item
+            return item[0]
+
+    def set(self, key, value, ttl=None):
+        """
+        :param ttl: time to live of this entry in seconds, the default one if None
+        """
+        ttl = self.ttl if ttl is None else ttl
+        if ttl is not None and ttl <= 0:
+            return
+        with self.lock:
+            self.data.pop(key, None)
+            self.data[key] = (value, None if ttl is None else time.time() + ttl)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def __len__(self):
+        return len(self.data)
+
+
+key_cache = LRUCache(KEY_CACHE_SIZE, KEY_CACHE_TTL)
+page_fetcher = CachingFetcher(PageFetcher(), PageCache(PAGE_CACHE_DIR))
+word_memo = LRUCache(WORD_MEMO_SIZE)
+appkey_serializer = URLSafeTimedSerializer(APPKEY_SECRET, salt='appkey') if APPKEY_SECRET else None
+if APPKEY_MODE == 'signed' and appkey_serializer is None:
+    # Every key issued or checked would fail, better not to start
+    raise RuntimeError("APPKEY_MODE is signed but APPKEY_SECRET is not set")
+if WORDWALL_KEY_FILE:
+    with open(WORDWALL_KEY_FILE) as key_file:
+        wordwall_key = RSA.importKey(key_file.read())
+else:
+    wordwall_key = None
+
+def connect_database(dbname):
+    """
+    New connection to the MySQL database
+
+    :raise MySQLdb.Error:
+    """
+    # When deployed to App Engine, the `SERVER_SOFTWARE` environment variable
+    # will be set to 'Google App Engine/version'.
+    if os.getenv('SERVER_SOFTWARE', '').startswith('Google App Engine/'):
+        # Connect using the unix socket located at
+        # /cloudsql/cloudsql-connection-name.
+        cloudsql_unix_socket = os.path.join(
+            '/cloudsql', CLOUDSQL_CONNECTION_NAME)
+
+        return MySQLdb.connect(
+            unix_socket=cloudsql_unix_socket,
+            user=CLOUDSQL_USER,
+            passwd=CLOUDSQL_PASSWORD,
+            db=dbname)
+
+    # If the unix socket is unavailable, then try to connect using TCP. This
+    # will work if you're running a local MySQL server or using the Cloud SQL
+    # proxy, for example:
+    #
+    #   $ cloud_sql_proxy -instances=your-connection-name=tcp:3306
+    #
+    return MySQLdb.connect(
+        host='127.0.0.1', user=CLOUDSQL_USER, passwd=CLOUDSQL_PASSWORD, db=dbname)
+
+def connect_sqlite(dbname):
+    """
+    New connection to the SQLite database, <SQLITE_DIR>/<dbname>.db
+
+    :raise sqlite3.Error:
+    """
+    return sqlitedb.connect(os.path.join(SQLITE_DIR, dbname + '.db'))
+
+db_pools = {}
+db_pools_lock = threading.Lock()
+
+def get_db_pool(key, connect):
+    """
+    :param key: (backend, dbname)
+    :param connect: function of the dbname making a new connection
+    :return: the DatabasePool of the database, made on first use
+    """
+    with db_pools_lock:
+        pool = db_pools.get(key)
+        if pool is None:
+            dbname = key[1]
+            pool = db_pools[key] = DatabasePool(lambda: connect(dbname),
+                                                DB_POOL_MIN, DB_POOL_MAX, DB_POOL_MAX_AGE, DB_POOL_TIMEOUT,
+                                                ping=lambda conn: conn.ping(),
+                                                reset=lambda conn: conn.rollback())
+        return pool
+
+def collect_db_pools():
+    """
+    Collector of a MetricsRegistry, summing the pools of all the databases
+    """
+    totals = OrderedDict()
+    for pool in list(db_pools.values()):
+        for name, kind, help, value in pool.collect():
+            if name in totals:
+                old = totals[name]
+                value = max(old[2], value) if name == "db_pool_max_wait_seconds" else old[2] + value
+            totals[name] = (kind, help, value)
+    return [(name, kind, help, value) for name, (kind, help, value) in totals.items()]
+
+# (backend, dbname) of the databases whose schema was found up to date
+checked_databases = set()
 
 class Database:
+    """
+    Interface of the storage backends, get one with get_database. A
+    backend gives its name, connect, its migrations, table_exists and
+    migrate_schema, the class of its errors and its upsert clause, the
+    queries use %s placeholders
+    """
+    backend = None
+    Error = Exception
+    migrations = []
+    # Parameters by statement at most, None for no limit
+    max_params = None
 
-    def __init__(self,dbname):
+    def __init__(self,dbname,check_schema=True):
+        """
+        :param check_schema: False to connect to a database whose schema
+                             is behind, to migrate it
+        """
         self.message = None
         self.db = None
+        self.cursor = None
 
-        # When deployed to App Engine, the `SERVER_SOFTWARE` environment variable
-        # will be set to 'Google App Engine/version'.
-        if os.getenv('SERVER_SOFTWARE', '').startswith('Google App Engine/'):
-            # Connect using the unix socket located at
-            # /cloudsql/cloudsql-connection-name.
-            cloudsql_unix_socket = os.path.join(
-                '/cloudsql', CLOUDSQL_CONNECTION_NAME)
+        # A pooled connection, given back by close
+        self.key = key = (self.backend, dbname)
+        self.pool = get_db_pool(key, self.__class__.connect)
+        self.pooled = None
+        try:
+            self.pooled = self.pool.acquire()
+            self.db = self.pooled.conn
+        except self.Error, e:
+            self.message = "[CONNECT ERROR] %s" % self.describe_error(e)
+        except PoolTimeout, e:
+            self.message = "[CONNECT ERROR] %s" % e
 
-            try:
-                self.db = MySQLdb.connect(
-                    unix_socket=cloudsql_unix_socket,
-                    user=CLOUDSQL_USER,
-                    passwd=CLOUDSQL_PASSWORD,
-                    db=dbname)
-            except MySQLdb.Error, e:
-                self.message = "[CONNECT ERROR] %d: %s" % (e.args[0], e.args[1])
-
-        # If the unix socket is unavailable, then try to connect using TCP. This
-        # will work if you're running a local MySQL server or using the Cloud SQL
-        # proxy, for example:
-        #
-        #   $ cloud_sql_proxy -instances=your-connection-name=tcp:3306
-        #
+        if self.db is not None:
+            self.cursor = self.db.cursor()
+            if check_schema and key not in checked_databases:
+                self.check_schema()
+
+    def check_schema(self):
+        """
+        Refuse to serve a database whose schema is behind: the connection
+        is given back and the message tells to migrate it
+        """
+        try:
+            pending = schema.pending_versions(self.cursor, self.migrations, self.table_exists)
+            self.db.commit()
+        except self.Error, e:
+            self.message = "[SCHEMA ERROR] %s" % self.describe_error(e)
         else:
-            try:
-                self.db = MySQLdb.connect(
-                    host='127.0.0.1', user=CLOUDSQL_USER, passwd=CLOUDSQL_PASSWORD, db=dbname)
-            except MySQLdb.Error, e:
-                self.message = "[CONNECT ERROR] %d: %s" % (e.args[0], e.args[1])
+            if not pending:
+                checked_databases.add(self.key)
+                return
+            self.message = "[SCHEMA ERROR] migrations %s not applied, run /migrate" % \
+                           ", ".join(str(version) for version in pending)
+        self.close()
+        self.db = None
+        self.cursor = None
+
+    def describe_error(self, e):
+        return str(e)
 
-        self.cursor = self.db.cursor()
+    def upsert(self, key, column, add=True):
+        """
+        :param key: column, or tuple of the columns, of the unique key
+        :param add: True to add the column of the row inserted to the one
+                    of the row already there, False to replace it
+        :return: end of an insert updating the row whose key is already there
+        """
+        raise NotImplementedError
 
     def create(self):
-        create_words = """
-                     CREATE TABLE wordlist ( 
-                     sword varchar(80),
-                     eword varchar(2048),
-                     frequency int)
-                     """
-
-        self.insert(create_words)
-        create_websites = """
-                     CREATE TABLE websites (
-                     url varchar(200))
-                      """
-        self.insert(create_websites)
-
-    def insert(self, query):
+        """
+        Create the tables, or bring them up to date
+        """
+        return self.migrate()
+
+    def migrate(self):
+        """
+        Apply the schema migrations not applied yet
+
+        :return: list of the versions applied, None on error
+        """
         self.message = None
         try:
-            self.cursor.execute(query)
+            applied = self.__class__.migrate_schema(self.db)
+            checked_databases.add(self.key)
+            return applied
+        except self.Error, e:
+            self.message = "[MIGRATION ERROR] %s" % self.describe_error(e)
+            self.db.rollback()
+        except schema.SchemaLocked, e:
+            self.message = "[MIGRATION ERROR] %s" % e
+
+    def insert(self, query, args=None):
+        self.message = None
+        try:
+            self.cursor.execute(query, args)
             self.db.commit()
-        except MySQLdb.Error, e:
-            self.message = "[INSERT ERROR] %d: %s" % (e.args[0], e.args[1])
+        except self.Error, e:
+            self.message = "[INSERT ERROR] %s" % self.describe_error(e)
+            self.db.rollback()
+
+    def execute(self, query, args=None):
+        """
+        Run query in the current transaction, end it with commit
+
+        :return: number of rows affected, None on error, the transaction
+                 is then rolled back
+        """
+        self.message = None
+        try:
+            self.cursor.execute(query, args)
+        except self.Error, e:
+            self.message = "[EXECUTE ERROR] %s" % self.describe_error(e)
             self.db.rollback()
+            return None
+        return self.cursor.rowcount
 
-    def query(self, query):
+    def commit(self):
         self.message = None
         try:
-            cursor = self.db.cursor( MySQLdb.cursors.DictCursor )
-            cursor.execute(query)
-        except MySQLdb.Error, e:
-            self.message = "[QUERY ERROR] %d: %s" % (e.args[0], e.args[1])
+            self.db.commit()
+            return True
+        except self.Error, e:
+            self.message = "[COMMIT ERROR] %s" % self.describe_error(e)
+            self.db.rollback()
+            return False
 
-        return cursor.fetchall()
+    def rollback(self):
+        try:
+            self.db.rollback()
+        except self.Error:
+            pass
+
+    def insert_many(self, insert, rows, update="", chunk_size=None, commit=True):
+        """
+        Insert rows with multi-row statements, all in one transaction
 
-    def squery(self, query):
+        :param insert: statement up to VALUES, e.g. "INSERT INTO t (`a`, `b`) VALUES"
+        :param rows: tuples of the values, passed as parameters
+        :param update: end of the statement, e.g. the upsert clause
+        :param chunk_size: rows by statement, BULK_CHUNK_SIZE by default
+        :param commit: False to leave the transaction open, for more writes
+        :return: number of rows affected, None on error
+        """
+        self.message = None
+        chunk_size = chunk_size or BULK_CHUNK_SIZE
+        if rows and self.max_params:
+            chunk_size = max(1, min(chunk_size, self.max_params // len(rows[0])))
+        affected = 0
+        try:
+            for start in range(0, len(rows), chunk_size):
+                chunk = rows[start:start + chunk_size]
+                values = ", ".join("(" + ", ".join(["%s"] * len(row)) + ")" for row in chunk)
+                self.cursor.execute("%s %s %s" % (insert, values, update),
+                                    [value for row in chunk for value in row])
+                affected += self.cursor.rowcount
+            if commit:
+                self.db.commit()
+        except self.Error, e:
+            self.message = "[INSERT ERROR] %s" % self.describe_error(e)
+            self.db.rollback()
+            return None
+        return affected
+
+    def query(self, query, args=None):
+        """
+        :return: the rows as dicts
+        """
+        self.message = None
+        try:
+            cursor = self.db.cursor()
+            cursor.execute(query, args)
+        except self.Error, e:
+            self.message = "[QUERY ERROR] %s" % self.describe_error(e)
+            return ()
+
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def squery(self, query, args=None):
         self.message = None
         try:
             #cursor = self.db.cursor( MySQLdb.cursors.DictCursor )
-            self.cursor.execute(query)
-        except MySQLdb.Error, e:
-            self.message = "[SQUERY ERROR] %d: %s" % (e.args[0], e.args[1])
+            self.cursor.execute(query, args)
+        except self.Error, e:
+            self.message = "[SQUERY ERROR] %s" % self.describe_error(e)
+            return None
 
         return self.cursor.fetchone()
 
@@ -123,9 +431,71 @@ class Database:
     def getCursor(self):
         return self.cursor
 
+    def close(self):
+        """
+        Give the connection back to the pool
+        """
+        if self.pooled is not None:
+            pooled, self.pooled = self.pooled, None
+            if self.cursor is not None:
+                self.cursor.close()
+            self.pool.release(pooled)
+
     def __del__(self):
-        self.db.close()
+        self.close()
 
+class MySQLDatabase(Database):
+    """
+    Cloud SQL, or a MySQL server
+    """
+    backend = 'mysql'
+    Error = MySQLdb.Error
+    migrations = schema.MIGRATIONS
+    table_exists = staticmethod(schema.table_exists)
+    connect = staticmethod(connect_database)
+    migrate_schema = staticmethod(schema.migrate)
+
+    def describe_error(self, e):
+        return "%d: %s" % (e.args[0], e.args[1])
+
+    def upsert(self, key, column, add=True):
+        if add:
+            return "ON DUPLICATE KEY UPDATE `{0}` = `{0}` + VALUES(`{0}`)".format(column)
+        return "ON DUPLICATE KEY UPDATE `{0}` = VALUES(`{0}`)".format(column)
+
+class SQLiteDatabase(Database):
+    """
+    Embedded database file, in WAL mode
+    """
+    backend = 'sqlite'
+    Error = sqlitedb.Error
+    max_params = sqlitedb.MAX_VARIABLES
+    migrations = schema.SQLITE_MIGRATIONS
+    table_exists = staticmethod(schema.sqlite_table_exists)
+    connect = staticmethod(connect_sqlite)
+    migrate_schema = staticmethod(schema.migrate_sqlite)
+
+    def upsert(self, key, column, add=True):
+        if isinstance(key, basestring):
+            key = (key,)
+        update = "`{1}` + excluded.`{1}`" if add else "excluded.`{1}`"
+        return ("ON CONFLICT (`{0}`) DO UPDATE SET `{1}` = " + update).format("`, `".join(key), column)
+
+DATABASE_BACKENDS = {
+    'mysql': MySQLDatabase,
+    'sqlite': SQLiteDatabase,
+}
+
+def get_database(dbname, backend=None, check_schema=True):
+    """
+    :param backend: name in DATABASE_BACKENDS, DATABASE_BACKEND by default
+    :param check_schema: False to get a database whose schema is behind, to migrate it
+    :return: Database of the backend, check getConnection() before use
+    """
+    backend = backend or DATABASE_BACKEND
+    if backend not in DATABASE_BACKENDS:
+        raise ValueError("Unknown database backend: %s" % backend)
+    return DATABASE_BACKENDS[backend](dbname, check_schema)
 
 class Keystore(db.Model):
     """A single key entry."""
@@ -143,6 +513,29 @@ class Keystore(db.Model):
     def query_keys(cls, ancestor_key):
         return cls.query(ancestor=ancestor_key)
 
+    # Entries are stored with the api key as id, so they are read
+    # with a key get instead of an ancestor query
+
+    @classmethod
+    def get_key(cls, ukey):
+        return cls.get_by_id(ukey)
+
+    @classmethod
+    def get_key_async(cls, ukey):
+        return cls.get_by_id_async(ukey)
+
+    @classmethod
+    def get_keys(cls, ukeys):
+        """
+        :return: the entries of ukeys with one get_multi, None for the missing ones
+        """
+        return db.get_multi([db.Key(cls, ukey) for ukey in ukeys])
+
+    def _post_put_hook(self, future):
+        # A revoked key must not be served from the cache anymore
+        if not self.valid:
+            key_cache.invalidate((self.ukey, self.ip))
+
 def get_ancestor(label, key):
     """
 
@@ -152,6 +545,194 @@ def get_ancestor(label, key):
     """
     return db.Key(label, key)
 
+class SignedKey:
+    """
+    Api key entry read from a signed key, with the Keystore fields used
+    to validate it
+    """
+
+    def __init__(self, ukey, ip, inserted, valid=True):
+        self.ukey = ukey
+        self.ip = ip
+        self.inserted = inserted
+        self.updated = inserted
+        self.valid = valid
+
+def generate_signed_key(ip):
+    """
+    :param ip: ip address of client, the key is bound to
+    :return: an api key signed with APPKEY_SECRET, embedding ip and issue time
+    """
+    if appkey_serializer is None:
+        raise ValueError("APPKEY_SECRET is not configured")
+    return appkey_serializer.dumps(ip)
+
+def is_signed_key(key):
+    """
+    Signed keys have dot separated parts, the base64 of generate_hash_key never has dots
+    """
+    return '.' in key
+
+def read_signed_key(key):
+    """
+    Check the signature of an api key, pure CPU work
+
+    :param key: api key from client
+    :return: SignedKey, None if the signature is not good
+    """
+    if appkey_serializer is None:
+        return None
+    try:
+        ip, inserted = appkey_serializer.loads(key, return_timestamp=True)
+    except BadSignature:
+        return None
+    return SignedKey(key, ip, inserted)
+
+def lookup_signed_key(key, ip, max_time):
+    """
+    Like lookup_key for signed keys, the datastore is only read when
+    APPKEY_REVOCATION is on, and then cached like lookup_key does
+
+    :return: list with the SignedKey, empty if the signature is not good
+    """
+    entry = read_signed_key(key)
+    if entry is None:
+        return []
+    if not APPKEY_REVOCATION:
+        return [entry]
+
+    cached = key_cache.get((key, ip))
+    if cached is not None:
+        return [cached]
+    revoked = Keystore.get_key(key)
+    entry.valid = revoked is None or revoked.valid
+    cache_key_entry(key, ip, entry, max_time)
+    return [entry]
+
+def revoke_key(key):
+    """
+    Revoke an api key storing it as not valid, for signed keys Keystore
+    is the revocation list
+
+    :param key: api key
+    :return: False if the key is not known
+    """
+    stored = Keystore.get_key(key)
+    if stored is not None:
+        stored.valid = False
+        stored.put()
+        return True
+    entry = read_signed_key(key) if is_signed_key(key) else None
+    if entry is None:
+        return False
+    Keystore(id=key, ukey=key, ip=entry.ip, valid=False, user="", password="").put()
+    return True
+
+def cache_key_entry(key, ip, entry, max_time):
+    """
+    Cache a valid key entry for the ip it is bound to, until the key
+    expires and at most KEY_CACHE_TTL seconds
+    """
+    if entry.valid and entry.ip == ip:
+        # inserted is UTC, set by the datastore or read from the signature
+        left = max_time - (datetime.datetime.utcnow() - entry.inserted).total_seconds()
+        key_cache.set((key, ip), entry, min(left, KEY_CACHE_TTL))
+
+def lookup_key(key, ip, max_time):
+    """
+    Get the Keystore entry of an api key, without the datastore round trip
+    when the key was already validated from the same ip. Only valid keys are
+    cached, until the key expires and at most KEY_CACHE_TTL seconds, which
+    bounds how long a revocation made by another instance can go unnoticed.
+
+    :param key: api key from client
+    :param ip: ip address of client
+    :param max_time: max time of api key validity in seconds
+    :return: list with the Keystore entry, empty if the key is not present
+    """
+    if is_signed_key(key):
+        return lookup_signed_key(key, ip, max_time)
+
+    entry = key_cache.get((key, ip))
+    if entry is not None:
+        return [entry]
+
+    stored = Keystore.get_key(key)
+    if stored is None:
+        return []
+    cache_key_entry(key, ip, stored, max_time)
+    return [stored]
+
+def validate_keys(keys, max_time):
+    """
+    Validate many api keys reading the ones not cached with one get_multi
+
+    :param keys: list of (api key, ip address of client)
+    :param max_time: max time of api key validity in seconds
+    :return: list of check_key_validity results, in the order of keys
+    """
+    entries = [None] * len(keys)
+    fetch = []
+    for i, (key, ip) in enumerate(keys):
+        cached = key_cache.get((key, ip))
+        if cached is not None:
+            entries[i] = [cached]
+        elif is_signed_key(key) and not APPKEY_REVOCATION:
+            entries[i] = lookup_signed_key(key, ip, max_time)
+        else:
+            fetch.append(i)
+
+    stored = Keystore.get_keys([keys[i][0] for i in fetch]) if fetch else []
+    for i, entity in zip(fetch, stored):
+        key, ip = keys[i]
+        if is_signed_key(key):
+            # For signed keys the stored entity is a revocation
+            entry = read_signed_key(key)
+            if entry is not None:
+                entry.valid = entity is None or entity.valid
+        else:
+            entry = entity
+        if entry is not None:
+            cache_key_entry(key, ip, entry, max_time)
+        entries[i] = [entry] if entry is not None else []
+
+    return [check_key_validity(a, key, ip, max_time) for a, (key, ip) in zip(entries, keys)]
+
+def list_keys(limit, cursor, state, max_time):
+    """
+    List a page of the api keys, newest first, with a projection query
+    reading only ukey, ip and inserted from the index
+
+    :param limit: size of the page, at most MAX_KEYS_PAGE, None for MAX_KEYS_PAGE
+    :param cursor: urlsafe cursor of the page, None for the first one
+    :param state: 'valid' for the keys not revoked, 'unexpired' for the keys
+                  issued in the last max_time seconds, anything else for all
+    :param max_time: max time of api key validity in seconds
+    :return: (list of key dicts, urlsafe cursor of the next page or None)
+    :raise ValueError: for a limit under 1 or a bad cursor
+    """
+    if limit is None:
+        limit = MAX_KEYS_PAGE
+    if limit < 1:
+        raise ValueError("Bad limit: %s, must be at least 1" % limit)
+    limit = min(limit, MAX_KEYS_PAGE)
+    try:
+        start = db.Cursor(urlsafe=cursor) if cursor else None
+    except datastore_errors.BadValueError:
+        raise ValueError("Bad cursor: %s" % cursor)
+
+    query = Keystore.query()
+    if state == 'valid':
+        query = query.filter(Keystore.valid == True)
+    elif state == 'unexpired':
+        query = query.filter(Keystore.inserted > datetime.datetime.utcnow() - datetime.timedelta(seconds=max_time))
+    query = query.order(-Keystore.inserted)
+
+    entries, next_cursor, more = query.fetch_page(limit, start_cursor=start,
+                                                  projection=[Keystore.ukey, Keystore.ip, Keystore.inserted])
+    keys = [{'key': e.ukey, 'ip': e.ip, 'inserted': e.inserted.isoformat()} for e in entries]
+    return keys, next_cursor.urlsafe() if more and next_cursor else None
+
 def generate_hash_key():
     """
     @return: A hashkey for use to authenticate agains the API.
@@ -162,11 +743,11 @@ def generate_hash_key():
 
 def calculate_time_delta(inserted, max_time):
     """
-    :param inserted: time of first api key generation and db insertion
+    :param inserted: UTC time of first api key generation and db insertion
     :param max_time: max time of api key validity in seconds
     :return: True if delta time < max_time
     """
-    time1 = datetime.datetime.now()
+    time1 = datetime.datetime.utcnow()
     return round((time1 - inserted).total_seconds()) <= max_time
 
 def check_key_validity(a, key, ip, max):
@@ -180,6 +761,8 @@ def check_key_validity(a, key, ip, max):
     :return : True if valid, json message if False
     """
     if a:
+        if not a[0].valid:
+            return {"Appkey revoked": key}
         issameip = a[0].ip == ip
         valtime = calculate_time_delta(a[0].inserted, max)
         if issameip:
@@ -193,119 +776,222 @@ def check_key_validity(a, key, ip, max):
         return {"Error Appkey not present ": key}
 
 
-def check_websitepresence(url, data):
+def url_hash(url):
     """
+    Key of the url in websites, the urls can be longer than an index allows
 
-    :param url: website scanned
-    :param data : db pointer
-    :return:
+    :param url:
+    :return: sha1 of the url, hex
     """
+    if isinstance(url, unicode):
+        url = url.encode('utf-8')
+    return hashlib.sha1(url).hexdigest()
 
-    cwquery = "SELECT COUNT(*) from websites WHERE url='{0}'".format(url)
-    r = data.squery(cwquery)
-    if r is None:
-        return 0
-    else:
-        return r
-
-    return r
-
-def get_frequency(hashed, data):
+def find_stored_page(page, fingerprint, data):
     """
-
-    :param hash:
-    :param data : db pointer
-    :return:
+    :param page: url of the page
+    :param fingerprint: simhash of the page, None to only look for its url
+    :return: url of the page stored under the same url, or with a simhash
+             within MAX_DISTANCE bits, None if there is none or on error
     """
-    clquery = "SELECT frequency from wordlist WHERE sword='{0}'".format(hashed)
-    r = data.squery(clquery)
-    return r
+    r = data.squery("SELECT url FROM pages WHERE url_hash=%s", (url_hash(page),))
+    if r is not None or fingerprint is None:
+        return r[0] if r is not None else None
+    # A near fingerprint has at least one block equal, see components/simhash.py
+    blocks = split_blocks(fingerprint)
+    rows = data.query("SELECT url, simhash FROM pages WHERE " +
+                      " OR ".join("block%d=%%s" % i for i in range(len(blocks))), blocks)
+    near = [(hamming(fingerprint, int(row['simhash'], 16)), row['url']) for row in rows]
+    near = [n for n in near if n[0] <= MAX_DISTANCE]
+    return min(near)[1] if near else None
 
-def check_wordpresence(hashed, data):
+def insert_wordlist(mlist, server, data, site=None, page=None, fingerprint=None):
     """
+    Add the words to wordlist, the frequency of the words already there
+    is increased, in BULK_CHUNK_SIZE rows by statement and one commit.
+    The counts of the site and the top words are updated in the same
+    transaction. The words of a page are stored once: a page whose url,
+    or a near duplicate of it, is in pages adds nothing. The words longer
+    than schema.MAX_WORD_LENGTH are not stored
 
-    :param hash:
-    :param data : db pointer
-    :return:
+    :param list: worl list, (word, frequency)
+    :param site: site of the words, the host of the page, in websites, None for none
+    :param page: url of the page of the words, None to not record it
+    :param fingerprint: simhash of the page, None if too short to have one
+    :return: [message, "record : <words stored>"], and "duplicate of : <url>"
+             when the page was not stored
     """
-    clquery = "SELECT COUNT(*) from wordlist WHERE sword='{0}'".format(hashed)
-    r = data.squery(clquery)
-    if r is None:
-        return 0
-    else:
-        return r
 
-def update_wordfrequency(hashed, revvalue, addvalue, data):
+    if data.getConnection() is None:
+        return data.getMessage()
+    #else:
+    #    return data.getCursor()
+
+    if page is not None:
+        duplicate_of = find_stored_page(page, fingerprint, data)
+        if data.getMessage() is not None:
+            return [data.getMessage(), "record : 0"]
+        if duplicate_of is not None:
+            return [None, "record : 0", "duplicate of : " + duplicate_of]
+
+    site_id = None
+    if site is not None:
+        site_id = get_site_id(site, data, add=True)
+        if site_id is None:
+            return [data.getMessage(), "record : 0"]
+
+    client_key = server.publickey()
+    rows = []
+    for a in mlist[:MAX_LIST_RECORD]:
+        # Too long for the sword columns, strict MySQL would fail the transaction
+        if len(a[0].strip()) > schema.MAX_WORD_LENGTH:
+            continue
+        word = a[0].encode('utf-8').strip()
+        encrypted = client_key.encrypt(word, 32)
+        rows.append((word, b64encode(encrypted[0]), a[1]))
+
+    r = 0
+    if page is not None:
+        # In the transaction of the words: a page stored meanwhile by
+        # another request fails on the url key, and nothing is added
+        blocks = split_blocks(fingerprint) if fingerprint is not None else [None] * (MAX_DISTANCE + 1)
+        r = data.insert_many("INSERT INTO pages (`url`, `url_hash`, `simhash`, `block0`, `block1`, `block2`, `block3`) VALUES",
+                             [(page, url_hash(page), "%016x" % fingerprint if fingerprint is not None else None) + tuple(blocks)],
+                             commit=False)
+    if r is not None:
+        r = data.insert_many("INSERT INTO wordlist (`sword`, `eword`, `frequency`) VALUES", rows,
+                             data.upsert("sword", "frequency"), commit=False)
+    if r is not None and rows:
+        r = update_word_totals(rows, site_id, data)
+    if r is not None and not data.commit():
+        r = None
+
+    mylist = []
+    mylist.append(data.getMessage())
+    mylist.append("record : "+str(len(rows) if r is not None else 0))
+    return mylist
+
+def update_word_totals(rows, site_id, data):
     """
+    Add the words of a page to the counts of its site, and put the words
+    that now rank among the top words in topwords, in the open transaction
 
-    :param word:
-    :param value:
-    :return:
+    :param rows: (word, encrypted word, frequency) written to wordlist
+    :param site_id: id of the site in websites, None for none
+    :return: None on error, the transaction is then rolled back
     """
-    sum = revvalue + addvalue
-    uwquery = "INSERT UPDATE wordlist SET `frequency`={0} where sword='{1}".format(sum, hashed)
-    data.insert(uwquery)
+    marks = ", ".join(["%s"] * len(rows))
+    totals = data.query("SELECT id, sword, frequency FROM wordlist WHERE sword IN (%s)" % marks,
+                        [row[0] for row in rows])
+    if data.getMessage() is not None:
+        data.rollback()
+        return None
+    r = update_topwords(0, [(t['sword'], t['frequency']) for t in totals], data)
 
-    return
+    if r is not None and site_id is not None:
+        added = dict((row[0], row[2]) for row in rows)
+        site_rows = [(site_id, t['id'], added[t['sword']]) for t in totals if t['sword'] in added]
+        r = data.insert_many("INSERT INTO site_words (`site_id`, `word_id`, `frequency`) VALUES", site_rows,
+                             data.upsert(("site_id", "word_id"), "frequency"), commit=False)
+        if r is not None:
+            site_totals = data.query("SELECT w.sword, s.frequency FROM site_words s JOIN wordlist w ON w.id = s.word_id "
+                                     "WHERE s.site_id = %s AND s.word_id IN (" + marks + ")",
+                                     [site_id] + [t['id'] for t in totals])
+            if data.getMessage() is not None:
+                data.rollback()
+                return None
+            r = update_topwords(site_id, [(t['sword'], t['frequency']) for t in site_totals], data)
+    return r
 
-def insert_wordlist(mlist, server, data):
+def update_topwords(site_id, totals, data):
     """
+    Keep the TOPWORDS_SIZE most frequent words of a site in topwords.
+    The counts only grow, so only the words just counted can enter it:
+    the ones above its least frequent word are put in, and the words
+    pushed out of it are deleted, in the open transaction
 
-    :param list: worl list
-    :return:
+    :param site_id: id of the site in websites, 0 for all the sites
+    :param totals: (word, frequency) of the words just counted
+    :return: None on error, the transaction is then rolled back
     """
+    r = data.squery("SELECT COUNT(*), MIN(frequency) FROM topwords WHERE site_id=%s", (site_id,))
+    if r is None:
+        data.rollback()
+        return None
+    size, lowest = r
+    if size >= schema.TOPWORDS_SIZE:
+        totals = [(word, frequency) for word, frequency in totals if frequency > lowest]
+    if not totals:
+        return 0
 
-    if data.getConnection() is None:
-        return data.getMessage()
-    #else:
-    #    return data.getCursor()
+    r = data.insert_many("INSERT INTO topwords (`site_id`, `sword`, `frequency`) VALUES",
+                         [(site_id, word, frequency) for word, frequency in totals],
+                         data.upsert(("site_id", "sword"), "frequency", add=False), commit=False)
+    if r is not None and size + len(totals) > schema.TOPWORDS_SIZE:
+        last = data.squery("SELECT frequency FROM topwords WHERE site_id=%s "
+                           "ORDER BY frequency DESC LIMIT 1 OFFSET %s", (site_id, schema.TOPWORDS_SIZE - 1))
+        if last is None and data.getMessage() is not None:
+            data.rollback()
+            return None
+        if last is not None:
+            # The words as frequent as the last one kept stay
+            r = data.execute("DELETE FROM topwords WHERE site_id=%s AND frequency < %s", (site_id, last[0]))
+    return r
 
-    mylist = []
-    i = 0
-    for a in mlist[:MAX_LIST_RECORD]:
-        word = MySQLdb.escape_string(a[0].encode('utf-8')).strip()
+def get_top_words(site, limit, data):
+    """
+    Most frequent words of the word wall, read from topwords
 
-        hashed =  SHA256.new(word).hexdigest()
-        client_key = server.publickey()
-        encrypted = client_key.encrypt(word, 32)
-        ecc = b64encode(encrypted[0])
-        freq = a[1]
-        r = check_wordpresence(word, data)
-        if int(r[0]) == 0:
-            i += 1
-            lquery = "INSERT INTO wordlist (`sword`, `eword`, `frequency`) VALUES ('{0}', '{1}', {2})".format(word, ecc, freq)
-            mylist.append(lquery)
-            data.insert(lquery)
-        else:
-            k = get_frequency(word, data)
-            return r
-            update_wordfrequency(word, k, freq, data)
+    :param site: host of the site, or the url of one of its pages, None for all the sites
+    :param limit: max number of words, at most TOPWORDS_SIZE
+    :return: list of (word, frequency), reversed by frequency, None on error
+    :raise ValueError: on a limit out of range
+    """
+    if not 0 < limit <= schema.TOPWORDS_SIZE:
+        raise ValueError("limit must be between 1 and %d" % schema.TOPWORDS_SIZE)
+    site_id = 0
+    if site:
+        site_id = get_site_id(site_of(site) if '://' in site else site.lower(), data)
+        if site_id is None:
+            return [] if data.getMessage() is None else None
 
-    mylist.append(data.getMessage())
-    mylist.append("record : "+str(i))
-    return mylist
+    rows = data.query("SELECT sword, frequency FROM topwords WHERE site_id=%s "
+                      "ORDER BY frequency DESC, sword LIMIT %s", (site_id, limit))
+    if data.getMessage() is not None:
+        return None
+    return [(row['sword'].decode('utf-8', 'replace'), row['frequency']) for row in rows]
 
-def insert_websites(website, data):
+def store_page(url, counts, fingerprint):
     """
+    Store the MAX_LIST_RECORD most frequent words of the page of url in
+    the word wall, under the site of the page, see insert_wordlist
 
-    :param list: website scanned
-    :param data : db pointer
-    :return:
+    :param counts: Counter of the words of the page
+    :param fingerprint: simhash of the page, see count_page
+    :return: result of insert_wordlist, None when WORDWALL_KEY_FILE is not set
     """
-    wb = website.strip()
+    if wordwall_key is None:
+        return None
+    data = get_database(WORDWALL_DB)
+    try:
+        return insert_wordlist(counts.most_common(MAX_LIST_RECORD), wordwall_key, data,
+                               site=site_of(url), page=url, fingerprint=fingerprint)
+    finally:
+        data.close()
 
-    if data.getConnection() is None:
-        return data.getMessage()
-    #else:
-    #    return data.getCursor()
-    r = check_websitepresence(wb, data)
-    if int(r[0]) == 0:
-        wquery = "INSERT INTO websites (`url`) VALUES ('{0}')".format(wb)
-        data.insert(wquery)
-
-        return wquery
-    else:
-        return ""
+def get_site_id(site, data, add=False):
+    """
+    :param site: site, the host of its pages
+    :param add: True to add the site to websites when it is not there
+    :return: id of the site in websites, None if not there or on error
+    """
+    key = url_hash(site)
+    r = data.squery("SELECT id FROM websites WHERE url_hash=%s", (key,))
+    if r is None and add and data.getMessage() is None:
+        # Added by another request meanwhile, the duplicate is not inserted
+        data.insert("INSERT INTO websites (`url`, `url_hash`) VALUES (%s, %s)", (site, key))
+        r = data.squery("SELECT id FROM websites WHERE url_hash=%s", (key,))
+    return r[0] if r is not None else None
 
 def tag_visible(element):
     """
@@ -322,27 +1008,198 @@ def tag_visible(element):
 
 def text_from_html(body):
     """
-    Create a parser
+    Visible text of the page, by the rules of tag_visible, without
+    building the tree of the page
 
     :param body:
     :return:
     """
-    soup = BeautifulSoup(body, 'html.parser')
-    texts = soup.findAll(text=True)
-    visible_texts = filter(tag_visible, texts)
-    return u" ".join(t.strip() for t in visible_texts)
+    return visible_text(body)
+
+def count_words(url, links=None):
+    """
+    Fetch url and count its words, without the stopwords
+
+    :param url:
+    :param links: list to add the href of the links of the page to
+    :return: Counter of the words
+    """
+    return count_page(url, links)[0]
+
+def memo_validator(response):
+    """
+    Key of word_memo known before the body is read, from the headers that
+    identify the content of the page
 
-def get_word_list(url):
+    :return: key of the Content-MD5, or of the strong ETag of the url, None without them
     """
-    Get a list of words from url, drop exclusion list
+    md5 = response.headers.get('content-md5')
+    if md5:
+        return ('content-md5', md5, response.charset)
+    etag = response.headers.get('etag')
+    if etag and not etag.startswith('W/'):
+        return ('etag', response.url, etag, response.charset)
+    return None
+
+def count_page(url, links=None):
+    """
+    Fetch url and count its words, without the stopwords.
+    The body is hashed before it is parsed: a page whose content was
+    counted before, from any url, or whose Content-MD5 or strong ETag was,
+    is not parsed again.
+    The near duplicates are found by the callers from the simhash, see
+    insert_wordlist, scan_urls and crawl_site
+
+    :param url:
+    :param links: list to add the href of the links of the page to
+    :return: (Counter of the words, simhash of the page, None if too short)
+    """
+    response = page_fetcher.stream(url)
+    if response.code != 200:
+        # Read to the end, so the connection goes back to the pool
+        for _ in response.chunks:
+            pass
+        raise FetchError("HTTP %d: %s" % (response.code, url))
+
+    stopwords = get_stopwords(STOPWORDS_LANGUAGE)
+    validator = memo_validator(response)
+    memo = word_memo.get(validator) if validator is not None else None
+    if memo is not None:
+        # Counted with other stopwords, count again
+        if memo[0] == stopwords.version:
+            for _ in response.chunks:
+                pass
+            if links is not None:
+                links.extend(memo[2])
+            return Counter(memo[1]), memo[3]
+        word_memo.invalidate(validator)
+
+    # Held until it is hashed, the fetcher caps it at its max_body_size
+    digest = hashlib.sha1()
+    chunks = []
+    for chunk in response.chunks:
+        digest.update(chunk)
+        chunks.append(chunk)
+    # Same bytes in another charset are another text
+    memo_key = ('sha1', digest.hexdigest(), response.charset)
+    memo = word_memo.get(memo_key)
+    if memo is not None and memo[0] != stopwords.version:
+        word_memo.invalidate(memo_key)
+        memo = None
+
+    if memo is None:
+        # Parsed a chunk at a time, only the words and the links are kept
+        page_links = []
+        texts = iter_visible_text(chunks, response.charset, page_links)
+        if sum(len(chunk) for chunk in chunks) >= PARALLEL_THRESHOLD:
+            # Large pages may have enough text to count on several cores
+            counts = count_tokens_parallel(list(texts), stopwords)
+        else:
+            counts = count_tokens(texts, stopwords)
+        memo = (stopwords.version, counts, tuple(page_links), simhash(counts))
+        word_memo.set(memo_key, memo)
+    if validator is not None:
+        word_memo.set(validator, memo)
+    if links is not None:
+        links.extend(memo[2])
+    # A copy, the memoized counts are shared
+    return Counter(memo[1]), memo[3]
+
+def check_rank_params(k, offset, min_frequency):
+    """
+    :raise ValueError: on a k, offset or min_frequency out of range
+    """
+    if not 0 < k <= MAX_TOP_WORDS:
+        raise ValueError("k must be between 1 and %d" % MAX_TOP_WORDS)
+    if offset < 0 or min_frequency < 1:
+        raise ValueError("offset must be positive and min_frequency at least 1")
+    # The heap of rank_words holds offset + k words
+    if offset + k > MAX_TOP_WORDS:
+        raise ValueError("offset + k must be at most %d" % MAX_TOP_WORDS)
+
+def rank_words(counts, k=TOP_WORDS, offset=0, min_frequency=1):
+    """
+    Most frequent words, selected with a heap of offset + k words
+    instead of sorting them all
+
+    :param counts: Counter of the words
+    :param k: max number of words returned
+    :param offset: number of most frequent words skipped, offset + k at most MAX_TOP_WORDS
+    :param min_frequency: min count of the words returned
+    :return: list of (word, count), reversed by count
+    :raise ValueError: on a k, offset or min_frequency out of range
+    """
+    check_rank_params(k, offset, min_frequency)
+    ranked = counts.most_common(offset + k)[offset:]
+    if min_frequency > 1:
+        ranked = [(word, count) for word, count in ranked if count >= min_frequency]
+    return ranked
+
+def get_word_list(url, k=TOP_WORDS, offset=0, min_frequency=1):
+    """
+    Get a list of words from url, drop the stopwords
     reverse and count instance of single word
     :param url:
-    :return:
+    :return: the k most frequent words after offset, see rank_words
+    """
+    # Before fetching anything
+    check_rank_params(k, offset, min_frequency)
+    return rank_words(count_words(url), k, offset, min_frequency)
+
+def scan_urls(urls, concurrency=SCAN_CONCURRENCY):
     """
-    html = urllib.urlopen(url).read()
-    lines = text_from_html(html).lower()
-    wordlist = [w for w in lines.split()]
-    result = [x for x in wordlist if x not in wordnot]
-    counts = list(reversed(sorted(Counter(result).items(),key=lambda x:x[1])))[10:]
-    return counts
+    Count the words of many urls, fetching at most concurrency of them at
+    the same time, so a scan takes about as long as its slowest page.
+    A url that fails does not fail the others
 
+    :param urls: list of urls
+    :param concurrency: max pages fetched at the same time
+    :return: (dict url -> word list, {"error": message} or {"duplicate_of": url},
+              Counter merging all the pages but the near duplicates)
+    """
+    results = {}
+    merged = Counter()
+    if not urls:
+        return results, merged
+
+    # Pages merged by this scan, a near duplicate of one of them is not merged again
+    merged_pages = SimHashIndex()
+    executor = ThreadPoolExecutor(max_workers=min(concurrency, len(urls)))
+    try:
+        futures = dict((executor.submit(count_page, url), url) for url in urls)
+        for future in as_completed(futures):
+            url = futures[future]
+            try:
+                counts, fingerprint = future.result()
+            except Exception as e:
+                results[url] = {"error": str(e)}
+                continue
+            if fingerprint is not None:
+                near = merged_pages.find(fingerprint)
+                if near is not None:
+                    results[url] = {"duplicate_of": near[0]}
+                    continue
+                merged_pages.add(fingerprint, url)
+            results[url] = rank_words(counts)
+            merged.update(counts)
+    finally:
+        executor.shutdown(wait=False)
+    return results, merged
+
+def crawl_site(url, depth, pages):
+    """
+    Count the words of the pages of the site of url, following its links
+    to the same site
+
+    :param url: seed url
+    :param depth: links followed from the seed, at most MAX_CRAWL_DEPTH
+    :param pages: pages fetched at most, at most MAX_CRAWL_PAGES
+    :return: CrawlResult, with the Counter merging all the pages but the near duplicates
+    :raise ValueError: on a depth or pages out of range
+    """
+    if not 0 <= depth <= MAX_CRAWL_DEPTH:
+        raise ValueError("depth must be between 0 and %d" % MAX_CRAWL_DEPTH)
+    if not 0 < pages <= MAX_CRAWL_PAGES:
+        raise ValueError("pages must be between 1 and %d" % MAX_CRAWL_PAGES)
+    # The crawl finds the near duplicates among its own pages
+    return Crawler(count_page, depth, pages, SCAN_CONCURRENCY).crawl(url)
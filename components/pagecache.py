@@ -0,0 +1,382 @@
+"""
+Cache of the fetched pages, by url.
+
+A memory LRU tier in front of an optional disk tier, both bounded in
+bytes. A page is served from the cache for the max-age of its
+Cache-Control, then it is revalidated with If-None-Match and
+If-Modified-Since, and a 304 reuses the stored body.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from components.fetcher import FetchResponse
+
+MEMORY_SIZE = 32 * 1024 * 1024
+DISK_SIZE = 512 * 1024 * 1024
+# Larger pages are fetched every time
+MAX_ENTRY_SIZE = 2 * 1024 * 1024
+# Response headers stored with the body
+STORED_HEADERS = ('content-type', 'cache-control', 'etag', 'last-modified')
+
+
+def parse_cache_control(value):
+    """
+    :param value: Cache-Control header
+    :return: dict directive -> argument, None for the directives without one
+    """
+    directives = {}
+    for part in value.split(','):
+        name, sep, arg = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = arg.strip().strip('"') if sep else None
+    return directives
+
+
+def expiry(headers, now):
+    """
+    :param headers: response headers, lower case names
+    :param now: time the response was received
+    :return: time until which the page can be used without revalidation,
+             None when the page must not be stored
+    """
+    directives = parse_cache_control(headers.get('cache-control', ''))
+    if 'no-store' in directives:
+        return None
+    max_age = 0
+    if 'no-cache' not in directives:
+        try:
+            max_age = int(directives.get('max-age') or 0) - int(headers.get('age') or 0)
+        except ValueError:
+            max_age = 0
+    if max_age > 0:
+        return now + max_age
+    # Stale from the start, worth storing only if it can be revalidated
+    if 'etag' in headers or 'last-modified' in headers:
+        return now
+    return None
+
+
+class CachedPage:
+
+    def __init__(self, url, code, headers, body, expires):
+        """
+        :param url: url of the page, after the redirects
+        :param headers: the STORED_HEADERS of the response
+        :param expires: time until which the page is fresh
+        """
+        self.url = url
+        self.code = code
+        self.headers = headers
+        self.body = body
+        self.expires = expires
+
+    @property
+    def size(self):
+        return len(self.body)
+
+    def is_fresh(self, now):
+        return now < self.expires
+
+    def validators(self):
+        """
+        :return: headers of the conditional request revalidating the page
+        """
+        headers = {}
+        if 'etag' in self.headers:
+            headers['If-None-Match'] = self.headers['etag']
+        if 'last-modified' in self.headers:
+            headers['If-Modified-Since'] = self.headers['last-modified']
+        return headers
+
+    def revalidated(self, headers, now):
+        """
+        Take the headers of a 304, they may update the validators and the max-age
+
+        :return: False if the page must not be stored any more
+        """
+        for name in STORED_HEADERS:
+            if name in headers and name != 'content-type':
+                self.headers[name] = headers[name]
+        expires = expiry(self.headers, now)
+        if expires is None:
+            return False
+        self.expires = expires
+        return True
+
+    def response(self):
+        return FetchResponse(self.url, self.code, dict(self.headers), chunks=iter([self.body]))
+
+    def dumps(self):
+        """
+        :return: bytes of the disk file, a json line of the metadata then the body
+        """
+        meta = {"url": self.url, "code": self.code, "headers": self.headers, "expires": self.expires}
+        return json.dumps(meta).encode('utf-8') + b"\n" + self.body
+
+    @classmethod
+    def loads(cls, data):
+        meta, _, body = data.partition(b"\n")
+        meta = json.loads(meta.decode('utf-8'))
+        return cls(meta["url"], meta["code"], meta["headers"], body, meta["expires"])
+
+
+class PageCache:
+    """
+    Pages by url in a memory LRU tier, and a disk tier when a directory
+    is given. The disk tier keeps its pages over restarts, its index is
+    rebuilt from the directory, least recently modified first
+    """
+
+    def __init__(self, directory=None, memory_size=MEMORY_SIZE, disk_size=DISK_SIZE,
+                 max_entry_size=MAX_ENTRY_SIZE):
+        self.directory = directory
+        self.memory_size = memory_size
+        self.disk_size = disk_size
+        self.max_entry_size = max_entry_size
+        self.lock = threading.Lock()
+        # url -> CachedPage and file name -> size, least recently used first
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        self.disk = OrderedDict()
+        self.disk_bytes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.evictions = 0
+        if directory:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            self._load_index()
+
+    def _load_index(self):
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.tmp'):
+                os.remove(path)
+            elif os.path.isfile(path):
+                stat = os.stat(path)
+                files.append((stat.st_mtime, name, stat.st_size))
+        for mtime, name, size in sorted(files):
+            self.disk[name] = size
+            self.disk_bytes += size
+        self._evict_disk()
+
+    @staticmethod
+    def _file_name(url):
+        return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+    def get(self, url):
+        """
+        :return: CachedPage, fresh or not, None if not cached
+        """
+        with self.lock:
+            page = self.memory.pop(url, None)
+            if page is not None:
+                self.memory[url] = page
+                self.memory_hits += 1
+                return page
+            name = self._file_name(url)
+            if name not in self.disk:
+                return None
+            self.disk[name] = self.disk.pop(name)
+
+        try:
+            with open(os.path.join(self.directory, name), 'rb') as f:
+                page = CachedPage.loads(f.read())
+        except (IOError, OSError, ValueError, KeyError):
+            # Evicted meanwhile, or a damaged file
+            return None
+        with self.lock:
+            self.disk_hits += 1
+            self._put_memory(url, page)
+        return page
+
+    def put(self, url, page):
+        """
+        Store the page in both tiers, unless it is larger than max_entry_size
+        """
+        if page.size > self.max_entry_size:
+            return
+        with self.lock:
+            self._put_memory(url, page)
+        if not self.directory:
+            return
+
+        name = self._file_name(url)
+        data = page.dumps()
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            # A reader never sees a partly written file
+            os.rename(tmp, os.path.join(self.directory, name))
+        except (IOError, OSError):
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+        with self.lock:
+            self.disk_bytes += len(data) - self.disk.pop(name, 0)
+            self.disk[name] = len(data)
+            self._evict_disk()
+
+    def _put_memory(self, url, page):
+        old = self.memory.pop(url, None)
+        if old is not None:
+            self.memory_bytes -= old.size
+        self.memory[url] = page
+        self.memory_bytes += page.size
+        while self.memory_bytes > self.memory_size and self.memory:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= evicted.size
+            self.evictions += 1
+
+    def _evict_disk(self):
+        while self.disk_bytes > self.disk_size and self.disk:
+            name, size = self.disk.popitem(last=False)
+            self.disk_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def discard(self, url):
+        with self.lock:
+            page = self.memory.pop(url, None)
+            if page is not None:
+                self.memory_bytes -= page.size
+            size = self.disk.pop(self._file_name(url), None) if self.directory else None
+            if size is not None:
+                self.disk_bytes -= size
+                try:
+                    os.remove(os.path.join(self.directory, self._file_name(url)))
+                except OSError:
+                    pass
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            self.memory_bytes = 0
+            for name in self.disk:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+            self.disk.clear()
+            self.disk_bytes = 0
+
+
+class CachingFetcher:
+    """
+    PageFetcher answering from a PageCache, same fetch and stream methods
+    """
+
+    def __init__(self, fetcher, cache):
+        self.fetcher = fetcher
+        self.cache = cache
+        self.lock = threading.Lock()
+        # Fresh pages served, stale pages answered with a 304, pages downloaded
+        self.hits = 0
+        self.revalidations = 0
+        self.misses = 0
+        # Body bytes not downloaded, and time spent downloading the misses
+        self.bytes_saved = 0
+        self.miss_seconds = 0.0
+
+    def fetch(self, url, headers=None):
+        response = self.stream(url, headers)
+        response.body = b"".join(response.chunks)
+        response.chunks = None
+        return response
+
+    def stream(self, url, headers=None):
+        """
+        :param headers: extra request headers, the page is neither cached nor
+                        read from the cache, it could differ
+        """
+        if headers:
+            return self.fetcher.stream(url, headers)
+
+        now = time.time()
+        page = self.cache.get(url)
+        if page is not None and page.is_fresh(now):
+            self._count(hits=1, bytes_saved=page.size)
+            return page.response()
+
+        started = time.time()
+        response = self.fetcher.stream(url, page.validators() if page is not None else None)
+        if page is not None and response.code == 304:
+            for _ in response.chunks:
+                pass
+            if page.revalidated(response.headers, time.time()):
+                self.cache.put(url, page)
+            else:
+                self.cache.discard(url)
+            self._count(revalidations=1, bytes_saved=page.size)
+            return page.response()
+
+        response.chunks = self._read_miss(url, response, response.chunks, started)
+        return response
+
+    def _read_miss(self, url, response, body_chunks, started):
+        store = response.code == 200
+        chunks = []
+        size = 0
+        for chunk in body_chunks:
+            if store:
+                size += len(chunk)
+                if size > self.cache.max_entry_size:
+                    store = False
+                    chunks = None
+                else:
+                    chunks.append(chunk)
+            yield chunk
+
+        now = time.time()
+        self._count(misses=1, miss_seconds=now - started)
+        expires = expiry(response.headers, now) if store else None
+        if expires is not None:
+            headers = dict((k, v) for k, v in response.headers.items() if k in STORED_HEADERS)
+            self.cache.put(url, CachedPage(response.url, response.code, headers, b"".join(chunks), expires))
+
+    def _count(self, hits=0, revalidations=0, misses=0, bytes_saved=0, miss_seconds=0.0):
+        with self.lock:
+            self.hits += hits
+            self.revalidations += revalidations
+            self.misses += misses
+            self.bytes_saved += bytes_saved
+            self.miss_seconds += miss_seconds
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "revalidations": self.revalidations, "misses": self.misses,
+                    "bytes_saved": self.bytes_saved, "miss_seconds": self.miss_seconds,
+                    "memory_hits": self.cache.memory_hits, "disk_hits": self.cache.disk_hits,
+                    "evictions": self.cache.evictions, "memory_bytes": self.cache.memory_bytes,
+                    "disk_bytes": self.cache.disk_bytes}
+
+    def collect(self):
+        """
+        Collector of a MetricsRegistry
+
+        :return: list of (name, type, help, value)
+        """
+        stats = self.stats()
+        return [
+            ("page_cache_hits_total", "counter", "Pages served fresh from the cache.", stats["hits"]),
+            ("page_cache_revalidations_total", "counter", "Stale pages the server answered with a 304.",
+             stats["revalidations"]),
+            ("page_cache_misses_total", "counter", "Pages downloaded.", stats["misses"]),
+            ("page_cache_saved_bytes_total", "counter", "Body bytes served from the cache instead of downloaded.",
+             stats["bytes_saved"]),
+            ("page_cache_miss_seconds_total", "counter", "Time spent downloading the pages not in the cache.",
+             stats["miss_seconds"]),
+            ("page_cache_evictions_total", "counter", "Pages evicted from a tier of the cache.", stats["evictions"]),
+            ("page_cache_memory_bytes", "gauge", "Bytes of the pages in the memory tier.", stats["memory_bytes"]),
+            ("page_cache_disk_bytes", "gauge", "Bytes of the pages in the disk tier.", stats["disk_bytes"]),
+        ]
@@ -0,0 +1,124 @@
+"""
+Delete the Keystore entries of the expired and revoked api keys.
+
+Runs in process, from the /reapkeys cron handler or the thread of
+KeyReaper.start, or from the command line through remote_api:
+
+    $ python -m components.reaper --host gigichallange.appspot.com
+"""
+import argparse
+import datetime
+import json
+import logging
+import threading
+import time
+from google.appengine.ext import ndb as db
+from components.helpers import Keystore
+from components.helpers import is_signed_key
+
+# Same as MainHandler.MAXKEYVALTIME
+MAX_KEY_TIME = 900
+REAP_BATCH_SIZE = 500
+REAP_MAX_PER_SECOND = 1000
+
+
+class KeyReaper:
+    """
+    Find the keys to delete with keys only queries and delete them in
+    batches, at most max_per_second keys per second
+    """
+
+    def __init__(self, max_time=MAX_KEY_TIME, batch_size=REAP_BATCH_SIZE, max_per_second=REAP_MAX_PER_SECOND):
+        """
+        :param max_time: max time of api key validity in seconds
+        :param batch_size: keys fetched and deleted at once
+        :param max_per_second: max keys deleted per second, None for no limit
+        """
+        self.max_time = max_time
+        self.batch_size = batch_size
+        self.max_per_second = max_per_second
+        # Totals of all the runs
+        self.runs = 0
+        self.expired = 0
+        self.revoked = 0
+        self.batches = 0
+
+    def run(self, deadline=None):
+        """
+        Delete the expired keys, then the revoked ones
+
+        :param deadline: seconds after which to stop, the next run goes on from there
+        :return: dict with the counts of this run
+        """
+        stop = time.time() + deadline if deadline else None
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=self.max_time)
+
+        expired, expired_batches = self._reap(Keystore.query(Keystore.inserted < cutoff), stop)
+        # A revoked signed key must stay in the revocation list until it expires
+        revoked, revoked_batches = self._reap(Keystore.query(Keystore.valid == False), stop,
+                                              lambda key: not is_signed_key(key.id()))
+
+        self.runs += 1
+        self.expired += expired
+        self.revoked += revoked
+        self.batches += expired_batches + revoked_batches
+        return {"expired": expired, "revoked": revoked, "batches": expired_batches + revoked_batches}
+
+    def _reap(self, query, stop, keep=None):
+        deleted = 0
+        batches = 0
+        cursor = None
+        more = True
+        while more and (stop is None or time.time() < stop):
+            started = time.time()
+            keys, cursor, more = query.fetch_page(self.batch_size, start_cursor=cursor, keys_only=True)
+            if keep is not None:
+                keys = [k for k in keys if keep(k)]
+            if keys:
+                db.delete_multi(keys)
+                deleted += len(keys)
+                batches += 1
+            if self.max_per_second:
+                wait = float(len(keys)) / self.max_per_second - (time.time() - started)
+                if wait > 0:
+                    time.sleep(wait)
+        return deleted, batches
+
+    def stats(self):
+        return {"runs": self.runs, "expired": self.expired, "revoked": self.revoked, "batches": self.batches}
+
+    def start(self, interval):
+        """
+        Run every interval seconds on a daemon thread, for the standalone
+        server: App Engine instances run it from cron.yaml instead
+        """
+        def loop():
+            while True:
+                try:
+                    self.run()
+                except Exception:
+                    logging.exception("Key reaper run failed")
+                time.sleep(interval)
+
+        thread = threading.Thread(target=loop, name="key-reaper")
+        thread.daemon = True
+        thread.start()
+        return thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Delete the expired and revoked api keys")
+    parser.add_argument("--host", required=True, help="app to reap through remote_api")
+    parser.add_argument("--max-time", type=int, default=MAX_KEY_TIME)
+    parser.add_argument("--batch-size", type=int, default=REAP_BATCH_SIZE)
+    parser.add_argument("--max-per-second", type=int, default=REAP_MAX_PER_SECOND)
+    args = parser.parse_args()
+
+    from google.appengine.ext.remote_api import remote_api_stub
+    remote_api_stub.ConfigureRemoteApiForOAuth(args.host, '/_ah/remote_api')
+
+    reaper = KeyReaper(args.max_time, args.batch_size, args.max_per_second)
+    print json.dumps(reaper.run())
+
+if __name__ == '__main__':
+    main()
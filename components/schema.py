@@ -0,0 +1,325 @@
+"""
+Versioned migrations of the schema of the word wall, MySQL and SQLite.
+
+Each migration has a version, applied once and recorded in the
+schema_version table. They are run by a deploy or admin step, /migrate,
+never by the requests, which refuse a database whose schema is behind.
+The migrations check the state of the schema before each change, so one
+interrupted halfway, by a deadline or a lost connection, is finished by
+the next run. A MySQL named lock keeps two instances from running them
+at the same time. The SQLite databases are new ones, made with the keys
+from the start.
+"""
+
+SCHEMA_LOCK = 'wordwall_schema'
+# Seconds waited for the lock held by another instance
+SCHEMA_LOCK_TIMEOUT = 30
+# Most frequent words kept by site in topwords, site 0 for all the sites
+TOPWORDS_SIZE = 100
+# Characters of the sword columns of wordlist and topwords
+MAX_WORD_LENGTH = 80
+
+
+class SchemaLocked(Exception):
+    pass
+
+
+def table_exists(cursor, table):
+    cursor.execute("SELECT COUNT(*) FROM information_schema.tables "
+                   "WHERE table_schema = DATABASE() AND table_name = %s", (table,))
+    return cursor.fetchone()[0] > 0
+
+
+def sqlite_table_exists(cursor, table):
+    cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = %s", (table,))
+    return cursor.fetchone()[0] > 0
+
+
+def column_exists(cursor, table, column):
+    cursor.execute("SELECT COUNT(*) FROM information_schema.columns "
+                   "WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s", (table, column))
+    return cursor.fetchone()[0] > 0
+
+
+def index_exists(cursor, table, index):
+    cursor.execute("SELECT COUNT(*) FROM information_schema.statistics "
+                   "WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s", (table, index))
+    return cursor.fetchone()[0] > 0
+
+
+def create_tables(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS wordlist (
+        sword varchar(80),
+        eword varchar(2048),
+        frequency int)
+        """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS websites (
+        url varchar(200))
+        """)
+
+
+def add_wordlist_id(cursor):
+    if not column_exists(cursor, 'wordlist', 'id'):
+        cursor.execute("ALTER TABLE wordlist ADD COLUMN id int unsigned NOT NULL AUTO_INCREMENT PRIMARY KEY FIRST")
+
+
+def add_wordlist_sword_key(cursor):
+    if index_exists(cursor, 'wordlist', 'sword'):
+        return
+    # One row by word, with the frequencies of its duplicates summed
+    cursor.execute("""
+        UPDATE wordlist w JOIN (
+            SELECT MIN(id) AS id, SUM(frequency) AS frequency FROM wordlist
+            GROUP BY sword HAVING COUNT(*) > 1) d ON w.id = d.id
+        SET w.frequency = d.frequency
+        """)
+    cursor.execute("""
+        DELETE w FROM wordlist w JOIN (
+            SELECT sword, MIN(id) AS id FROM wordlist
+            GROUP BY sword HAVING COUNT(*) > 1) d ON w.sword = d.sword AND w.id > d.id
+        """)
+    cursor.connection.commit()
+    cursor.execute("ALTER TABLE wordlist ADD UNIQUE KEY sword (sword)")
+
+
+def add_websites_url_hash(cursor):
+    """
+    Urls longer than an index allows are looked up by their sha1
+    """
+    if not column_exists(cursor, 'websites', 'id'):
+        cursor.execute("ALTER TABLE websites ADD COLUMN id int unsigned NOT NULL AUTO_INCREMENT PRIMARY KEY FIRST")
+    if not column_exists(cursor, 'websites', 'url_hash'):
+        cursor.execute("ALTER TABLE websites MODIFY url varchar(2048), ADD COLUMN url_hash char(40) AFTER url")
+    if index_exists(cursor, 'websites', 'url_hash'):
+        return
+    cursor.execute("UPDATE websites SET url_hash = SHA1(url) WHERE url_hash IS NULL")
+    cursor.execute("""
+        DELETE w FROM websites w JOIN (
+            SELECT url_hash, MIN(id) AS id FROM websites
+            GROUP BY url_hash HAVING COUNT(*) > 1) d ON w.url_hash = d.url_hash AND w.id > d.id
+        """)
+    cursor.connection.commit()
+    cursor.execute("ALTER TABLE websites MODIFY url_hash char(40) NOT NULL, ADD UNIQUE KEY url_hash (url_hash)")
+
+
+def create_site_words(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS site_words (
+        site_id int unsigned NOT NULL,
+        word_id int unsigned NOT NULL,
+        frequency int NOT NULL DEFAULT 0,
+        PRIMARY KEY (site_id, word_id),
+        KEY word_id (word_id))
+        """)
+
+
+def fill_topwords(cursor):
+    """
+    Global top words of the words already there, kept current by
+    insert_wordlist from then on
+    """
+    cursor.execute("SELECT COUNT(*) FROM topwords")
+    if cursor.fetchone()[0] == 0:
+        cursor.execute("INSERT INTO topwords (site_id, sword, frequency) "
+                       "SELECT 0, sword, frequency FROM wordlist ORDER BY frequency DESC LIMIT %s",
+                       (TOPWORDS_SIZE,))
+        cursor.connection.commit()
+
+
+def create_topwords(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS topwords (
+        site_id int unsigned NOT NULL,
+        sword varchar(80) NOT NULL,
+        frequency int NOT NULL,
+        PRIMARY KEY (site_id, sword),
+        KEY site_frequency (site_id, frequency))
+        """)
+    fill_topwords(cursor)
+
+
+def create_pages(cursor):
+    """
+    Pages stored in the word wall, with their simhash in hex and its
+    blocks, see components/simhash.py, to find the near duplicates
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS pages (
+        id int unsigned NOT NULL AUTO_INCREMENT PRIMARY KEY,
+        url varchar(2048) NOT NULL,
+        url_hash char(40) NOT NULL,
+        simhash char(16),
+        block0 int unsigned,
+        block1 int unsigned,
+        block2 int unsigned,
+        block3 int unsigned,
+        UNIQUE KEY url_hash (url_hash),
+        KEY block0 (block0),
+        KEY block1 (block1),
+        KEY block2 (block2),
+        KEY block3 (block3))
+        """)
+
+
+# (version, name, function of a cursor), in the order they are applied
+MIGRATIONS = [
+    (1, "wordlist and websites tables", create_tables),
+    (2, "wordlist primary key", add_wordlist_id),
+    (3, "wordlist unique sword", add_wordlist_sword_key),
+    (4, "websites primary key and unique url hash", add_websites_url_hash),
+    (5, "site_words table", create_site_words),
+    (6, "topwords table", create_topwords),
+    (7, "pages table", create_pages),
+]
+
+
+def create_sqlite_tables(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS wordlist (
+        id INTEGER PRIMARY KEY,
+        sword varchar(80),
+        eword varchar(2048),
+        frequency int)
+        """)
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS sword ON wordlist (sword)")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS websites (
+        id INTEGER PRIMARY KEY,
+        url varchar(2048),
+        url_hash char(40) NOT NULL)
+        """)
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS url_hash ON websites (url_hash)")
+
+
+def create_sqlite_site_words(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS site_words (
+        site_id INTEGER NOT NULL,
+        word_id INTEGER NOT NULL,
+        frequency INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (site_id, word_id))
+        """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS site_words_word_id ON site_words (word_id)")
+
+
+def create_sqlite_topwords(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS topwords (
+        site_id INTEGER NOT NULL,
+        sword varchar(80) NOT NULL,
+        frequency INTEGER NOT NULL,
+        PRIMARY KEY (site_id, sword))
+        """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS topwords_site_frequency ON topwords (site_id, frequency)")
+    fill_topwords(cursor)
+
+
+def create_sqlite_pages(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS pages (
+        id INTEGER PRIMARY KEY,
+        url varchar(2048) NOT NULL,
+        url_hash char(40) NOT NULL,
+        simhash char(16),
+        block0 INTEGER,
+        block1 INTEGER,
+        block2 INTEGER,
+        block3 INTEGER)
+        """)
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS pages_url_hash ON pages (url_hash)")
+    for i in range(4):
+        cursor.execute("CREATE INDEX IF NOT EXISTS pages_block{0} ON pages (block{0})".format(i))
+
+
+SQLITE_MIGRATIONS = [
+    (1, "wordlist and websites tables with their keys", create_sqlite_tables),
+    (2, "site_words table", create_sqlite_site_words),
+    (3, "topwords table", create_sqlite_topwords),
+    (4, "pages table", create_sqlite_pages),
+]
+
+
+def create_schema_version(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+        version int NOT NULL PRIMARY KEY,
+        name varchar(200) NOT NULL,
+        applied datetime NOT NULL)
+        """)
+
+
+def applied_versions(cursor):
+    cursor.execute("SELECT version FROM schema_version")
+    return set(row[0] for row in cursor.fetchall())
+
+
+def pending_versions(cursor, migrations, exists=table_exists):
+    """
+    Read only, for the connections of the requests: a database without
+    the schema_version table has all the migrations pending
+
+    :param exists: table_exists, or sqlite_table_exists for SQLite
+    :return: list of the versions of migrations not applied yet, in order
+    """
+    done = applied_versions(cursor) if exists(cursor, 'schema_version') else set()
+    return [version for version, _, _ in migrations if version not in done]
+
+
+def migrate(conn, migrations=MIGRATIONS, lock_timeout=SCHEMA_LOCK_TIMEOUT):
+    """
+    Apply the migrations not applied yet, in order
+
+    :param conn: DB-API connection to the database
+    :return: list of the versions applied
+    :raise SchemaLocked: when another instance kept the lock for lock_timeout
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT GET_LOCK(%s, %s)", (SCHEMA_LOCK, lock_timeout))
+        if not cursor.fetchone()[0]:
+            raise SchemaLocked("Schema migrations running elsewhere for %s seconds" % lock_timeout)
+        try:
+            return apply_migrations(conn, cursor, migrations,
+                                    "INSERT INTO schema_version (version, name, applied) "
+                                    "VALUES (%s, %s, UTC_TIMESTAMP())")
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (SCHEMA_LOCK,))
+            cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+def migrate_sqlite(conn, migrations=SQLITE_MIGRATIONS):
+    """
+    Apply the migrations not applied yet, in order. Two processes may
+    run them at the same time, they only create what does not exist
+
+    :param conn: components.sqlitedb Connection
+    :return: list of the versions applied
+    """
+    cursor = conn.cursor()
+    try:
+        return apply_migrations(conn, cursor, migrations,
+                                "INSERT OR IGNORE INTO schema_version (version, name, applied) "
+                                "VALUES (%s, %s, datetime('now'))")
+    finally:
+        cursor.close()
+
+
+def apply_migrations(conn, cursor, migrations, record):
+    """
+    :param record: query recording a version applied, of the version and its name
+    """
+    create_schema_version(cursor)
+    done = applied_versions(cursor)
+    applied = []
+    for version, name, step in migrations:
+        if version in done:
+            continue
+        step(cursor)
+        cursor.execute(record, (version, name))
+        conn.commit()
+        applied.append(version)
+    return applied
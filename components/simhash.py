@@ -0,0 +1,121 @@
+"""
+SimHash fingerprints of the pages, to find the near duplicates.
+
+The 64 bits fingerprint of a page is made from the hashes of its words,
+weighted by their counts: pages differing by a few words have
+fingerprints differing by a few bits. The index finds a fingerprint
+within max_distance bits with max_distance + 1 tables, one per block of
+the bits: two fingerprints that close have at least one block equal.
+"""
+import hashlib
+import threading
+from collections import deque
+
+FINGERPRINT_BITS = 64
+MAX_DISTANCE = 3
+# Fewer words than this make fingerprints too unstable to compare
+MIN_WORDS = 20
+
+
+def _word_hash(word):
+    return bytearray(hashlib.md5(word.encode('utf-8')).digest()[:FINGERPRINT_BITS // 8])
+
+
+def simhash(counts, min_words=MIN_WORDS):
+    """
+    :param counts: Counter of the words of the page
+    :return: 64 bits fingerprint, None for the pages with less than min_words words
+    """
+    total = sum(counts.values())
+    if total < min_words:
+        return None
+    # Weights by byte value for each byte of the hashes, the bits are summed
+    # once per byte value instead of once per word
+    tables = [[0] * 256 for _ in range(FINGERPRINT_BITS // 8)]
+    for word, weight in counts.items():
+        for table, byte in zip(tables, _word_hash(word)):
+            table[byte] += weight
+    fingerprint = 0
+    for i, table in enumerate(tables):
+        for bit in range(8):
+            ones = sum(w for byte, w in enumerate(table) if w and byte >> bit & 1)
+            # More weight on the words with the bit set than on the others
+            if 2 * ones > total:
+                fingerprint |= 1 << (i * 8 + bit)
+    return fingerprint
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+def block_masks(max_distance=MAX_DISTANCE):
+    """
+    :return: (shift, mask) of each of the max_distance + 1 blocks of the
+             bits, the last one takes the bits left
+    """
+    blocks = max_distance + 1
+    width = FINGERPRINT_BITS // blocks
+    return [(i * width, (1 << (width if i < blocks - 1 else FINGERPRINT_BITS - i * width)) - 1)
+            for i in range(blocks)]
+
+
+def split_blocks(fingerprint, max_distance=MAX_DISTANCE):
+    """
+    :return: the blocks of fingerprint, a fingerprint within max_distance
+             bits has at least one of them equal
+    """
+    return [(fingerprint >> shift) & mask for shift, mask in block_masks(max_distance)]
+
+
+class SimHashIndex:
+    """
+    Bounded, thread safe index of fingerprints, the oldest is dropped first
+    """
+
+    def __init__(self, max_distance=MAX_DISTANCE, maxsize=None):
+        """
+        :param max_distance: max bits differing between near duplicates
+        :param maxsize: max number of fingerprints, None for no limit
+        """
+        self.max_distance = max_distance
+        self.maxsize = maxsize
+        self.blocks = block_masks(max_distance)
+        self.tables = [{} for _ in self.blocks]
+        self.order = deque()
+        self.lock = threading.Lock()
+
+    def _keys(self, fingerprint):
+        return [(fingerprint >> shift) & mask for shift, mask in self.blocks]
+
+    def find(self, fingerprint):
+        """
+        :return: (value, distance) of the nearest fingerprint within
+                 max_distance, None if there is none
+        """
+        best = None
+        with self.lock:
+            for table, key in zip(self.tables, self._keys(fingerprint)):
+                for other, value in table.get(key, ()):
+                    distance = hamming(fingerprint, other)
+                    if distance <= self.max_distance and (best is None or distance < best[1]):
+                        best = (value, distance)
+        return best
+
+    def add(self, fingerprint, value):
+        with self.lock:
+            for table, key in zip(self.tables, self._keys(fingerprint)):
+                table.setdefault(key, []).append((fingerprint, value))
+            self.order.append((fingerprint, value))
+            while self.maxsize is not None and len(self.order) > self.maxsize:
+                self._remove(*self.order.popleft())
+
+    def _remove(self, fingerprint, value):
+        for table, key in zip(self.tables, self._keys(fingerprint)):
+            entries = table[key]
+            entries.remove((fingerprint, value))
+            if not entries:
+                del table[key]
+
+    def __len__(self):
+        return len(self.order)
@@ -0,0 +1,88 @@
+"""
+SQLite connections for the embedded storage of the word wall.
+
+The connections take the queries written for MySQLdb, their %s
+placeholders are turned into ? once by query. They run in WAL mode, so
+the readers don't wait for the writer, and keep STATEMENT_CACHE
+prepared statements each, reused as long as the pool keeps them.
+"""
+import re
+import sqlite3
+
+Error = sqlite3.Error
+
+# Seconds a writer waits for the lock of another one
+BUSY_TIMEOUT = 10
+STATEMENT_CACHE = 256
+# Variables by statement of SQLite before 3.32
+MAX_VARIABLES = 999
+# Queries translated kept, the multi-row inserts make one by row count
+TRANSLATED_SIZE = 1024
+
+PLACEHOLDER_RE = re.compile(r"%([s%])")
+
+translated = {}
+
+
+def translate(query):
+    """
+    :return: query with the %s placeholders of MySQLdb as ?, and %% as %
+    """
+    result = translated.get(query)
+    if result is None:
+        result = PLACEHOLDER_RE.sub(lambda m: '?' if m.group(1) == 's' else '%', query)
+        if len(translated) >= TRANSLATED_SIZE:
+            translated.clear()
+        translated[query] = result
+    return result
+
+
+class Cursor:
+
+    def __init__(self, cursor, connection):
+        self.cursor = cursor
+        self.connection = connection
+
+    def execute(self, query, args=None):
+        # Without args the query is taken as is, like MySQLdb does
+        if args is None:
+            return self.cursor.execute(query)
+        return self.cursor.execute(translate(query), tuple(args))
+
+    def executemany(self, query, rows):
+        return self.cursor.executemany(translate(query), rows)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
+class Connection:
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def cursor(self):
+        return Cursor(self.conn.cursor(), self)
+
+    def ping(self):
+        self.conn.execute("SELECT 1").fetchone()
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+
+def connect(path, busy_timeout=BUSY_TIMEOUT, statement_cache=STATEMENT_CACHE):
+    """
+    :param path: file of the database
+    :return: Connection, usable from any thread, one at a time
+    :raise Error:
+    """
+    conn = sqlite3.connect(path, timeout=busy_timeout, check_same_thread=False,
+                           cached_statements=statement_cache)
+    # The byte strings of the queries are stored as text, as MySQLdb does
+    conn.text_factory = str
+    conn.execute("PRAGMA journal_mode=WAL").fetchone()
+    # No sync at each commit: a power loss can lose the last commits, not
+    # corrupt the database in WAL mode
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return Connection(conn)
@@ -0,0 +1,227 @@
+"""
+Visible text of html pages, extracted while the page is parsed.
+
+Same rules as tag_visible on the BeautifulSoup tree built with
+html.parser, without building the tree: only the names of the open tags
+are kept, the text of style, script, head, title and meta, the comments
+and the text outside of any tag are dropped as soon as they are parsed.
+The page can be fed in chunks, as they are read from the network, and
+the links of the page can be collected on the way.
+"""
+import codecs
+import itertools
+import re
+
+try:
+    from HTMLParser import HTMLParser
+    from htmlentitydefs import name2codepoint
+except ImportError:
+    from html.parser import HTMLParser
+    from html.entities import name2codepoint
+    unichr = chr
+
+# Parents of the text nodes that are not visible
+INVISIBLE_TAGS = frozenset(['style', 'script', 'head', 'title', 'meta'])
+# Closed as soon as they are opened, like the html.parser tree builder does
+EMPTY_ELEMENT_TAGS = frozenset([
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link', 'menuitem',
+    'meta', 'param', 'source', 'track', 'wbr', 'spacer', 'frame'])
+# Bytes at the start of the page searched for a BOM or a declared charset
+SNIFF_SIZE = 1024
+
+BOMS = [(codecs.BOM_UTF8, 'utf-8'), (codecs.BOM_UTF16_LE, 'utf-16-le'), (codecs.BOM_UTF16_BE, 'utf-16-be')]
+# <meta charset="..."> and <meta http-equiv="Content-Type" content="text/html; charset=...">
+META_CHARSET_RE = re.compile(br'<meta[^>]+?charset\s*=\s*["\']?\s*([a-zA-Z0-9_:.\-]+)', re.I)
+XML_ENCODING_RE = re.compile(br'^\s*<\?xml[^>]+?encoding\s*=\s*["\']([a-zA-Z0-9_.\-]+)', re.I)
+
+
+class VisibleTextParser(HTMLParser):
+    """
+    Collects the visible text nodes, stripped, take them with take()
+    after each feed
+    """
+
+    def __init__(self, links=None):
+        """
+        :param links: list to append the href of the a tags to, None to not collect them
+        """
+        try:
+            HTMLParser.__init__(self, convert_charrefs=False)
+        except TypeError:
+            HTMLParser.__init__(self)
+        # Names of the open tags, the document itself is not in it
+        self.stack = []
+        self.data = []
+        self.texts = []
+        # Empty element tags closed on open, their explicit end tag is skipped
+        self.already_closed = []
+        self.links = links
+
+    def end_data(self, visible=True):
+        """
+        End the current text node, like BeautifulSoup.endData
+        """
+        if self.data:
+            if visible and self.stack and self.stack[-1] not in INVISIBLE_TAGS:
+                self.texts.append(u"".join(self.data).strip())
+            self.data = []
+
+    def take(self):
+        """
+        :return: list of the visible text nodes parsed since the last take
+        """
+        texts = self.texts
+        self.texts = []
+        return texts
+
+    def flush(self):
+        """
+        End the last text node, at the end of the page
+        """
+        self.end_data()
+
+    def handle_starttag(self, tag, attrs, empty_element=True):
+        self.end_data()
+        if tag == 'a' and self.links is not None:
+            for name, value in attrs:
+                if name == 'href' and value:
+                    self.links.append(value)
+        self.stack.append(tag)
+        if empty_element and tag in EMPTY_ELEMENT_TAGS:
+            self.pop_tag(tag)
+            self.already_closed.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs, empty_element=False)
+        self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in self.already_closed:
+            self.already_closed.remove(tag)
+        else:
+            self.pop_tag(tag)
+
+    def pop_tag(self, tag):
+        self.end_data()
+        # Up to the most recent open tag of that name, an end tag matching
+        # none of them closes them all, as the tree builder does
+        for i in range(len(self.stack) - 1, -1, -1):
+            if self.stack[i] == tag:
+                del self.stack[i:]
+                return
+        del self.stack[:]
+
+    def handle_data(self, data):
+        self.data.append(data)
+
+    def handle_charref(self, name):
+        try:
+            if name[:1] in ('x', 'X'):
+                data = unichr(int(name[1:], 16))
+            else:
+                data = unichr(int(name))
+        except (ValueError, OverflowError):
+            data = u"\N{REPLACEMENT CHARACTER}"
+        self.handle_data(data)
+
+    def handle_entityref(self, name):
+        codepoint = name2codepoint.get(name)
+        self.handle_data(unichr(codepoint) if codepoint is not None else u"&%s;" % name)
+
+    def handle_comment(self, data):
+        self.end_data()
+        self.handle_data(data)
+        self.end_data(visible=False)
+
+    def handle_decl(self, data):
+        self.end_data()
+        if data.startswith("DOCTYPE "):
+            data = data[len("DOCTYPE "):]
+        elif data == "DOCTYPE":
+            data = u""
+        self.handle_data(data)
+        self.end_data()
+
+    def unknown_decl(self, data):
+        self.end_data()
+        if data.upper().startswith("CDATA["):
+            data = data[len("CDATA["):]
+        self.handle_data(data)
+        self.end_data()
+
+    def handle_pi(self, data):
+        self.end_data()
+        self.handle_data(data)
+        self.end_data()
+
+
+def sniff_encoding(head):
+    """
+    :param head: first bytes of the page
+    :return: (encoding of the BOM, or declared by the page, or None,
+              length of the BOM)
+    """
+    for bom, encoding in BOMS:
+        if head.startswith(bom):
+            return encoding, len(bom)
+    match = XML_ENCODING_RE.match(head) or META_CHARSET_RE.search(head)
+    if match is None:
+        return None, 0
+    encoding = match.group(1).decode('ascii').lower()
+    # A page readable as ascii up to its meta is not utf-16, as browsers assume
+    if encoding.startswith('utf-16'):
+        encoding = 'utf-8'
+    return encoding, 0
+
+
+def iter_visible_text(chunks, encoding=None, links=None):
+    """
+    :param chunks: iterable of the page chunks, bytes or unicode
+    :param encoding: charset of the bytes, from the Content-Type header. A
+                     BOM overrides it, when not given the charset declared
+                     in the first SNIFF_SIZE bytes is used, utf-8 if none or
+                     unknown. Undecodable bytes are replaced
+    :param links: list to append the href of the links of the page to, as
+                  they are parsed
+    :return: generator of the visible text nodes, stripped
+    """
+    chunks = iter(chunks)
+    head = b""
+    pending = []
+    for chunk in chunks:
+        if not isinstance(chunk, bytes):
+            pending.append(chunk)
+            break
+        head += chunk
+        if len(head) >= SNIFF_SIZE:
+            break
+    sniffed, bom = sniff_encoding(head[:SNIFF_SIZE])
+    if bom:
+        head = head[bom:]
+    if bom or encoding is None:
+        encoding = sniffed
+    try:
+        decoder = codecs.getincrementaldecoder(encoding or 'utf-8')('replace')
+    except LookupError:
+        decoder = codecs.getincrementaldecoder('utf-8')('replace')
+    chunks = itertools.chain([head], pending, chunks)
+    parser = VisibleTextParser(links)
+    for chunk in chunks:
+        if isinstance(chunk, bytes):
+            chunk = decoder.decode(chunk)
+        parser.feed(chunk)
+        for text in parser.take():
+            yield text
+    parser.feed(decoder.decode(b"", True))
+    # No close(): an unfinished tag at the end is dropped, not taken as text
+    parser.flush()
+    for text in parser.take():
+        yield text
+
+
+def visible_text(body, encoding=None):
+    """
+    :param body: whole page, bytes or unicode
+    :return: the visible text nodes joined by spaces
+    """
+    return u" ".join(iter_visible_text([body], encoding))
@@ -0,0 +1,233 @@
+"""
+Words of the visible text, and the stopwords dropped from the counts.
+
+A text is NFKC normalized and case folded, then its words are taken in
+one regex pass: letters and digits, with inner apostrophes, so the
+punctuation around them is dropped. The stopwords of a language are
+read from stopwords/<language>.txt the first time they are needed.
+
+Large texts are cut at whitespace and their chunks counted on a process
+pool, where processes can be started: not on App Engine standard, there
+they are counted in process.
+"""
+import hashlib
+import io
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter
+
+STOPWORDS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stopwords')
+DEFAULT_LANGUAGE = 'en'
+# Texts shorter than this, in characters, are counted in process, the pool costs more
+PARALLEL_THRESHOLD = 1024 * 1024
+PARALLEL_CHUNK_SIZE = 256 * 1024
+# Processes of the counting pool, the number of cpus if not set. With
+# less than 2 the texts are counted in process: the chunks cost twice as much
+PARALLEL_WORKERS = os.environ.get('PARALLEL_COUNT_WORKERS')
+
+WORD_RE = re.compile(u"[^\\W_]+(?:['\u2019][^\\W_]+)*", re.UNICODE)
+SPACE_RE = re.compile(r"\s", re.UNICODE)
+
+try:
+    _casefold = unicode.lower
+except NameError:
+    _casefold = str.casefold
+
+
+def normalize(text):
+    """
+    :param text: unicode
+    :return: text NFKC normalized and case folded
+    """
+    return _casefold(unicodedata.normalize('NFKC', text))
+
+
+def tokenize(text):
+    """
+    :param text: unicode
+    :return: list of the normalized words of text
+    """
+    return WORD_RE.findall(normalize(text))
+
+
+class StopwordSet:
+    """
+    Immutable set of normalized stopwords, its version changes with its words
+    """
+
+    def __init__(self, language, words):
+        self.language = language
+        self.words = frozenset(normalize(w) for w in words)
+        self.version = hashlib.sha1(u"\n".join(sorted(self.words)).encode('utf-8')).hexdigest()[:12]
+
+    def __contains__(self, word):
+        return word in self.words
+
+    def __len__(self):
+        return len(self.words)
+
+    @classmethod
+    def load(cls, language, directory=STOPWORDS_DIR):
+        """
+        :raise ValueError: when there is no list for the language
+        """
+        path = os.path.join(directory, '%s.txt' % language)
+        if not re.match(r'^[a-z]{2,3}$', language) or not os.path.isfile(path):
+            raise ValueError("No stopwords for language: %s" % language)
+        with io.open(path, encoding='utf-8') as f:
+            words = [line.strip() for line in f]
+        return cls(language, [w for w in words if w and not w.startswith('#')])
+
+
+_stopwords = {}
+_stopwords_lock = threading.Lock()
+
+
+def get_stopwords(language=DEFAULT_LANGUAGE):
+    """
+    :return: StopwordSet of the language, loaded once
+    :raise ValueError: when there is no list for the language
+    """
+    stopwords = _stopwords.get(language)
+    if stopwords is None:
+        with _stopwords_lock:
+            stopwords = _stopwords.get(language)
+            if stopwords is None:
+                stopwords = _stopwords[language] = StopwordSet.load(language)
+    return stopwords
+
+
+def reload_stopwords(language=DEFAULT_LANGUAGE):
+    """
+    Read the list of the language again, after its file changed
+
+    :return: the new StopwordSet
+    """
+    stopwords = StopwordSet.load(language)
+    with _stopwords_lock:
+        _stopwords[language] = stopwords
+    return stopwords
+
+
+def count_tokens(texts, stopwords=None, counts=None):
+    """
+    :param texts: iterable of unicode texts
+    :param stopwords: StopwordSet of the words not counted, the default language one if None
+    :param counts: Counter to add to, a new one if None
+    :return: Counter of the words
+    """
+    if stopwords is None:
+        stopwords = get_stopwords()
+    words = stopwords.words
+    if counts is None:
+        counts = Counter()
+    for text in texts:
+        counts.update(w for w in WORD_RE.findall(normalize(text)) if w not in words)
+    return counts
+
+
+def split_text(texts, chunk_size=PARALLEL_CHUNK_SIZE):
+    """
+    :param texts: iterable of unicode texts
+    :return: generator of texts of about chunk_size characters, cut at
+             whitespace so that no word is cut
+    """
+    pending = []
+    size = 0
+    for text in texts:
+        pending.append(text)
+        size += len(text) + 1
+        if size < chunk_size:
+            continue
+        text = u" ".join(pending)
+        start = 0
+        while len(text) - start > chunk_size:
+            space = SPACE_RE.search(text, start + chunk_size)
+            if space is None:
+                break
+            yield text[start:space.start()]
+            start = space.end()
+        pending = [text[start:]]
+        size = len(pending[0])
+    if pending:
+        yield u" ".join(pending)
+
+
+def merge_counts(parts):
+    """
+    Tree reduction of the counts: each round merges them by pairs, so the
+    Counters merged together have about the same size
+
+    :param parts: iterable of Counters, updated in place
+    :return: Counter of all the parts
+    """
+    parts = list(parts)
+    if not parts:
+        return Counter()
+    while len(parts) > 1:
+        merged = []
+        for i in range(0, len(parts) - 1, 2):
+            parts[i].update(parts[i + 1])
+            merged.append(parts[i])
+        if len(parts) % 2:
+            merged.append(parts[-1])
+        parts = merged
+    return parts[0]
+
+
+_pool = None
+_pool_failed = False
+_pool_lock = threading.Lock()
+
+
+def get_count_pool():
+    """
+    :return: the ProcessPoolExecutor of the counting, None where processes
+             cannot be started or with less than 2 workers
+    """
+    global _pool, _pool_failed
+    if _pool is None and not _pool_failed:
+        with _pool_lock:
+            if _pool is None and not _pool_failed:
+                try:
+                    import multiprocessing
+                    from concurrent.futures import ProcessPoolExecutor
+                    workers = int(PARALLEL_WORKERS or multiprocessing.cpu_count())
+                    if workers < 2:
+                        raise ValueError("No parallel counting with %d workers" % workers)
+                    _pool = ProcessPoolExecutor(max_workers=workers)
+                except (ImportError, NotImplementedError, OSError, ValueError):
+                    _pool_failed = True
+    return _pool
+
+
+def _count_chunk(text, stopwords):
+    return count_tokens([text], stopwords)
+
+
+def count_tokens_parallel(texts, stopwords=None, executor=None, threshold=PARALLEL_THRESHOLD,
+                          chunk_size=PARALLEL_CHUNK_SIZE):
+    """
+    Like count_tokens, counting chunks of the texts on a process pool
+    when they are longer than threshold
+
+    :param texts: list of unicode texts
+    :param executor: process pool used whatever the length of the texts,
+                     if None the one of get_count_pool above threshold
+    :return: Counter of the words
+    """
+    if stopwords is None:
+        stopwords = get_stopwords()
+    if executor is None and sum(len(text) for text in texts) >= threshold:
+        executor = get_count_pool()
+    if executor is None:
+        return count_tokens(texts, stopwords)
+
+    try:
+        futures = [executor.submit(_count_chunk, chunk, stopwords) for chunk in split_text(texts, chunk_size)]
+    except (NotImplementedError, OSError, RuntimeError):
+        # The processes could not be started
+        return count_tokens(texts, stopwords)
+    return merge_counts(future.result() for future in futures)
@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 import tornado.wsgi
+from concurrent.futures import ThreadPoolExecutor
 from tornado.wsgi import WSGIContainer
 from tornado.wsgi import WSGIAdapter
 from tornado.httpserver import HTTPServer
@@ -7,18 +8,38 @@ from tornado.ioloop import IOLoop
 import pyrestful.rest
 from pyrestful import mediatypes
 from pyrestful.rest import get, post, put, delete
+from pyrestful.metrics import MetricsRegistry
 import json
 import logging
 import datetime
+from collections import OrderedDict
 from google.appengine.api import users
 from google.appengine.ext import ndb as db
 from components.helpers import generate_hash_key
+from components.helpers import generate_signed_key
+from components.helpers import APPKEY_MODE
 from components.helpers import calculate_time_delta
 from components.helpers import check_key_validity
 from components.helpers import Keystore
 from components.helpers import Urlstore
 from components.helpers import get_ancestor
-from components.helpers import get_word_list
+from components.helpers import lookup_key
+from components.helpers import list_keys
+from components.helpers import count_page
+from components.helpers import store_page
+from components.helpers import scan_urls
+from components.helpers import rank_words
+from components.helpers import check_rank_params
+from components.helpers import MAX_SCAN_URLS
+from components.helpers import TOP_WORDS
+from components.helpers import crawl_site
+from components.helpers import page_fetcher
+from components.helpers import collect_db_pools
+from components.helpers import get_database
+from components.helpers import get_top_words
+from components.helpers import WORDWALL_DB
+from components.fetcher import FetchError
+from components.reaper import KeyReaper
 
 #from apiclient.discovery import build
 #from oauth2client.client import GoogleCredentials
@@ -29,6 +50,7 @@ class MainHandler(pyrestful.rest.RestHandler):
     ONLYONE = 1
     FIRSTELEMENT = 0
     MAXKEYVALTIME = 900
+    REAPDEADLINE = 300
     VALID = 1
     PREFIX = "/api/v1.0"
 
@@ -56,10 +78,7 @@ class MainHandler(pyrestful.rest.RestHandler):
     def postId(self, data):
         x_real_ip = self.request.headers.get("X-Real-IP")
         remote_ip = x_real_ip or self.request.remote_ip or self.request.remote_addr
-        #ancestor_key = db.Key("mkey", data["key"])
-
-        ancestor_key = get_ancestor("mkey", data["key"])
-        a = Keystore.query_keys(ancestor_key).fetch(self.ONLYONE)
+        a = lookup_key(data["key"], remote_ip, self.MAXKEYVALTIME)
 
         ck = check_key_validity(a, data["key"], remote_ip, self.MAXKEYVALTIME)
         if ck is True:
@@ -72,9 +91,7 @@ class MainHandler(pyrestful.rest.RestHandler):
         x_real_ip = self.request.headers.get("X-Real-IP")
         remote_ip = x_real_ip or self.request.remote_ip or self.request.remote_addr
 
-        ancestor_key = get_ancestor("mkey", data["key"])
-        #ancestor_key = db.Key("mkey", data["key"])
-        a = Keystore.query_keys(ancestor_key).fetch(self.ONLYONE)
+        a = lookup_key(data["key"], remote_ip, self.MAXKEYVALTIME)
 
         ck = check_key_validity(a, data["key"], remote_ip, self.MAXKEYVALTIME )
         if ck is True:
@@ -88,8 +105,7 @@ class MainHandler(pyrestful.rest.RestHandler):
         x_real_ip = self.request.headers.get("X-Real-IP")
         remote_ip = x_real_ip or self.request.remote_ip or self.request.remote_addr
 
-        ancestor_key = get_ancestor("mkey", key)
-        a = Keystore.query_keys(ancestor_key).fetch(self.ONLYONE)
+        a = lookup_key(key, remote_ip, self.MAXKEYVALTIME)
         ck = check_key_validity(a, key, remote_ip, self.MAXKEYVALTIME)
         if ck is True:
             return {"value" : value, "ip" : remote_ip, "key" : key}
@@ -103,22 +119,105 @@ class MainHandler(pyrestful.rest.RestHandler):
         return {"value" : value, "ip" : remote_ip}
 
 
-    @post(_path="/sendurl", _types=[str, str], _produces=mediatypes.APPLICATION_JSON)
-    def sendUrl(self, url, key):
+    @post(_path="/sendurl?<k>&<offset>&<minfreq>", _types=[str, str, int, int, int], _produces=mediatypes.APPLICATION_JSON, _executor="scrape")
+    def sendUrl(self, url, key, k, offset, minfreq):
         x_real_ip = self.request.headers.get("X-Real-IP")
         remote_ip = x_real_ip or self.request.remote_ip or self.request.remote_addr
 
-        ancestor_key = get_ancestor("mkey", key)
-        a = Keystore.query_keys(ancestor_key).fetch(self.ONLYONE)
+        a = lookup_key(key, remote_ip, self.MAXKEYVALTIME)
 
         ck = check_key_validity(a, key, remote_ip, self.MAXKEYVALTIME)
         if ck is True:
-            return {"key": key , "nounslist" : get_word_list(url)}
-            #return {"url": url, "key": key}
+            # Only the words the word wall renders
+            try:
+                k, offset, minfreq = TOP_WORDS if k is None else k, offset or 0, 1 if minfreq is None else minfreq
+                # Before fetching anything
+                check_rank_params(k, offset, minfreq)
+                counts, fingerprint = count_page(url)
+            except FetchError as e:
+                return {"Error fetching url": str(e)}
+            except ValueError as e:
+                return {"Error": str(e)}
+            response = {"key": key , "nounslist" : rank_words(counts, k, offset, minfreq)}
+            # Added to the word wall of /topwords, once by page
+            stored = store_page(url, counts, fingerprint)
+            if stored is not None:
+                response["wordwall"] = stored
+            return response
+        else:
+            return ck
+
+
+    @post(_path="/scanurls", _consumes=mediatypes.APPLICATION_JSON, _produces=mediatypes.APPLICATION_JSON, _executor="scrape")
+    def postScanUrls(self, data):
+        x_real_ip = self.request.headers.get("X-Real-IP")
+        remote_ip = x_real_ip or self.request.remote_ip or self.request.remote_addr
+
+        # One key validation for the whole list
+        a = lookup_key(data["key"], remote_ip, self.MAXKEYVALTIME)
+
+        ck = check_key_validity(a, data["key"], remote_ip, self.MAXKEYVALTIME)
+        if ck is True:
+            urls = data.get("urls")
+            if not isinstance(urls, list) or not urls or not all(isinstance(u, basestring) for u in urls):
+                return {"Error urls must be a non-empty list of urls": urls}
+            urls = list(OrderedDict.fromkeys(urls))
+            if len(urls) > MAX_SCAN_URLS:
+                return {"Error too many urls": len(urls), "max urls": MAX_SCAN_URLS}
+            results, merged = scan_urls(urls)
+            return {"key": data["key"], "urls": results, "nounslist": rank_words(merged)}
+        else:
+            return ck
+
+
+    @post(_path="/crawl", _consumes=mediatypes.APPLICATION_JSON, _produces=mediatypes.APPLICATION_JSON, _executor="scrape")
+    def postCrawl(self, data):
+        x_real_ip = self.request.headers.get("X-Real-IP")
+        remote_ip = x_real_ip or self.request.remote_ip or self.request.remote_addr
+
+        a = lookup_key(data["key"], remote_ip, self.MAXKEYVALTIME)
+
+        ck = check_key_validity(a, data["key"], remote_ip, self.MAXKEYVALTIME)
+        if ck is True:
+            try:
+                k, offset, minfreq = int(data.get("k", TOP_WORDS)), int(data.get("offset", 0)), int(data.get("minfreq", 1))
+                # Before crawling anything
+                check_rank_params(k, offset, minfreq)
+                result = crawl_site(data["url"], int(data.get("depth", 2)), int(data.get("pages", 20)))
+            except (ValueError, TypeError) as e:
+                return {"Error": str(e)}
+            words = rank_words(result.counts, k, offset, minfreq)
+            return {"key": data["key"], "url": data["url"], "pages": result.pages,
+                    "errors": result.errors, "duplicates": result.duplicates, "nounslist": words}
         else:
             return ck
 
 
+    @get(_path="/topwords?<key>&<site>&<limit>", _types=[str, str, int], _produces=mediatypes.APPLICATION_JSON)
+    def getTopWords(self, key, site, limit):
+        x_real_ip = self.request.headers.get("X-Real-IP")
+        remote_ip = x_real_ip or self.request.remote_ip or self.request.remote_addr
+
+        # The key is a query argument, it may be missing
+        a = lookup_key(key, remote_ip, self.MAXKEYVALTIME) if key else []
+        ck = check_key_validity(a, key, remote_ip, self.MAXKEYVALTIME)
+        if ck is not True:
+            return ck
+
+        # The word wall, from the top words kept as /sendurl stores the pages
+        data = get_database(WORDWALL_DB)
+        if data.getConnection() is None:
+            return {"Error": data.getMessage()}
+        try:
+            words = get_top_words(site, TOP_WORDS if limit is None else limit, data)
+        except ValueError as e:
+            return {"Error": str(e)}
+        finally:
+            data.close()
+        if words is None:
+            return {"Error": data.getMessage()}
+        return {"site": site, "nounslist": words}
+
     @post(_path="/login", _consumes=mediatypes.APPLICATION_JSON, _produces=mediatypes.APPLICATION_JSON)
     def getLogin(self, login):
         x_real_ip = self.request.headers.get("X-Real-IP")
@@ -132,48 +231,93 @@ class MainHandler(pyrestful.rest.RestHandler):
         else:
             nickname = "no logged user"
 
-        gkey = generate_hash_key()
-        ciccio = Keystore(parent=db.Key("mkey",gkey), \
-                 loggeduser = nickname, \
-                 ukey = gkey, \
-                 ip = remote_ip, \
-                 valid = True, \
-                 user  = login["username"], \
-                 password = login["password"])
-
-        ciccio.put()
+        if APPKEY_MODE == "signed":
+            # Validated from its signature, nothing to store
+            gkey = generate_signed_key(remote_ip)
+        else:
+            gkey = generate_hash_key()
+            ciccio = Keystore(id=gkey, \
+                     loggeduser = nickname, \
+                     ukey = gkey, \
+                     ip = remote_ip, \
+                     valid = True, \
+                     user  = login["username"], \
+                     password = login["password"])
+
+            ciccio.put()
         return { "key" : gkey  , "ip" : remote_ip, "user" : nickname, "user1" : login["username"], "pwd" : login["password"] }
 
-    @get(_path="/getallkeys", _produces=mediatypes.APPLICATION_JSON)
-    def getAllKeys(self):
-        x_real_ip = self.request.headers.get("X-Real-IP")
-        remote_ip = x_real_ip or self.request.remote_ip or self.request.remote_addr
-
-        listAllKeys = {}
-        keys = Keystore.all().order('-inserted')
-        k = None
-
-        for k in keys:
-            listAllKeys.update({'key' : k.ukey, 'ip' : k.ip, 'inserted' : k.inserted})
-
-        if k:
-            return {"key": k.ukey}
-        else:
-            return {"keylength" : len(keys)}
+    @get(_path="/getallkeys?<limit>&<cursor>&<state>", _types=[int, str, str], _produces=mediatypes.APPLICATION_JSON)
+    def getAllKeys(self, limit, cursor, state):
+        # The listing shows every key with its ip
+        if not users.is_current_user_admin():
+            return {"Error": "admin login required"}
+
+        try:
+            keys, next_cursor = list_keys(limit, cursor, state, self.MAXKEYVALTIME)
+        except ValueError as e:
+            return {"Error": str(e)}
+
+        return {"keys": keys, "cursor": next_cursor}
+
+    @get(_path="/reapkeys", _produces=mediatypes.APPLICATION_JSON)
+    def getReapKeys(self):
+        # App Engine drops X-Appengine-Cron from outside requests
+        if self.request.headers.get("X-Appengine-Cron") != "true" and not users.is_current_user_admin():
+            return {"Error": "cron or admin login required"}
+
+        # Within the cron request deadline, the next run goes on
+        return KeyReaper(self.MAXKEYVALTIME).run(deadline=self.REAPDEADLINE)
+
+    @get(_path="/migrate", _produces=mediatypes.APPLICATION_JSON)
+    def getMigrate(self):
+        # Run after each deploy, and by cron for the instances deployed meanwhile
+        if self.request.headers.get("X-Appengine-Cron") != "true" and not users.is_current_user_admin():
+            return {"Error": "cron or admin login required"}
+
+        data = get_database(WORDWALL_DB, check_schema=False)
+        if data.getConnection() is None:
+            return {"Error": data.getMessage()}
+        try:
+            applied = data.migrate()
+        finally:
+            data.close()
+        if applied is None:
+            return {"Error": data.getMessage()}
+        return {"applied": applied}
 
     def get_login_url(self):
         return users.create_login_url(self.request.uri)
 
-app = pyrestful.rest.RestService([MainHandler])
+SCRAPE_WORKERS = 4
+REAP_INTERVAL = 900
+
+def cron_or_admin(handler):
+    # App Engine drops X-Appengine-Cron from outside requests
+    return handler.request.headers.get("X-Appengine-Cron") == "true" or users.is_current_user_admin()
+
+# Served on /metrics with the operations
+metrics = MetricsRegistry()
+metrics.register_collector(page_fetcher.collect)
+metrics.register_collector(collect_db_pools)
 
 if __name__ == '__main__':
 
-    http_server = HTTPServer(WSGIAdapter(app))
+    # Standalone the scrapes run on a bounded pool, so the IOLoop keeps
+    # serving the other endpoints while a page is fetched and parsed
+    app = pyrestful.rest.RestService([MainHandler], compress_response=True, metrics_path="/metrics", metrics=metrics,
+                                     executors={"scrape": ThreadPoolExecutor(max_workers=SCRAPE_WORKERS)})
+    KeyReaper(MainHandler.MAXKEYVALTIME).start(REAP_INTERVAL)
+    http_server = HTTPServer(app)
     http_server.listen(5000)
     IOLoop.instance().start()
 
 else:
 
+    # WSGI requests must finish synchronously, so no executors here. The
+    # app is public, /metrics is only served to cron and the admins
+    app = pyrestful.rest.RestService([MainHandler], compress_response=True, metrics_path="/metrics", metrics=metrics,
+                                     metrics_authorize=cron_or_admin)
     application = tornado.wsgi.WSGIAdapter(app)
 
 
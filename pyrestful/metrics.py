@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# -*- coding: utf-8 -*-
+
+import bisect
+import threading
+
+import tornado.web
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUANTILES       = (0.5, 0.95, 0.99)
+
+class Histogram(object):
+	""" Latency histogram with fixed buckets, the last one counts what is above every bound """
+	def __init__(self, buckets=LATENCY_BUCKETS):
+		self.buckets = buckets
+		self.counts  = [0]*(len(buckets)+1)
+		self.count   = 0
+		self.sum     = 0.0
+
+	def observe(self, value):
+		""" Adds a value to its bucket """
+		self.counts[bisect.bisect_left(self.buckets,value)] += 1
+		self.count += 1
+		self.sum   += value
+
+	def quantile(self, q):
+		""" Estimates the quantile by interpolating inside the bucket that holds it """
+		if self.count == 0:
+			return 0.0
+		rank = q*self.count
+		cumulative = 0
+		for i, c in enumerate(self.counts):
+			if c and cumulative + c >= rank:
+				if i == len(self.buckets):
+					return self.buckets[-1]
+				lower = self.buckets[i-1] if i else 0.0
+				return lower + (self.buckets[i]-lower)*(rank-cumulative)/c
+			cumulative += c
+		return self.buckets[-1]
+
+	def copy(self):
+		h = Histogram(self.buckets)
+		h.counts = list(self.counts)
+		h.count  = self.count
+		h.sum    = self.sum
+		return h
+
+class OperationMetrics(object):
+	""" Request count, error count and latency of one operation """
+	def __init__(self, buckets=LATENCY_BUCKETS):
+		self.requests = 0
+		self.errors   = 0
+		self.latency  = Histogram(buckets)
+
+class MetricsRegistry(object):
+	""" Metrics of the operations of a RestService, safe to share between threads """
+	def __init__(self, buckets=LATENCY_BUCKETS):
+		self.buckets     = buckets
+		self._operations = {}
+		self._collectors = []
+		self._lock       = threading.Lock()
+
+	def register_collector(self, collector):
+		""" Adds a callable returning a list of (name, type, help, value), rendered with the operations """
+		with self._lock:
+			self._collectors.append(collector)
+
+	def record(self, operation, seconds, error=False):
+		""" Records a request served by the operation """
+		with self._lock:
+			metrics = self._operations.get(operation)
+			if metrics is None:
+				metrics = self._operations[operation] = OperationMetrics(self.buckets)
+			metrics.requests += 1
+			if error:
+				metrics.errors += 1
+			metrics.latency.observe(seconds)
+
+	def snapshot(self):
+		""" Gets a consistent copy of the metrics as {operation: (requests, errors, histogram)} """
+		with self._lock:
+			return dict((name,(m.requests,m.errors,m.latency.copy())) for name, m in self._operations.items())
+
+	def render(self):
+		""" Renders the metrics in the Prometheus text format """
+		snapshot   = sorted(self.snapshot().items())
+		lines      = []
+		lines.append('# HELP pyrestful_requests_total Requests served by the operation.')
+		lines.append('# TYPE pyrestful_requests_total counter')
+		for name, (requests, errors, latency) in snapshot:
+			lines.append('pyrestful_requests_total{operation="%s"} %d'%(_label(name),requests))
+		lines.append('# HELP pyrestful_errors_total Requests of the operation answered with a server error.')
+		lines.append('# TYPE pyrestful_errors_total counter')
+		for name, (requests, errors, latency) in snapshot:
+			lines.append('pyrestful_errors_total{operation="%s"} %d'%(_label(name),errors))
+		lines.append('# HELP pyrestful_request_duration_seconds Latency of the operation.')
+		lines.append('# TYPE pyrestful_request_duration_seconds histogram')
+		for name, (requests, errors, latency) in snapshot:
+			cumulative = 0
+			for bound, c in zip(latency.buckets + ('+Inf',),latency.counts):
+				cumulative += c
+				lines.append('pyrestful_request_duration_seconds_bucket{operation="%s",le="%s"} %d'%(_label(name),bound,cumulative))
+			lines.append('pyrestful_request_duration_seconds_sum{operation="%s"} %r'%(_label(name),latency.sum))
+			lines.append('pyrestful_request_duration_seconds_count{operation="%s"} %d'%(_label(name),latency.count))
+		lines.append('# HELP pyrestful_request_duration_quantile_seconds Latency quantiles of the operation, estimated from the histogram.')
+		lines.append('# TYPE pyrestful_request_duration_quantile_seconds gauge')
+		for name, (requests, errors, latency) in snapshot:
+			for q in QUANTILES:
+				lines.append('pyrestful_request_duration_quantile_seconds{operation="%s",quantile="%s"} %r'%(_label(name),q,latency.quantile(q)))
+		with self._lock:
+			collectors = list(self._collectors)
+		for collector in collectors:
+			for name, kind, help, value in collector():
+				lines.append('# HELP %s %s'%(name,help))
+				lines.append('# TYPE %s %s'%(name,kind))
+				lines.append('%s %s'%(name,value))
+		return '\n'.join(lines) + '\n'
+
+def _label(value):
+	return str(value).replace('\\','\\\\').replace('"','\\"').replace('\n','\\n')
+
+class MetricsHandler(tornado.web.RequestHandler):
+	""" Serves the metrics of a MetricsRegistry """
+	def initialize(self, registry):
+		self.registry = registry
+
+	def get(self):
+		# The metrics_authorize setting, a function of the handler, restricts who reads them
+		authorize = self.settings.get('metrics_authorize')
+		if authorize is not None and not authorize(self):
+			raise tornado.web.HTTPError(403)
+		self.set_header('Content-Type','text/plain; version=0.0.4; charset=utf-8')
+		self.write(self.registry.render())
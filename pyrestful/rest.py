@@ -18,16 +18,31 @@
 
 import tornado.ioloop
 import tornado.web
+import tornado.gen
+import tornado.concurrent
 import tornado.wsgi
 import xml.dom.minidom
 import inspect
 import re
 import json
 import sys
+from timeit import default_timer
+from tornado.log import app_log
 
 from pyrestful import mediatypes, types
+from pyrestful.metrics import MetricsRegistry, MetricsHandler
 from pyconvert.pyconv import convertXML2OBJ, convert2XML, convertJSON2OBJ, convert2JSON
 
+# Bytes of encoded JSON buffered before each flush, see RestHandler._write_json
+JSON_CHUNK_SIZE = 64*1024
+# Containers of scalars up to this many items are encoded with one call of the encoder
+JSON_INLINE_ITEMS = 16
+
+if sys.version_info > (3,):
+	string_types = str
+else:
+	string_types = basestring
+
 class PyRestfulException(Exception):
 	""" Class for PyRestful exceptions """
 	def __init__(self,message):
@@ -35,14 +50,44 @@ class PyRestfulException(Exception):
 	def __str__(self):
 		return repr(self.message)
 
+def iter_json(value, dumps):
+	""" Generates the JSON of value in pieces, the small containers of scalars are encoded at once """
+	if isinstance(value,dict):
+		if len(value) <= JSON_INLINE_ITEMS and not any(isinstance(v,(dict,list,tuple)) for v in value.values()):
+			yield dumps(value)
+			return
+		yield '{'
+		for i, (k, v) in enumerate(value.items()):
+			# The keys converted like the encoder does: 1 as "1", None as "null"
+			if not isinstance(k,string_types):
+				k = dumps(k)
+			yield (',' if i else '') + dumps(k) + ':'
+			for piece in iter_json(v,dumps):
+				yield piece
+		yield '}'
+	elif isinstance(value,(list,tuple)):
+		if len(value) <= JSON_INLINE_ITEMS and not any(isinstance(v,(dict,list,tuple)) for v in value):
+			yield dumps(value)
+			return
+		yield '['
+		for i, v in enumerate(value):
+			if i:
+				yield ','
+			for piece in iter_json(v,dumps):
+				yield piece
+		yield ']'
+	else:
+		yield dumps(value)
+
 def config(func,method,**kwparams):
 	""" Decorator config function """
 	path     = None
 	produces = None
 	consumes = None
-	types    = None
+	params_types = None
 	manual_response = None
 	catch_fire = False
+	executor = None
 
 	if len(kwparams):
 		path = kwparams['_path']
@@ -51,18 +96,27 @@ def config(func,method,**kwparams):
 		if '_consumes' in kwparams:
 			consumes = kwparams['_consumes']
 		if '_types' in kwparams:
-			types = kwparams['_types']
+			params_types = kwparams['_types']
 		if '_manual_response' in kwparams:
 			manual_response = kwparams['_manual_response']
 		if '_catch_fire' in kwparams:
 			catch_fire = kwparams['_catch_fire']
+		if '_executor' in kwparams:
+			# A thread pool, or the name of one in the 'executors' setting, that runs
+			# a blocking operation off the IOLoop. The operation must not write to
+			# the handler from there: it returns the response like any other
+			executor = kwparams['_executor']
+
+	# Generator functions are run as tornado coroutines
+	if inspect.isgeneratorfunction(func):
+		func = tornado.gen.coroutine(func)
 
 	def operation(*args,**kwargs):
 		return func(*args,**kwargs)
 
 	operation.func_name       = func.__name__
-	operation._func_params    = inspect.getargspec(func).args[1:]
-	operation._types          = types or [str]*len(operation._func_params)
+	operation._func_params    = inspect.getargspec(getattr(func,'__wrapped__',func)).args[1:]
+	operation._types          = params_types or [str]*len(operation._func_params)
 	operation._service_name   = re.findall(r'(?<=/)\w+',path)
 	operation._service_params = re.findall(r'(?<={)\w+',path)
 	operation._method         = method
@@ -72,6 +126,12 @@ def config(func,method,**kwparams):
 	operation._path           = path
 	operation._manual_response = manual_response
 	operation._catch_fire = catch_fire
+	operation._executor   = executor
+	# If the _types is not specified, assumes str types for the params
+	operation._params_types   = operation._types + [str]*(len(operation._service_params)-len(operation._types))
+	# One compiled converter per param, so requests do not walk types.convert
+	operation._converters     = tuple(types.converter(t) for t in operation._params_types) + \
+	                            (types.converter(str),)*(len(operation._func_params)-len(operation._params_types))
 	
 	if not operation._produces in [mediatypes.APPLICATION_JSON,mediatypes.APPLICATION_XML,mediatypes.TEXT_XML,mediatypes.TEXT_HTML, None]:
 		raise PyRestfulException('The media type used do not exist : '+operation.func_name)
@@ -109,26 +169,32 @@ def delete(*params, **kwparams):
 	return method
 
 class RestHandler(tornado.web.RequestHandler):
+	@tornado.gen.coroutine
 	def get(self):
 		""" Executes get method """
-		self._exe('GET')
+		yield self._exe('GET')
 
+	@tornado.gen.coroutine
 	def post(self):
 		""" Executes post method """
-		self._exe('POST')
+		yield self._exe('POST')
 
+	@tornado.gen.coroutine
 	def put(self):
 		""" Executes put method """
-		self._exe('PUT')
+		yield self._exe('PUT')
 
+	@tornado.gen.coroutine
 	def patch(self):
 		""" Executes patch method """
-		self._exe('PATCH')
+		yield self._exe('PATCH')
 
+	@tornado.gen.coroutine
 	def delete(self):
 		""" Executes put method """
-		self._exe('DELETE')
+		yield self._exe('DELETE')
 
+	@tornado.gen.coroutine
 	def _exe(self, method):
 		""" Executes the python function for the Rest Service """
 		request_path = self.request.path
@@ -138,85 +204,116 @@ class RestHandler(tornado.web.RequestHandler):
 		if 'Content-Type' in self.request.headers.keys():
 			content_type = self.request.headers['Content-Type']
 
-		# Get all funcion names configured in the class RestHandler
-		functions    = list(filter(lambda op: hasattr(getattr(self,op),'_service_name') == True and inspect.ismethod(getattr(self,op)) == True, dir(self)))
-		# Get all http methods configured in the class RestHandler
-		http_methods = list(map(lambda op: getattr(getattr(self,op),'_method'), functions))
+		# The dispatch table is built once per class, see build_routes
+		routes, http_methods = self.get_routes()
 
 		if method not in http_methods:
 			raise tornado.web.HTTPError(405,'The service not have %s verb'%method)
-		for operation in list(map(lambda op: getattr(self,op), functions)):
-			service_name          = getattr(operation,'_service_name')
-			service_params        = getattr(operation,'_service_params')
-			# If the _types is not specified, assumes str types for the params
-			params_types          = getattr(operation,"_types") or [str]*len(service_params)
-			params_types          = params_types + [str]*(len(service_params)-len(params_types))
-			produces              = getattr(operation,'_produces')
-			consumes              = getattr(operation,'_consumes')
-			services_from_request = list(filter(lambda x: x in path,service_name))
-			query_params          = getattr(operation,'_query_params')
-			manual_response       = getattr(operation,'_manual_response')
-			catch_fire	      = getattr(operation,'_catch_fire')
-
-			if operation._method == self.request.method and service_name == services_from_request and len(service_params) + len(service_name) == len(services_and_params):
-				try:
-					params_values = self._find_params_value_of_url(service_name,request_path) + self._find_params_value_of_arguments(operation)
-					p_values      = self._convert_params_values(params_values, params_types)
-					if consumes == None and produces == None:
-						consumes = content_type
-						produces = content_type
-					if consumes == mediatypes.APPLICATION_XML:
-						if params_types[0] in [str]:
-							param_obj = xml.dom.minidom.parseString(self.request.body)
-						else:
-							param_obj = convertXML2OBJ(params_types[0],xml.dom.minidom.parseString(self.request.body).documentElement)
-						p_values.append(param_obj)
-					elif consumes == mediatypes.APPLICATION_JSON:
-						body = self.request.body
-						if sys.version_info > (3,):
-							body = str(self.request.body,'utf-8')
-						if params_types[0] in [dict,str]:
-							param_obj = json.loads(body)
-						else:
-							param_obj = convertJSON2OBJ(params_types[0],json.loads(body))
-						p_values.append(param_obj)
-					response = operation(*p_values)
-				
-					if response == None:
-						return
-
-					if produces:
-						self.set_header('Content-Type',produces)
-
-					if manual_response:
-						return
-
-					if produces == mediatypes.TEXT_HTML and isinstance(response,str):
-						self.write(response)
-						self.finish()
-
-					if produces == mediatypes.APPLICATION_JSON and hasattr(response,'__module__'):
-						response = convert2JSON(response)
-					elif produces == mediatypes.APPLICATION_XML and hasattr(response,'__module__') and not isinstance(response,xml.dom.minidom.Document):
-						response = convert2XML(response)
-
-					if produces == mediatypes.APPLICATION_JSON and isinstance(response,dict):
-						self.write(response)
-						self.finish()
-					elif produces == mediatypes.APPLICATION_JSON and isinstance(response,list):
-						self.write(json.dumps(response))
-						self.finish()
-					elif produces in [mediatypes.APPLICATION_XML,mediatypes.TEXT_XML] and isinstance(response,xml.dom.minidom.Document):
-						self.write(response.toxml())
-						self.finish()
-					else:
-						self.gen_http_error(500,'Internal Server Error : response is not %s document'%produces)
-						if catch_fire == True:
-							raise PyRestfulException('Internal Server Error : response is not %s document'%produces)
-				except Exception as detail:
-					self.gen_http_error(500,'Internal Server Error : %s'%detail)
-					if catch_fire == True:
-						raise PyRestfulException(detail)
+
+		operation = self._find_operation(routes, self.request.method, services_and_params)
+		if operation is None:
+			return
+		self._rest_operation = operation
+		self._rest_started   = default_timer()
+
+		service_name          = operation._service_name
+		params_types          = operation._params_types
+		produces              = operation._produces
+		consumes              = operation._consumes
+		manual_response       = operation._manual_response
+		catch_fire            = operation._catch_fire
+
+		try:
+			params_values = self._find_params_value_of_url(service_name,request_path) + self._find_params_value_of_arguments(operation)
+			try:
+				p_values  = self._convert_params_values(params_values, operation._converters)
+			except (ValueError,TypeError,AttributeError,IndexError) as detail:
+				self.gen_http_error(400,'Bad Request : %s'%detail)
+				return
+			if consumes == None and produces == None:
+				consumes = content_type
+				produces = content_type
+			if consumes == mediatypes.APPLICATION_XML:
+				if params_types[0] in [str]:
+					param_obj = xml.dom.minidom.parseString(self.request.body)
+				else:
+					param_obj = convertXML2OBJ(params_types[0],xml.dom.minidom.parseString(self.request.body).documentElement)
+				p_values.append(param_obj)
+			elif consumes == mediatypes.APPLICATION_JSON:
+				body = self.request.body
+				if sys.version_info > (3,):
+					body = str(self.request.body,'utf-8')
+				if params_types[0] in [dict,str]:
+					param_obj = json.loads(body)
+				else:
+					param_obj = convertJSON2OBJ(params_types[0],json.loads(body))
+				p_values.append(param_obj)
+			executor = self._find_executor(operation._executor)
+			if executor is not None:
+				response = yield executor.submit(operation,self,*p_values)
+			else:
+				response = operation(self,*p_values)
+			if tornado.concurrent.is_future(response):
+				response = yield response
+
+			if response == None:
+				return
+
+			if produces:
+				self.set_header('Content-Type',produces)
+
+			if manual_response:
+				return
+
+			if produces == mediatypes.TEXT_HTML and isinstance(response,str):
+				self.write(response)
+				self.finish()
+
+			if produces == mediatypes.APPLICATION_JSON and hasattr(response,'__module__'):
+				response = convert2JSON(response)
+			elif produces == mediatypes.APPLICATION_XML and hasattr(response,'__module__') and not isinstance(response,xml.dom.minidom.Document):
+				response = convert2XML(response)
+
+			if produces == mediatypes.APPLICATION_JSON and isinstance(response,(dict,list)):
+				self._write_json(response)
+			elif produces in [mediatypes.APPLICATION_XML,mediatypes.TEXT_XML] and isinstance(response,xml.dom.minidom.Document):
+				self.write(response.toxml())
+				self.finish()
+			else:
+				self.gen_http_error(500,'Internal Server Error : response is not %s document'%produces)
+				if catch_fire == True:
+					raise PyRestfulException('Internal Server Error : response is not %s document'%produces)
+		except Exception as detail:
+			self.gen_http_error(500,'Internal Server Error : %s'%detail)
+			if catch_fire == True:
+				raise PyRestfulException(detail)
+
+	def on_finish(self):
+		""" Records the request in the metrics of the operation, when the RestService has them """
+		metrics   = self.settings.get('metrics')
+		operation = getattr(self,'_rest_operation',None)
+		if metrics is not None and operation is not None:
+			metrics.record(operation.func_name,default_timer() - self._rest_started,self.get_status() >= 500)
+
+	def _find_operation(self, routes, method, services_and_params):
+		""" Finds the operation for the request in the dispatch table """
+		table = routes.get((method,len(services_and_params)))
+		if table is None:
+			return None
+		segments = set(services_and_params)
+		# Operations are indexed by their first service name, so only the
+		# operations named by a segment of the request are checked
+		for name in services_and_params + [None]:
+			for operation in table.get(name,()):
+				if all(s in segments for s in operation._service_name):
+					return operation
+		return None
+
+	def _find_executor(self, executor):
+		""" Gets the executor of the operation, a name is looked up in the 'executors' application setting """
+		if isinstance(executor,str):
+			return self.settings.get('executors',{}).get(executor)
+		return executor
 
 	def _find_params_value_of_url(self,services,url):
 		""" Find the values of path params """
@@ -246,18 +343,57 @@ class RestHandler(tornado.web.RequestHandler):
 			values = [None]*(len(operation._func_params) - len(operation._service_params))
 		return values
 
-	def _convert_params_values(self, values_list, params_types):
-		""" Converts the values to the specifics types """
+	def _convert_params_values(self, values_list, converters):
+		""" Converts the values to the specifics types with the converters of the operation """
 		values = list()
 		i = 0
 		for v in values_list:
 			if v != None:
-				values.append(types.convert(v,params_types[i]))
+				values.append(converters[i](v))
 			else:
 				values.append(v)
 			i+=1
 		return values
 
+	def _write_json(self, response):
+		""" Writes a dict or a list as JSON and finishes the response, encoding the nested containers piece
+		by piece and flushing every json_chunk_size bytes, so the whole document is never held in memory.
+		The encoder is json.dumps unless a faster one is given in the json_encoder setting, and the
+		chunks are gzipped for the clients that accept it when the compress_response setting is on.
+		Under tornado.wsgi.WSGIAdapter the document is written whole: the adapter holds the response
+		until the end anyway, and its connection cannot be closed to cut a response sent in part """
+		dumps      = self.settings.get('json_encoder',json.dumps)
+		chunk_size = self.settings.get('json_chunk_size',JSON_CHUNK_SIZE)
+		streamed   = hasattr(self.request.connection,'close')
+		self.set_header('Content-Type','application/json; charset=UTF-8')
+		chunk   = []
+		size    = 0
+		flushed = False
+		try:
+			for piece in iter_json(response,dumps):
+				# Like tornado json_encode, so the JSON is safe inside a <script>
+				piece = piece.replace('</','<\\/')
+				chunk.append(piece)
+				size += len(piece)
+				if streamed and size >= chunk_size:
+					self.write(''.join(chunk))
+					self.flush()
+					flushed = True
+					chunk = []
+					size  = 0
+		except Exception:
+			if not flushed:
+				# Nothing sent yet, the caller answers with an error
+				raise
+			# The status and a part of the document are sent: the connection is
+			# closed so the client sees a cut response, not a complete one
+			app_log.exception('Error encoding the JSON response of %s',self.request.uri)
+			self.request.connection.close()
+			self.finish()
+			return
+		self.write(''.join(chunk))
+		self.finish()
+
 	def gen_http_error(self,status,msg):
 		""" Generates the custom HTTP error """
 		self.clear()
@@ -265,6 +401,29 @@ class RestHandler(tornado.web.RequestHandler):
 		self.write('<html><body>'+str(msg)+'</body></html>')
 		self.finish()
 
+	@classmethod
+	def build_routes(cls):
+		""" Builds the dispatch table of the Rest Services, indexed by http method and number of path segments """
+		routes  = {}
+		methods = set()
+		for f in dir(cls):
+			o = getattr(cls,f)
+			if callable(o) and hasattr(o,'_service_name'):
+				o = getattr(o,'__func__',o)
+				key  = (o._method,len(o._service_name) + len(o._service_params))
+				name = o._service_name[0] if o._service_name else None
+				routes.setdefault(key,{}).setdefault(name,[]).append(o)
+				methods.add(o._method)
+		cls._routes = (routes,frozenset(methods))
+		return cls._routes
+
+	@classmethod
+	def get_routes(cls):
+		""" Gets the dispatch table, building it if the handler was not registered by a RestService """
+		if '_routes' not in cls.__dict__:
+			return cls.build_routes()
+		return cls._routes
+
 	@classmethod
 	def get_services(self):
 		""" Generates the resources (uri) to deploy the Rest Services """
@@ -300,7 +459,7 @@ class RestHandler(tornado.web.RequestHandler):
 class RestService(tornado.web.Application):
 	""" Class to create Rest services in tornado web server """
 	resource = None
-	def __init__(self, rest_handlers, resource=None, handlers=None, default_host='', transforms=None, **settings):
+	def __init__(self, rest_handlers, resource=None, handlers=None, default_host='', transforms=None, metrics_path=None, **settings):
 		restservices = []
 		self.resource = resource
 		for r in rest_handlers:
@@ -308,10 +467,15 @@ class RestService(tornado.web.Application):
 			restservices += svs
 		if handlers != None:
 			restservices += handlers
+		if metrics_path != None:
+			# Latency and error metrics of every operation, in Prometheus text format
+			registry = settings.setdefault('metrics',MetricsRegistry())
+			restservices.insert(0,(metrics_path,MetricsHandler,dict(registry=registry)))
 		tornado.web.Application.__init__(self, restservices, default_host, transforms, **settings)
 
 	def _generateRestServices(self,rest):
 		svs = []
+		rest.build_routes()
 		paths = rest.get_paths()
 		for p in paths:
 			s = re.sub(r'(?<={)\w+}','.*',p).replace('{','')
@@ -323,7 +487,7 @@ class RestService(tornado.web.Application):
 class WSGIRestService(tornado.wsgi.WSGIApplication):
 	""" Class to create WSGI Rest services in tornado web server """
 	resource = None
-	def __init__(self, rest_handlers, resource=None, handlers=None, default_host='', **settings):
+	def __init__(self, rest_handlers, resource=None, handlers=None, default_host='', metrics_path=None, **settings):
 		restservices = []
 		self.resource = resource
 		for r in rest_handlers:
@@ -331,10 +495,15 @@ class WSGIRestService(tornado.wsgi.WSGIApplication):
 			restservices += svs
 		if handlers != None:
 			restservices += handlers
+		if metrics_path != None:
+			# Latency and error metrics of every operation, in Prometheus text format
+			registry = settings.setdefault('metrics',MetricsRegistry())
+			restservices.insert(0,(metrics_path,MetricsHandler,dict(registry=registry)))
 		tornado.wsgi.WSGIApplication.__init__(self, restservices, default_host, **settings)
 
 	def _generateRestServices(self,rest):
 		svs = []
+		rest.build_routes()
 		paths = rest.get_paths()
 		for p in paths:
 			s = re.sub(r'(?<={)\w+}','.*',p).replace('{','')
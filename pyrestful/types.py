@@ -42,3 +42,31 @@ def convert(value, type):
 		elif str(value).upper() == 'FALSE': return False
 	else:
 		return value
+
+_booleans = {'TRUE': True, 'FALSE': False}
+
+def converter(type):
+	""" Builds the convert function for a type, so the issubclass chain of convert runs once per operation """
+	if issubclass(type,str):
+		# convert gives back booleans for 'true'/'false' only when str is also the boolean type
+		as_boolean = issubclass(type,boolean)
+		def convert_str(value):
+			flag = _booleans.get(value.upper())
+			if flag is None:
+				return value.decode('utf-8')
+			return flag if as_boolean else value
+		return convert_str
+	elif issubclass(type,unicode):
+		return unicode
+	elif issubclass(type,int):
+		return int
+	elif issubclass(type,long):
+		return long
+	elif issubclass(type,float):
+		return float
+	elif issubclass(type,boolean):
+		def convert_boolean(value):
+			return _booleans.get(value.upper(),value)
+		return convert_boolean
+	else:
+		return lambda value: value
@@ -0,0 +1,26 @@
+import os
+import sys
+
+import pytest
+
+# The tests import the packages of the repository, like the benchmarks do,
+# and the stand-in servers of the benchmarks
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+
+@pytest.fixture
+def server():
+    from standin_http import StandinServer
+    with StandinServer() as server:
+        yield server
+
+
+@pytest.fixture
+def fetcher():
+    from components.fetcher import PageFetcher
+    fetcher = PageFetcher(read_timeout=0.5, max_body_size=1024 * 1024)
+    yield fetcher
+    # Let the handler threads of the kept alive connections end
+    fetcher.pool.clear()
@@ -0,0 +1,38 @@
+"""
+Word counts of the pages memoized by their content
+"""
+import pytest
+
+pytest.importorskip('google.appengine.ext.ndb')
+pytest.importorskip('MySQLdb')
+pytest.importorskip('Crypto')
+from components import helpers
+
+
+@pytest.fixture
+def counting(fetcher, monkeypatch):
+    parsed = []
+    parse = helpers.iter_visible_text
+
+    def iter_visible_text(chunks, *args):
+        parsed.append(chunks)
+        return parse(chunks, *args)
+
+    monkeypatch.setattr(helpers, 'page_fetcher', fetcher)
+    monkeypatch.setattr(helpers, 'word_memo', helpers.LRUCache(helpers.WORD_MEMO_SIZE))
+    monkeypatch.setattr(helpers, 'iter_visible_text', iter_visible_text)
+    return parsed
+
+
+def test_same_content_parsed_once(server, counting):
+    # Both serve the same page of 1000 bytes
+    counts, fingerprint = helpers.count_page(server.url + "/page/1000")
+    links = []
+    again = helpers.count_page(server.url + "/slow/0", links)
+    assert len(counting) == 1
+    assert again == (counts, fingerprint)
+    assert again[0] is not counts
+    assert counts[u'fox'] > 0
+
+    helpers.count_page(server.url + "/page/2000")
+    assert len(counting) == 2
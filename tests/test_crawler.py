@@ -0,0 +1,22 @@
+"""
+Same site crawl of the stand-in server
+"""
+from components.crawler import Crawler
+from components.simhash import simhash
+from components.textextract import iter_visible_text
+from components.tokenizer import count_tokens
+
+
+def test_crawl_same_site(server, fetcher):
+    def count(url, links):
+        counts = count_tokens(iter_visible_text(fetcher.stream(url).chunks, 'utf-8', links))
+        return counts, simhash(counts)
+
+    result = Crawler(count, max_depth=2, max_pages=100).crawl(server.url + "/site/0")
+    # The binary tree of the site down to depth 2, nothing outside of it
+    assert sorted(int(url.rsplit('/', 1)[1]) for url in result.pages) == list(range(7))
+    assert not result.errors
+    assert result.counts['common'] == 7
+
+    result = Crawler(count, max_depth=3, max_pages=10).crawl(server.url + "/site/0")
+    assert len(result.pages) + len(result.errors) == 10
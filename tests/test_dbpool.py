@@ -0,0 +1,99 @@
+"""
+Pool of database connections
+"""
+import threading
+import time
+
+import pytest
+
+from components.dbpool import DatabasePool
+from components.dbpool import PoolTimeout
+
+
+class FakeConnection(object):
+
+    def __init__(self):
+        self.closed = False
+        self.rollbacks = 0
+        self.alive = True
+
+    def ping(self):
+        if not self.alive:
+            raise IOError("gone")
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+
+def make_pool(**kwargs):
+    opened = []
+
+    def connect():
+        opened.append(FakeConnection())
+        return opened[-1]
+    pool = DatabasePool(connect, ping=lambda conn: conn.ping(), reset=lambda conn: conn.rollback(), **kwargs)
+    return pool, opened
+
+
+def test_connection_reused_and_reset():
+    pool, opened = make_pool()
+    for _ in range(5):
+        with pool.connection():
+            pass
+    assert len(opened) == 1
+    assert opened[0].rollbacks == 5
+    assert pool.stats()["checkouts"] == 5
+
+
+def test_timeout_when_saturated():
+    pool, opened = make_pool(max_size=2, wait_timeout=0.1)
+    held = [pool.acquire(), pool.acquire()]
+    started = time.time()
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    assert time.time() - started >= 0.1
+    stats = pool.stats()
+    assert stats["timeouts"] == 1
+    assert stats["waits"] == 1
+    assert len(opened) == 2
+    for pooled in held:
+        pool.release(pooled)
+
+
+def test_waiter_gets_released_connection():
+    pool, opened = make_pool(max_size=1, wait_timeout=5)
+    pooled = pool.acquire()
+    got = []
+    waiter = threading.Thread(target=lambda: got.append(pool.acquire()))
+    waiter.start()
+    time.sleep(0.05)
+    pool.release(pooled)
+    waiter.join(5)
+    assert got and got[0].conn is opened[0]
+    assert pool.stats()["waits"] == 1
+
+
+def test_dead_and_old_connections_replaced():
+    pool, opened = make_pool(max_age=60)
+    pooled = pool.acquire()
+    pool.release(pooled)
+    opened[0].alive = False
+    pooled = pool.acquire()
+    assert opened[0].closed and pooled.conn is opened[1]
+    # Older than max_age when it comes back
+    pooled.created -= 120
+    pool.release(pooled)
+    assert opened[1].closed
+    assert pool.acquire().conn is opened[2]
+    stats = pool.stats()
+    assert stats["dead"] == 1 and stats["recycled"] == 1
+
+
+def test_broken_connection_not_kept():
+    pool, opened = make_pool(max_size=1)
+    pool.release(pool.acquire(), broken=True)
+    assert opened[0].closed
+    assert pool.acquire().conn is opened[1]
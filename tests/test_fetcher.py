@@ -0,0 +1,43 @@
+"""
+Page fetcher against the stand-in server of the benchmarks
+"""
+import time
+
+import pytest
+
+from components.fetcher import FetchError
+from standin_http import html_page
+
+
+def test_connections_reused(server, fetcher):
+    for _ in range(20):
+        response = fetcher.fetch(server.url + "/page/20000")
+        assert response.code == 200
+        assert response.body == html_page(20000)
+    assert server.connections == 1
+
+
+def test_gzip_decoded(server, fetcher):
+    response = fetcher.fetch(server.url + "/gzip/20000")
+    assert response.headers.get('content-encoding') == 'gzip'
+    assert response.body == html_page(20000)
+
+
+def test_redirects_followed_up_to_limit(server, fetcher):
+    response = fetcher.fetch(server.url + "/redirect/3")
+    assert response.code == 200
+    assert response.url == server.url + "/redirect/0"
+    with pytest.raises(FetchError):
+        fetcher.fetch(server.url + "/redirect/%d" % (fetcher.max_redirects + 1))
+
+
+def test_size_cap(server, fetcher):
+    with pytest.raises(FetchError):
+        fetcher.fetch(server.url + "/page/2000000")
+
+
+def test_read_timeout(server, fetcher):
+    started = time.time()
+    with pytest.raises(FetchError):
+        fetcher.fetch(server.url + "/slow/2")
+    assert time.time() - started < 1.5
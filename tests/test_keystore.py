@@ -0,0 +1,78 @@
+"""
+Keystore entries stored under the api key as id, on the ndb testbed of
+the App Engine SDK
+"""
+import pytest
+
+testbed = pytest.importorskip('google.appengine.ext.testbed')
+pytest.importorskip('MySQLdb')
+pytest.importorskip('Crypto')
+from google.appengine.ext import ndb
+
+from components import helpers
+from components.helpers import Keystore
+
+MAX_TIME = 900
+
+
+@pytest.fixture(autouse=True)
+def datastore():
+    bed = testbed.Testbed()
+    bed.activate()
+    bed.init_datastore_v3_stub()
+    bed.init_memcache_stub()
+    ndb.get_context().clear_cache()
+    helpers.key_cache.clear()
+    yield bed
+    bed.deactivate()
+
+
+def store_key(ukey, ip="10.0.0.1", valid=True):
+    Keystore(id=ukey, loggeduser="tester", ukey=ukey, ip=ip, valid=valid, user="user", password="pwd").put()
+
+
+def test_get_key_by_id():
+    store_key("key1")
+    entry = Keystore.get_key("key1")
+    assert entry.key.id() == "key1"
+    assert entry.ukey == "key1" and entry.ip == "10.0.0.1" and entry.valid
+    assert Keystore.get_key("missing") is None
+    assert Keystore.get_key_async("key1").get_result().ukey == "key1"
+
+
+def test_get_keys_in_order():
+    store_key("key1")
+    store_key("key2", ip="10.0.0.2")
+    entries = Keystore.get_keys(["key2", "missing", "key1"])
+    assert [e.ukey if e is not None else None for e in entries] == ["key2", None, "key1"]
+
+
+def test_revocation_drops_cached_entry():
+    store_key("key1")
+    assert helpers.lookup_key("key1", "10.0.0.1", MAX_TIME)[0].ukey == "key1"
+    assert helpers.key_cache.get(("key1", "10.0.0.1")) is not None
+
+    # The post put hook of the revoked entity invalidates the cache
+    assert helpers.revoke_key("key1")
+    assert helpers.key_cache.get(("key1", "10.0.0.1")) is None
+    entries = helpers.lookup_key("key1", "10.0.0.1", MAX_TIME)
+    assert helpers.check_key_validity(entries, "key1", "10.0.0.1", MAX_TIME) == {"Appkey revoked": "key1"}
+
+
+def test_validate_keys():
+    store_key("key1")
+    store_key("key2", valid=False)
+    results = helpers.validate_keys([("key1", "10.0.0.1"), ("key2", "10.0.0.1"), ("key3", "10.0.0.1"),
+                                     ("key1", "10.0.0.9")], MAX_TIME)
+    assert results[0] is True
+    assert results[1] == {"Appkey revoked": "key2"}
+    assert results[2] == {"Error Appkey not present ": "key3"}
+    assert results[3] == {"Is same ip address": "False"}
+
+
+def test_list_keys_limit():
+    with pytest.raises(ValueError):
+        helpers.list_keys(0, None, None, MAX_TIME)
+    store_key("key1")
+    keys, cursor = helpers.list_keys(None, None, 'unexpired', MAX_TIME)
+    assert [k['key'] for k in keys] == ["key1"] and cursor is None
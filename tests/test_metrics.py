@@ -0,0 +1,34 @@
+"""
+Metrics of the operations served on metrics_path
+"""
+import pytest
+
+pytest.importorskip('pyconvert')
+from tornado.testing import AsyncHTTPTestCase
+
+import pyrestful.rest
+from pyrestful import mediatypes
+from pyrestful.rest import get
+
+
+class PingHandler(pyrestful.rest.RestHandler):
+
+    @get(_path="/ping", _produces=mediatypes.APPLICATION_JSON)
+    def getPing(self):
+        return {"ping": "pong"}
+
+
+class TestMetricsAuthorize(AsyncHTTPTestCase):
+
+    def get_app(self):
+        return pyrestful.rest.RestService([PingHandler], metrics_path="/metrics",
+                                          metrics_authorize=lambda handler: handler.request.headers.get("X-Admin") == "yes")
+
+    def test_refused(self):
+        assert self.fetch("/metrics").code == 403
+
+    def test_authorized(self):
+        assert self.fetch("/ping").code == 200
+        response = self.fetch("/metrics", headers={"X-Admin": "yes"})
+        assert response.code == 200
+        assert b"getPing" in response.body
@@ -0,0 +1,33 @@
+"""
+Page cache in front of the fetcher, against the stand-in server
+"""
+import shutil
+import tempfile
+import time
+
+from components.pagecache import CachingFetcher
+from components.pagecache import PageCache
+from standin_http import html_page
+
+
+def test_cache_revalidation(server, fetcher):
+    directory = tempfile.mkdtemp()
+    try:
+        cached = CachingFetcher(fetcher, PageCache(directory))
+        for _ in range(3):
+            assert cached.fetch(server.url + "/cached/1").body == html_page(1000)
+        time.sleep(1.1)
+        # Stale: revalidated with its ETag, the server answers 304
+        assert cached.fetch(server.url + "/cached/1").body == html_page(1000)
+        stats = cached.stats()
+        assert (stats["misses"], stats["hits"], stats["revalidations"]) == (1, 2, 1)
+        assert (server.bodies, server.not_modified) == (1, 1)
+
+        cached.fetch(server.url + "/cached/60")
+        # A new cache on the same directory starts from the disk tier
+        restarted = CachingFetcher(fetcher, PageCache(directory))
+        restarted.fetch(server.url + "/cached/60")
+        assert restarted.stats()["disk_hits"] == 1
+        assert server.bodies == 2
+    finally:
+        shutil.rmtree(directory)
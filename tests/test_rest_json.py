@@ -0,0 +1,89 @@
+"""
+JSON responses of pyrestful, encoded piece by piece
+"""
+import io
+import json
+
+import pytest
+
+pytest.importorskip('pyconvert')
+from tornado.testing import AsyncHTTPTestCase
+from tornado.wsgi import WSGIAdapter
+
+import pyrestful.rest
+from pyrestful import mediatypes
+from pyrestful.rest import get
+from pyrestful.rest import iter_json
+
+WORDS = [["word%d" % i, i] for i in range(5000)]
+
+
+class Unencodable(object):
+    pass
+
+
+class JsonHandler(pyrestful.rest.RestHandler):
+
+    @get(_path="/words", _produces=mediatypes.APPLICATION_JSON)
+    def getWords(self):
+        return {"key": "k", "nounslist": WORDS, "meta": {1: None, "html": "</script>"}}
+
+    @get(_path="/badfirst", _produces=mediatypes.APPLICATION_JSON)
+    def getBadFirst(self):
+        return {"nounslist": [Unencodable()]}
+
+    @get(_path="/badlater", _produces=mediatypes.APPLICATION_JSON)
+    def getBadLater(self):
+        return {"nounslist": WORDS + [Unencodable()]}
+
+
+class TestJsonResponse(AsyncHTTPTestCase):
+
+    def get_app(self):
+        return pyrestful.rest.RestService([JsonHandler], json_chunk_size=1024)
+
+    def test_nested_document(self):
+        response = self.fetch("/words")
+        assert response.code == 200
+        assert response.headers["Content-Type"] == "application/json; charset=UTF-8"
+        assert json.loads(response.body.decode('utf-8')) == {
+            "key": "k", "nounslist": WORDS, "meta": {"1": None, "html": "</script>"}}
+        assert b"<\\/script>" in response.body
+
+    def test_nested_list_streamed(self):
+        pieces = list(iter_json({"nounslist": WORDS}, json.dumps))
+        # Each pair of the nested list is its own piece
+        assert len(pieces) > len(WORDS)
+        assert max(len(piece) for piece in pieces) < 100
+        assert json.loads("".join(pieces)) == {"nounslist": WORDS}
+
+    def test_error_before_flush(self):
+        response = self.fetch("/badfirst")
+        assert response.code == 500
+
+    def test_error_after_flush(self):
+        # The status was sent: the response is cut, not completed nor replaced
+        response = self.fetch("/badlater")
+        assert response.code == 599 or response.error is not None
+        if response.body is not None:
+            with pytest.raises(ValueError):
+                json.loads(response.body.decode('utf-8'))
+
+
+def wsgi_get(app, path):
+    started = []
+    environ = {"REQUEST_METHOD": "GET", "PATH_INFO": path, "SERVER_NAME": "localhost",
+               "wsgi.url_scheme": "http", "wsgi.input": io.BytesIO()}
+    body = b"".join(app(environ, lambda status, headers: started.append(status)))
+    return started, body
+
+
+def test_wsgi_written_whole():
+    app = WSGIAdapter(pyrestful.rest.RestService([JsonHandler], json_chunk_size=1024))
+    started, body = wsgi_get(app, "/words")
+    assert started == ["200 OK"]
+    assert json.loads(body.decode('utf-8'))["nounslist"] == WORDS
+
+    # Nothing was sent before the error, the client gets a 500 and not a cut 200
+    started, body = wsgi_get(app, "/badlater")
+    assert started == ["500 Internal Server Error"]
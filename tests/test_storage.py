@@ -0,0 +1,106 @@
+"""
+Word wall storage on the SQLite backend: schema check, upserts, top
+words and pages stored once
+"""
+import random
+import sqlite3
+from collections import Counter
+
+import pytest
+
+pytest.importorskip('google.appengine.ext.ndb')
+pytest.importorskip('MySQLdb')
+pytest.importorskip('Crypto')
+from components import helpers
+from components import schema
+from components.simhash import simhash
+
+
+class PlainKey(object):
+    """
+    Stands for the RSA key of the word wall, the words are stored reversed
+    """
+
+    def publickey(self):
+        return self
+
+    def encrypt(self, word, _):
+        return (word[::-1],)
+
+
+@pytest.fixture
+def database(tmpdir, monkeypatch, request):
+    monkeypatch.setattr(helpers, 'SQLITE_DIR', str(tmpdir))
+    dbname = request.node.name
+    migrating = helpers.get_database(dbname, 'sqlite', check_schema=False)
+    assert migrating.migrate() == [version for version, _, _ in schema.SQLITE_MIGRATIONS]
+    migrating.close()
+    data = helpers.get_database(dbname, 'sqlite')
+    yield data
+    data.close()
+    helpers.db_pools.pop(('sqlite', dbname)).close()
+    helpers.checked_databases.discard(('sqlite', dbname))
+
+
+def page_counts(rnd, words=300, size=80):
+    return Counter(dict((u"word%d" % rnd.randrange(words), rnd.randrange(1, 20)) for _ in range(size)))
+
+
+def test_schema_behind_refused(tmpdir, monkeypatch):
+    monkeypatch.setattr(helpers, 'SQLITE_DIR', str(tmpdir))
+    data = helpers.get_database('behind', 'sqlite')
+    assert data.getConnection() is None
+    assert data.getMessage().startswith("[SCHEMA ERROR]")
+    helpers.db_pools.pop(('sqlite', 'behind')).close()
+    # The check only reads, the migrations make schema_version
+    conn = sqlite3.connect(str(tmpdir.join('behind.db')))
+    assert conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0] == 0
+    conn.close()
+
+
+def test_topwords_match_the_counts(database):
+    rnd = random.Random(0)
+    totals = Counter()
+    sites = dict((site, Counter()) for site in ("a.com", "b.com"))
+    for i in range(60):
+        counts = page_counts(rnd)
+        site = "a.com" if i % 3 else "b.com"
+        result = helpers.insert_wordlist(counts.most_common(), PlainKey(), database, site=site)
+        assert result == [None, "record : %d" % min(len(counts), helpers.MAX_LIST_RECORD)]
+        totals.update(dict(counts.most_common(helpers.MAX_LIST_RECORD)))
+        sites[site].update(dict(counts.most_common(helpers.MAX_LIST_RECORD)))
+
+    for site, expected in [(None, totals)] + list(sites.items()):
+        top = helpers.get_top_words(site, 50, database)
+        # The words tied with others may differ, not their frequencies
+        assert [frequency for _, frequency in top] == [frequency for _, frequency in expected.most_common(50)]
+        assert all(expected[word] == frequency for word, frequency in top)
+    size = database.squery("SELECT COUNT(*) FROM topwords WHERE site_id=0")[0]
+    assert schema.TOPWORDS_SIZE <= size < schema.TOPWORDS_SIZE + 20
+
+
+def test_page_stored_once(database):
+    rnd = random.Random(1)
+    counts = page_counts(rnd)
+    fingerprint = simhash(counts)
+    assert helpers.insert_wordlist(counts.most_common(), PlainKey(), database, page="http://a.com/1",
+                                   fingerprint=fingerprint)[1] == "record : %d" % len(counts)
+    again = helpers.insert_wordlist(counts.most_common(), PlainKey(), database, page="http://a.com/1",
+                                    fingerprint=fingerprint)
+    assert again == [None, "record : 0", "duplicate of : http://a.com/1"]
+
+    # A print view: one more word, a fingerprint a few bits away
+    near = counts.copy()
+    near[u"print"] += 1
+    assert helpers.insert_wordlist(near.most_common(), PlainKey(), database, page="http://a.com/1?print=1",
+                                   fingerprint=simhash(near))[2] == "duplicate of : http://a.com/1"
+
+    stored = database.squery("SELECT SUM(frequency) FROM wordlist")[0]
+    assert stored == sum(counts.values())
+
+
+def test_long_words_not_stored(database):
+    counts = Counter({u"short": 3, u"x" * schema.MAX_WORD_LENGTH: 2, u"y" * (schema.MAX_WORD_LENGTH + 1): 1})
+    result = helpers.insert_wordlist(counts.most_common(), PlainKey(), database, site="a.com")
+    assert result == [None, "record : 2"]
+    assert sorted(word for word, _ in helpers.get_top_words(None, 10, database)) == [u"short", u"x" * schema.MAX_WORD_LENGTH]
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Charset of the pages without one in the Content-Type header
+"""
+import codecs
+
+from components.textextract import iter_visible_text
+from components.textextract import SNIFF_SIZE
+from components.textextract import visible_text
+
+CAFE = u"café crème"
+
+
+def page(head, encoding):
+    return (u"<html><head>%s<title>t</title></head><body><p>%s</p></body></html>" % (head, CAFE)).encode(encoding)
+
+
+def in_chunks(body, size):
+    return [body[i:i + size] for i in range(0, len(body), size)]
+
+
+def test_meta_charset():
+    body = page(u'<meta charset="iso-8859-1">', 'latin-1')
+    assert visible_text(body) == CAFE
+    # The declaration split over chunks smaller than it
+    assert list(iter_visible_text(in_chunks(body, 7))) == [CAFE]
+
+
+def test_meta_http_equiv():
+    body = page(u'<meta http-equiv="Content-Type" content="text/html; charset=windows-1252">', 'cp1252')
+    assert visible_text(body) == CAFE
+
+
+def test_header_charset_wins_over_meta():
+    body = page(u'<meta charset="iso-8859-1">', 'utf-8')
+    assert visible_text(body, 'utf-8') == CAFE
+
+
+def test_bom():
+    body = codecs.BOM_UTF16_LE + page(u"", 'utf-16-le')
+    # The BOM wins over the header
+    assert visible_text(body, 'iso-8859-1') == CAFE
+    assert visible_text(codecs.BOM_UTF8 + page(u"", 'utf-8')) == CAFE
+
+
+def test_declared_past_sniff_size_not_used():
+    body = page(u"<!--%s--><meta charset=\"iso-8859-1\">" % (u"x" * SNIFF_SIZE), 'latin-1')
+    assert visible_text(body) == u"caf� cr�me"
+
+
+def test_unknown_charset_falls_back_to_utf8():
+    body = page(u'<meta charset="no-such-charset">', 'utf-8')
+    assert visible_text(body) == CAFE
+
+
+def test_unicode_chunks():
+    assert visible_text(page(u'<meta charset="iso-8859-1">', 'utf-8').decode('utf-8')) == CAFE
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Words of the visible text and their counts
+"""
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from components.tokenizer import StopwordSet
+from components.tokenizer import count_tokens
+from components.tokenizer import count_tokens_parallel
+from components.tokenizer import get_stopwords
+from components.tokenizer import split_text
+from components.tokenizer import tokenize
+
+TEXT = u"The quick brown fox jumps over the lazy dog near the river bank. "
+
+
+def test_tokenize():
+    assert tokenize(u"Don't STOP, “well-known” café_bar 42!") == [u"don't", u"stop", u"well", u"known", u"café",
+                                                                  u"bar", u"42"]
+    # NFKC then case folded
+    assert tokenize(u"ﬁne ＷＯＲＤ") == [u"fine", u"word"]
+
+
+def test_count_tokens_drops_stopwords():
+    stopwords = StopwordSet('xx', [u"The", u"over"])
+    counts = count_tokens([TEXT, TEXT], stopwords)
+    assert counts[u"fox"] == 2
+    assert u"the" not in counts and u"over" not in counts
+    assert sum(counts.values()) == 2 * 9
+
+
+def test_default_stopwords():
+    stopwords = get_stopwords()
+    assert u"the" in stopwords
+    assert count_tokens([TEXT], stopwords) == Counter(
+        w for w in tokenize(TEXT) if w not in stopwords.words)
+
+
+def test_split_text_keeps_words():
+    texts = [TEXT] * 50
+    chunks = list(split_text(texts, chunk_size=200))
+    assert len(chunks) > 1
+    assert max(len(chunk) for chunk in chunks) < 200 + len(TEXT)
+    assert Counter(tokenize(u" ".join(chunks))) == Counter(tokenize(u" ".join(texts)))
+
+
+def test_count_tokens_parallel_same_counts():
+    texts = [TEXT + u"word%d " % i for i in range(500)]
+    stopwords = get_stopwords()
+    executor = ThreadPoolExecutor(max_workers=2)
+    try:
+        parallel = count_tokens_parallel(texts, stopwords, executor=executor, chunk_size=1000)
+    finally:
+        executor.shutdown()
+    assert parallel == count_tokens(texts, stopwords)